@@ -0,0 +1,82 @@
+from bridgekeeper import perms
+from bridgekeeper.rules import UNIVERSAL, EMPTY
+from django.db.models import BooleanField, Exists, OuterRef, Value
+
+from autographql.auth.utils import VIEW, UPDATE, DELETE, get_model_permission, get_rule_query
+
+# Annotation holding the decision of a permission for a user, by permission type and user pk
+PERMISSION_ANNOTATION_PREFIX = '_permission_'
+PERMISSION_ANNOTATION = PERMISSION_ANNOTATION_PREFIX + '{0}_{1}'
+
+# Generated boolean fields of the object types and the permission type they resolve
+PERMISSION_FIELDS = {
+    'can_view': VIEW,
+    'can_update': UPDATE,
+    'can_delete': DELETE,
+}
+
+# Attribute of the resolvers of the permission fields holding their permission type
+PERMISSION_TYPE_ATTRIBUTE = 'permission_type'
+
+
+def get_permission_annotation_name(user, type):
+    return PERMISSION_ANNOTATION.format(type, user.pk)
+
+
+def get_permission_annotation(user, model, type):
+    """
+    Returns the expression computing the permission of the user for a row, None if it can only
+    be checked on the instance
+    """
+    permission = get_model_permission(model, type)
+    if user.is_superuser or permission not in perms:
+        # Answered by the auth backends without any query
+        return None
+
+    query = get_rule_query(user, permission)
+    if query is UNIVERSAL or query is EMPTY:
+        return Value(query is UNIVERSAL, output_field=BooleanField())
+    return Exists(model._base_manager.filter(query, pk=OuterRef('pk')))
+
+
+def annotate_permissions(queryset, user, types):
+    """Annotates every row of the queryset with the decisions of the permission types for the user"""
+    annotations = {}
+    for type in types:
+        annotation = get_permission_annotation(user, queryset.model, type)
+        if annotation is not None:
+            annotations[get_permission_annotation_name(user, type)] = annotation
+    if not annotations:
+        return queryset
+    return queryset.annotate(**annotations)
+
+
+def has_model_perm(user, type, instance):
+    """
+    Checks the permission of the user for the instance, the annotation computed by the query
+    that loaded the instance is used when there is one
+    """
+    decision = getattr(instance, get_permission_annotation_name(user, type), None)
+    if decision is not None:
+        return bool(decision)
+    return user.has_perm(get_model_permission(instance._meta.model, type), instance)
+
+
+def get_permission_resolver(type):
+    def resolve_permission(root, info):
+        return has_model_perm(info.context.user, type, root)
+
+    setattr(resolve_permission, PERMISSION_TYPE_ATTRIBUTE, type)
+    return resolve_permission
+
+
+def get_permission_type(resolver):
+    """Returns the permission type a field resolver computes, None if it is not a permission field"""
+    return getattr(resolver, PERMISSION_TYPE_ATTRIBUTE, None)
+
+
+def clear_permission_annotations(instance):
+    """Drops the decisions loaded with the instance, they are stale once the instance is changed"""
+    for name in list(vars(instance)):
+        if name.startswith(PERMISSION_ANNOTATION_PREFIX):
+            delattr(instance, name)
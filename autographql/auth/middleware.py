@@ -1,20 +1,152 @@
 import logging
 
 from bridgekeeper import perms
+from bridgekeeper.rules import UNIVERSAL, EMPTY
 from django.core.exceptions import PermissionDenied
-from django.db.models import Model
+from django.db.models import Model, QuerySet
+from django.db.models.query import ModelIterable
 from graphene import Connection
+from graphql import OperationType, get_named_type, is_leaf_type
 
-from autographql.auth.utils import VIEW, get_model_permission
+from autographql.auth.utils import VIEW, get_model_permission, get_rule_query, is_possible_for
 from autographql.auth.constants import PERMISSION_DENIED_MESSAGE
+from autographql.cache import get_request_cache
+from autographql.managers import is_viewable_by, get_viewable_by
 
 logger = logging.getLogger(__name__)
 
 
+class PermissionCache(object):
+    """
+    Request scoped permission decisions by (user, permission, model, pk), an instance
+    reached through several fields of the same query is only checked once
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._decisions = {}
+
+    def has_perm(self, user, permission, instance):
+        if instance.pk is None:
+            # Unsaved instances have no identity to cache the decision by
+            return user.has_perm(permission, instance)
+
+        key = (user.pk, permission, instance._meta.model, instance.pk)
+        try:
+            decision = self._decisions[key]
+        except KeyError:
+            self.misses += 1
+            decision = self._decisions[key] = user.has_perm(permission, instance)
+        else:
+            self.hits += 1
+        return decision
+
+    def has_perms(self, user, permission, instances):
+        """Returns the instances the user has the permission for, the uncached ones are checked in bulk"""
+        unchecked = [
+            instance for instance in instances
+            if instance.pk is None or (user.pk, permission, instance._meta.model, instance.pk) not in self._decisions
+        ]
+        self.hits += len(instances) - len(unchecked)
+        self.misses += len(unchecked)
+
+        allowed = set(id(instance) for instance in get_allowed_instances(user, permission, unchecked))
+        for instance in unchecked:
+            if instance.pk is not None:
+                key = (user.pk, permission, instance._meta.model, instance.pk)
+                self._decisions[key] = id(instance) in allowed
+
+        return [
+            instance for instance in instances
+            if id(instance) in allowed
+            or (instance.pk is not None and self._decisions[(user.pk, permission, instance._meta.model, instance.pk)])
+        ]
+
+    def clear(self):
+        self._decisions.clear()
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._decisions),
+            'ratio': round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+def get_allowed_instances(user, permission, instances):
+    """
+    Returns the instances the user has the permission for. Bridgekeeper rules are checked for all
+    the instances of a model with one pk__in query filtered by the rule instead of one check per instance
+    """
+    if user.is_superuser:
+        return list(instances)
+    if permission not in perms:
+        # Only the django auth chain knows about this permission
+        return [instance for instance in instances if user.has_perm(permission, instance)]
+
+    rule = perms[permission]
+    pks = {}
+    allowed = []
+    for instance in instances:
+        if instance.pk is None:
+            # Unsaved instances can not be queried
+            if rule.check(user, instance):
+                allowed.append(instance)
+        else:
+            pks.setdefault(instance._meta.model, set()).add(instance.pk)
+
+    query = get_rule_query(user, permission)
+    allowed_pks = set()
+    for model, model_pks in pks.items():
+        if query is EMPTY:
+            break
+        queryset = model._base_manager.filter(pk__in=model_pks)
+        if query is not UNIVERSAL:
+            queryset = queryset.filter(query)
+        allowed_pks.update((model, pk) for pk in queryset.values_list('pk', flat=True))
+
+    allowed.extend(
+        instance for instance in instances
+        if instance.pk is not None and (instance._meta.model, instance.pk) in allowed_pks
+    )
+    return allowed
+
+
+def get_permission_cache(context, create=True):
+    request_cache = get_request_cache(context, 'permissions')
+    if 'cache' not in request_cache and create:
+        request_cache['cache'] = PermissionCache()
+    return request_cache.get('cache')
+
+
+def is_checked_type(return_type):
+    """Checks if values of the graphql type can be model instances, lists of them or connections"""
+    return not is_leaf_type(get_named_type(return_type))
+
+
 class AuthorizationMiddleware(object):
+    # Result of is_checked_type by field return type, the types live as long as the schema
+    checked_types = {}
+
     def resolve(self, next, root, info, **args):
+        checked = self.checked_types.get(info.return_type)
+        if checked is None:
+            checked = self.checked_types[info.return_type] = is_checked_type(info.return_type)
+
+        if not checked and info.path.prev is not None:
+            # Scalars and enums, nothing to check
+            return next(root, info, **args)
+
         instance = next(root, info, **args)
 
+        if info.path.prev is None and info.operation.operation == OperationType.MUTATION:
+            # Rows may have been changed by the mutation, decisions made before it are stale
+            permission_cache = get_permission_cache(info.context, create=False)
+            if permission_cache is not None:
+                permission_cache.clear()
+
         if info.context.user.is_superuser:
             # Superusers have all permissions
             return instance
@@ -24,29 +156,67 @@ class AuthorizationMiddleware(object):
 
         # If model, check user has permission to access this model instance
         if isinstance(value, Model):
+            if is_viewable_by(value, user):
+                # Loaded by a queryset that was filtered by the view rule of the user
+                return instance
+
             # Check access permissions
             permission = get_model_permission(value._meta.model, VIEW)
-            logger.debug('Checking permission {0} for user [{1}] to access instance'.format(permission, user))
-            if not user.has_perm(permission, value):
-                logger.debug('Permission denied for user [{0}] to instance'.format(user))
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                logger.debug('Checking permission {0} for user [{1}] to access instance'.format(permission, user))
+            if not get_permission_cache(info.context).has_perm(user, permission, value):
+                if debug:
+                    logger.debug('Permission denied for user [{0}] to instance'.format(user))
                 raise PermissionDenied(PERMISSION_DENIED_MESSAGE)
 
+        # List field, drop the instances the user is not allowed to see
+        elif isinstance(value, (list, tuple, QuerySet)):
+            instance = self.check_list(info, user, value)
+
         # Connection field, check user has permissions to list this model's instances
         elif isinstance(value, Connection):
             # Make sure it has a model meta on the type. If it doesn't probably not a django connection
             if hasattr(value._meta.node._meta, 'model'):
                 model = value._meta.node._meta.model
                 permission = get_model_permission(model, VIEW)
-                logger.debug('Checking permission {0} for user [{1}] to list [{2}]'.format(permission, user, value))
+                debug = logger.isEnabledFor(logging.DEBUG)
+                if debug:
+                    logger.debug('Checking permission {0} for user [{1}] to list [{2}]'.format(permission, user, value))
 
                 # Check bridgekeeper first for possible permissions
-                if permission in perms and perms[permission].is_possible_for(user):
+                if is_possible_for(user, permission):
                     pass
                 # Check against django auth chain
                 elif user.has_perm(permission):
                     pass
                 else:
-                    logger.debug('Permission denied for user [{0}] to list [{1}]'.format(user, value))
+                    if debug:
+                        logger.debug('Permission denied for user [{0}] to list [{1}]'.format(user, value))
                     raise PermissionDenied(PERMISSION_DENIED_MESSAGE)
 
         return instance
+
+    def check_list(self, info, user, value):
+        """Checks all the instances of a list at once, rows of querysets filtered for the user are trusted"""
+        if isinstance(value, QuerySet):
+            if get_viewable_by(value) == user.pk or not issubclass(value._iterable_class, ModelIterable):
+                return value
+
+        instances = [item for item in value if isinstance(item, Model) and not is_viewable_by(item, user)]
+        if not instances:
+            return value
+
+        permission_cache = get_permission_cache(info.context)
+        denied = set(id(item) for item in instances)
+        for model in set(item._meta.model for item in instances):
+            permission = get_model_permission(model, VIEW)
+            model_instances = [item for item in instances if item._meta.model is model]
+            denied.difference_update(id(item) for item in permission_cache.has_perms(user, permission, model_instances))
+
+        if not denied:
+            return value
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Permission denied for user [{0}] to {1} instances of list'.format(user, len(denied)))
+        return [item for item in value if id(item) not in denied]
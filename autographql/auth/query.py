@@ -1,10 +1,15 @@
 from bridgekeeper import perms
-from bridgekeeper.rules import BinaryCompositeRule, Attribute, Relation, ManyRelation
+from bridgekeeper.rules import BinaryCompositeRule, Attribute, Relation, ManyRelation, Not, Is, In, blanket_rule, \
+    always_allow, UNIVERSAL, EMPTY
 from django.core.exceptions import FieldDoesNotExist
 from django.db.models import Prefetch
+from django.db.models.constants import LOOKUP_SEP
 from django.db.models.fields.related import ForeignKey
 
-from autographql.auth.utils import get_model_permission, VIEW
+from autographql.auth.rules import ManyRelation as AnnotatedManyRelation, get_accessor_name
+from autographql.auth.utils import get_model_permission, get_rule_query, VIEW
+from autographql.managers import get_viewable_by
+from autographql.optimizer.utils import get_prefetch_to
 
 
 class AuthQueryOptimizer(object):
@@ -13,6 +18,14 @@ class AuthQueryOptimizer(object):
         self.user = info.context.user
 
     def optimize(self, queryset):
+        if self.user.is_superuser:
+            # Superusers are never checked
+            return queryset
+
+        if get_viewable_by(queryset) == self.user.pk:
+            # Rows were filtered by the rule, they are not checked again
+            return queryset
+
         permission = get_model_permission(queryset.model, VIEW)
         if permission not in perms:
             # Nothing to optimize
@@ -31,20 +44,142 @@ class AuthQueryOptimizer(object):
     def get_queryset(self, model):
         return model.objects.for_user(self.user)
 
-    def optimize_queryset_rule(self, queryset, store, rule):
-        """Recursive helper to process rule tree"""
+    def get_join_rule(self, model):
+        """
+        Returns the rule a row of model joined into another query has to be checked with,
+        always_allow if every row is visible and None if the rows can only be filtered with a separate query
+        """
+        if self.user.is_superuser:
+            return always_allow
+
+        permission = get_model_permission(model, VIEW)
+        if permission not in perms:
+            return always_allow
+
+        rule = perms[permission]
+        q = get_rule_query(self.user, permission)
+        if q is UNIVERSAL:
+            return always_allow
+        if q is EMPTY or not self.is_row_rule(model, rule):
+            return None
+        return rule
+
+    def get_only_fields(self, model):
+        """
+        Returns the fields of model that the view rule reads when an instance is checked,
+        None if the rule may read fields that can not be determined
+        """
+        if self.user.is_superuser:
+            # Superusers are never checked
+            return []
+
+        permission = get_model_permission(model, VIEW)
+        if permission not in perms:
+            return []
+
+        return self.get_rule_fields(model, perms[permission])
+
+    def get_rule_fields(self, model, rule):
+        """Recursive helper to collect the fields read by the rule tree"""
+        if isinstance(rule, BinaryCompositeRule):
+            left = self.get_rule_fields(model, rule.left)
+            right = self.get_rule_fields(model, rule.right)
+            if left is None or right is None:
+                return None
+            return left + right
+        if isinstance(rule, Not):
+            return self.get_rule_fields(model, rule.base)
+        if isinstance(rule, (blanket_rule, Is, In, ManyRelation)):
+            # Only the primary key is read, it is always loaded
+            return []
+        if isinstance(rule, (Attribute, Relation)):
+            model_field = self.get_model_field_from_name(model, rule.attr)
+            if model_field is None or not model_field.concrete:
+                return None
+            if isinstance(rule, Relation) and self.is_join_rule(model, rule):
+                # Joined, the columns read by the nested rule are loaded with it
+                related_fields = self.get_rule_fields(model_field.related_model, rule.rule)
+                if related_fields is None:
+                    return None
+                return [rule.attr] + [rule.attr + LOOKUP_SEP + field for field in related_fields]
+            return [rule.attr]
+        return None
+
+    def is_row_rule(self, model, rule):
+        """Checks if the rule can be evaluated on the columns of a single row, without any queries"""
+        if isinstance(rule, BinaryCompositeRule):
+            return self.is_row_rule(model, rule.left) and self.is_row_rule(model, rule.right)
+        if isinstance(rule, Not):
+            return self.is_row_rule(model, rule.base)
+        if isinstance(rule, (blanket_rule, Is)):
+            return True
+        if isinstance(rule, Attribute):
+            model_field = self.get_model_field_from_name(model, rule.attr)
+            if model_field is None or not model_field.concrete:
+                return False
+            # Related objects would be loaded by the check
+            return not model_field.is_relation or rule.attr == model_field.attname
+        return False
+
+    def is_join_rule(self, model, rule):
+        """Checks if the rule can be evaluated on a row and its forward relations joined into the same query"""
+        if isinstance(rule, BinaryCompositeRule):
+            return self.is_join_rule(model, rule.left) and self.is_join_rule(model, rule.right)
+        if isinstance(rule, Not):
+            return self.is_join_rule(model, rule.base)
+        if isinstance(rule, (blanket_rule, Is)):
+            return True
+        if isinstance(rule, (Attribute, Relation)):
+            model_field = self.get_model_field_from_name(model, rule.attr)
+            if model_field is None or not model_field.concrete:
+                return False
+            if isinstance(rule, Attribute):
+                return True
+            if not (model_field.many_to_one or model_field.one_to_one):
+                return False
+            return self.is_join_rule(model_field.related_model, rule.rule)
+        return False
+
+    def is_prefetched(self, queryset, path):
+        """Checks if the relation is prefetched by the queryset, a joined relation would not be prefetched again"""
+        return any(get_prefetch_to(lookup) == path for lookup in queryset._prefetch_related_lookups)
+
+    def optimize_queryset_rule(self, queryset, store, rule, model=None, prefix=''):
+        """Recursive helper to process rule tree, prefix is the path of the joined relation model belongs to"""
+        if model is None:
+            model = queryset.model
+
         # BinaryCompositeRule
         if isinstance(rule, BinaryCompositeRule):
             # Left and right, recursive call
-            queryset = self.optimize_queryset_rule(queryset, store, rule.left)
-            queryset = self.optimize_queryset_rule(queryset, store, rule.right)
+            queryset = self.optimize_queryset_rule(queryset, store, rule.left, model, prefix)
+            queryset = self.optimize_queryset_rule(queryset, store, rule.right, model, prefix)
+
+        elif isinstance(rule, Not):
+            queryset = self.optimize_queryset_rule(queryset, store, rule.base, model, prefix)
+
+        # Forward relation rule, the related row is joined and checked with the same query
+        elif (
+            isinstance(rule, Relation)
+            and self.is_join_rule(model, rule)
+            and not self.is_prefetched(queryset, prefix + rule.attr)
+        ):
+            model_field = self.get_model_field_from_name(model, rule.attr)
+            store.select_related(prefix + rule.attr)
+            queryset = self.optimize_queryset_rule(
+                queryset,
+                store,
+                rule.rule,
+                model_field.related_model,
+                prefix + rule.attr + LOOKUP_SEP,
+            )
 
         # Relation rule
         elif isinstance(rule, Relation):
-            model_field = self.get_model_field_from_name(queryset.model, rule.attr)
+            model_field = self.get_model_field_from_name(model, rule.attr)
             queryset = queryset.prefetch_related(
                 Prefetch(
-                    rule.attr,
+                    prefix + rule.attr,
                     queryset=self.optimize_queryset(
                         self.get_queryset(model_field.related_model),
                         rule.rule,
@@ -52,13 +187,17 @@ class AuthQueryOptimizer(object):
                 )
             )
 
+        # ManyRelation rule that can be answered by an annotation of the rows
+        elif isinstance(rule, AnnotatedManyRelation) and not prefix:
+            queryset = rule.annotate(self.user, queryset)
+
         # ManyRelation rule
         elif isinstance(rule, ManyRelation):
-            attr = queryset.model.__class__._meta.get_field(rule.query_attr,).get_accessor_name()
-            model_field = self.get_model_field_from_name(queryset.model, attr)
+            attr = get_accessor_name(model, rule.query_attr)
+            model_field = self.get_model_field_from_name(model, attr)
             queryset = queryset.prefetch_related(
                 Prefetch(
-                    attr,
+                    prefix + attr,
                     queryset=self.optimize_queryset(
                         self.get_queryset(model_field.related_model),
                         rule.rule,
@@ -68,8 +207,8 @@ class AuthQueryOptimizer(object):
 
         # Attribute rule
         elif isinstance(rule, Attribute):
-            model_field = self.get_model_field_from_name(queryset.model, rule.attr)
-            store.optimize_field(model_field, rule.attr)
+            model_field = self.get_model_field_from_name(model, rule.attr)
+            store.optimize_field(model_field, rule.attr, prefix)
 
         return queryset
     
@@ -102,23 +241,21 @@ class AuthQueryOptimizerStore(object):
         # Add the onlys to the queryset
         # .only overwrites old onlys so we need to pull the existing onlys from the queryset
         if len(self.only_list) > 0:
-            only_list = self.only_list
-            loaded_field_names = queryset.query.get_loaded_field_names()
-            if loaded_field_names:
-                only_list = list(loaded_field_names[queryset.model]) + only_list
-                queryset = queryset.only(*only_list)
+            field_names, defer = queryset.query.deferred_loading
+            if field_names and not defer:
+                queryset = queryset.only(*field_names, *self.only_list)
 
         return queryset
     
-    def optimize_field(self, model_field, field):
+    def optimize_field(self, model_field, field, prefix=''):
         if self._is_foreign_key_id(model_field, field):
-            self.only(field)
+            self.only(prefix + field)
             return True
         if model_field.many_to_one or model_field.one_to_one:
-            self.select_related(field)
+            self.select_related(prefix + field)
             return True
         if model_field.one_to_many or model_field.many_to_many:
-            self.prefetch_related(field)
+            self.prefetch_related(prefix + field)
             return True
         return False
 
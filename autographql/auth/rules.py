@@ -1,4 +1,17 @@
 from bridgekeeper.rules import Attribute, Is, Relation as _Relation, ManyRelation as _ManyRelation, UNIVERSAL, EMPTY
+from django.db.models import Exists, OuterRef, ForeignObjectRel
+
+# Annotation holding the result of a ManyRelation rule for a user, by rule id and user pk
+MANY_RELATION_ANNOTATION_PREFIX = '_many_relation_'
+MANY_RELATION_ANNOTATION = MANY_RELATION_ANNOTATION_PREFIX + '{0}_{1}'
+
+
+def get_accessor_name(model, query_attr):
+    """Name of the related manager of a many relation by the name it is filtered with"""
+    field = model._meta.get_field(query_attr)
+    if isinstance(field, ForeignObjectRel):
+        return field.get_accessor_name()
+    return field.name
 
 
 def is_rule(f):
@@ -19,10 +32,36 @@ class Relation(_Relation):
 
 
 class ManyRelation(_ManyRelation):
+    def get_annotation_name(self, user):
+        return MANY_RELATION_ANNOTATION.format(id(self), user.pk)
+
+    def annotate(self, user, queryset):
+        """
+        Annotates every row of the queryset with an exists subquery of the rule,
+        check reads the annotation instead of running one query per instance
+        """
+        related_q = self.rule.query(user)
+        if related_q is UNIVERSAL or related_q is EMPTY:
+            # Checked without any query
+            return queryset
+
+        subquery = queryset.model._base_manager.filter(self.query(user), pk=OuterRef('pk'))
+        return queryset.annotate(**{self.get_annotation_name(user): Exists(subquery)})
+
     def check(self, user, instance=None):
         if instance is None:
             return self.rule.check(user, None)
-        attr = instance.__class__._meta.get_field(self.query_attr,).get_accessor_name()
+
+        annotation = getattr(instance, self.get_annotation_name(user), None)
+        if annotation is not None:
+            return annotation
+
+        related_q = self.rule.query(user)
+        if related_q is UNIVERSAL or related_q is EMPTY:
+            # Like query, which does not require any related row
+            return related_q is UNIVERSAL
+
+        attr = get_accessor_name(instance.__class__, self.query_attr)
         related_manager = getattr(instance, attr)
 
         qs = related_manager.get_queryset()
@@ -33,7 +72,4 @@ class ManyRelation(_ManyRelation):
                     return True
             return False
 
-        related_q = self.rule.query(user)
-        if related_q is UNIVERSAL or related_q is EMPTY:
-            return related_q
         return related_manager.filter(related_q).exists()
@@ -1,6 +1,11 @@
+from bridgekeeper import perms
+
+from autographql.cache import LRUCache
+from autographql.settings import autographql_settings
+
 VIEW = 'view'
-CREATE = 'create',
-UPDATE = 'update',
+CREATE = 'create'
+UPDATE = 'update'
 DELETE = 'delete'
 
 permission_map = {
@@ -10,10 +15,123 @@ permission_map = {
     DELETE: '%(app_label)s.delete_%(model_name)s',
 }
 
+# Permission names by model and permission type, formatted once per model
+model_permissions = {}
+
 
 def get_model_permission(model, type):
+    try:
+        return model_permissions[(model, type)]
+    except KeyError:
+        pass
+
     kwargs = {
         'app_label': model._meta.app_label,
         'model_name': model._meta.model_name
     }
-    return permission_map[type] % kwargs
+    for permission_type, name in permission_map.items():
+        model_permissions[(model, permission_type)] = name % kwargs
+    return model_permissions[(model, type)]
+
+
+# Attribute of the user object holding the compiled rule queries of the user
+USER_QUERIES_ATTRIBUTE = '_autographql_rule_queries'
+
+# Compiled rule queries by user pk, shared by the requests of a user when USER_QUERY_CACHE_TIMEOUT is set
+user_queries_cache = LRUCache(
+    autographql_settings.USER_QUERY_CACHE_SIZE,
+    timeout=autographql_settings.USER_QUERY_CACHE_TIMEOUT,
+)
+
+
+def get_rule_query(user, permission):
+    """
+    Returns the Q object (or UNIVERSAL/EMPTY) the rule of the permission filters by for the user.
+    The queries are built once per user object, which lives as long as the request
+    """
+    queries = getattr(user, USER_QUERIES_ATTRIBUTE, None)
+    if queries is None:
+        queries = {}
+        if user_queries_cache.timeout:
+            shared_queries = user_queries_cache.get(user.pk)
+            if shared_queries is None:
+                user_queries_cache.set(user.pk, queries)
+            else:
+                queries = shared_queries
+
+        try:
+            setattr(user, USER_QUERIES_ATTRIBUTE, queries)
+        except AttributeError:
+            pass
+
+    try:
+        return queries[permission]
+    except KeyError:
+        query = queries[permission] = perms[permission].query(user)
+        return query
+
+
+# Attribute of the user object holding the is_possible_for results of the user
+USER_POSSIBLE_ATTRIBUTE = '_autographql_possible_permissions'
+
+# is_possible_for results by (permission, user pk, permission version of the user),
+# shared by the requests of a user when POSSIBLE_PERMISSION_CACHE_TIMEOUT is set
+possible_permissions_cache = LRUCache(
+    autographql_settings.POSSIBLE_PERMISSION_CACHE_SIZE,
+    timeout=autographql_settings.POSSIBLE_PERMISSION_CACHE_TIMEOUT,
+)
+
+# Permission version by user pk, bumped when the rule queries of the user are invalidated
+permission_versions = {}
+
+
+def is_possible_for(user, permission):
+    """
+    Checks if the user can satisfy the rule of the permission for any instance, False if the permission has no rule.
+    Results are kept on the user object, which lives as long as the request
+    """
+    if permission not in perms:
+        return False
+
+    possible = getattr(user, USER_POSSIBLE_ATTRIBUTE, None)
+    if possible is None:
+        possible = {}
+        try:
+            setattr(user, USER_POSSIBLE_ATTRIBUTE, possible)
+        except AttributeError:
+            pass
+
+    try:
+        return possible[permission]
+    except KeyError:
+        pass
+
+    key = (permission, user.pk, permission_versions.get(user.pk, 0))
+    result = possible_permissions_cache.get(key) if possible_permissions_cache.timeout else None
+    if result is None:
+        result = perms[permission].is_possible_for(user)
+        if possible_permissions_cache.timeout:
+            possible_permissions_cache.set(key, result)
+
+    possible[permission] = result
+    return result
+
+
+def invalidate_rule_queries(user=None):
+    """
+    Drops the compiled rule queries and is_possible_for results of the user, or of every user when no user is given.
+    Needed when data the rules read about the user changes, e.g. their groups
+    """
+    if user is None:
+        user_queries_cache.clear()
+        possible_permissions_cache.clear()
+        return
+
+    user_queries_cache.delete(user.pk)
+    # Shared results of the previous version are not read again and age out of the cache
+    permission_versions[user.pk] = permission_versions.get(user.pk, 0) + 1
+    for attribute in (USER_QUERIES_ATTRIBUTE, USER_POSSIBLE_ATTRIBUTE):
+        try:
+            delattr(user, attribute)
+        except AttributeError:
+            pass
@@ -0,0 +1,14 @@
+import timeit
+
+
+def run_benchmark(name, func, number=1000, repeat=5):
+    """Times func and returns the best and mean time of a single call in microseconds"""
+    times = timeit.repeat(func, number=number, repeat=repeat)
+    per_call = [t / number * 1e6 for t in times]
+    return {
+        'name': name,
+        'number': number,
+        'repeat': repeat,
+        'best_us': min(per_call),
+        'mean_us': sum(per_call) / len(per_call),
+    }
@@ -0,0 +1,204 @@
+"""
+Benchmarks of the cost of bridgekeeper rule shapes through the schema, on the northwind models of autographql.tests.
+The models are loaded into a throwaway test database that is destroyed afterwards
+"""
+import copy
+import timeit
+
+from bridgekeeper.rules import Attribute, always_allow
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from graphql_relay import to_global_id
+
+from autographql.auth.middleware import AuthorizationMiddleware
+from autographql.auth.rules import Relation, ManyRelation
+from autographql.auth.utils import VIEW, CREATE, UPDATE, DELETE, get_model_permission
+from autographql.instrumentation import QueryCollector
+
+LIST_QUERY = '''
+query {
+    listOrders(first: 20, orderBy: [{orderId: ASC}]) {
+        edges { node { orderId freight customer { companyName } employee { lastName } } }
+    }
+}
+'''
+
+NODE_QUERY = '''
+query ($id: ID!) {
+    orders(id: $id) { orderId freight customer { companyName } employee { lastName } }
+}
+'''
+
+CUSTOMERS_NODE_QUERY = '''
+query ($id: ID!) {
+    customers(id: $id) { customerId companyName }
+}
+'''
+
+UPDATE_QUERY = '''
+mutation ($input: UpdateOrderDetailsInput!) {
+    updateOrderDetails(input: $input) {
+        errors { field messages }
+        edge { node { quantity } }
+    }
+}
+'''
+
+CUSTOMERS_QUERY = '''
+query {
+    listCustomers(first: 20, orderBy: [{customerId: ASC}]) {
+        edges { node { customerId companyName } }
+    }
+}
+'''
+
+
+def get_cases(Orders, Customers, Employees):
+    """(name, model, view rule, list query, node query)"""
+    germany = Relation('customer', Attribute('country', 'Germany'))
+    vice_president = Relation('employee', Relation('reports_to', Attribute('title', 'Vice President, Sales')))
+    return [
+        ('attribute', Orders, Attribute('ship_via_id', 3), LIST_QUERY, NODE_QUERY),
+        ('relation', Orders, germany, LIST_QUERY, NODE_QUERY),
+        ('nested relation', Orders, vice_president, LIST_QUERY, NODE_QUERY),
+        (
+            'many relation', Customers, ManyRelation('orders', Attribute('ship_via_id', 3)),
+            CUSTOMERS_QUERY, CUSTOMERS_NODE_QUERY,
+        ),
+        ('and', Orders, Attribute('ship_via_id', 3) & germany, LIST_QUERY, NODE_QUERY),
+        ('or', Orders, Attribute('ship_via_id', 1) | vice_president, LIST_QUERY, NODE_QUERY),
+    ]
+
+
+def get_detail_rule(model, rule):
+    """
+    Update rule of an order detail that applies the rule of a case to its order or to the customer of its order.
+    Order details are the only northwind model whose update mutation has an id input
+    """
+    if model.__name__ == 'Customers':
+        rule = Relation('customer', rule)
+    return Relation('order_id', rule)
+
+
+def measure(name, func, number, repeat):
+    """
+    Times func like run_benchmark and splits the time of a call into the time spent
+    executing sql and the python time of the package
+    """
+    collector = QueryCollector()
+    times = []
+    with collector.collect():
+        for _ in range(repeat):
+            times.append(timeit.timeit(func, number=number))
+
+    per_call = [t / number * 1e6 for t in times]
+    calls = number * repeat
+    sql_us = sum(duration for path, sql, duration in collector.queries) / calls * 1e6
+    mean_us = sum(per_call) / len(per_call)
+    return {
+        'name': name,
+        'number': number,
+        'repeat': repeat,
+        'best_us': min(per_call),
+        'mean_us': mean_us,
+        'queries': len(collector.queries) / calls,
+        'sql_us': sql_us,
+        'python_us': mean_us - sql_us,
+    }
+
+
+class Runner(object):
+    def __init__(self, schema, user):
+        self.schema = schema
+        self.user = user
+
+    def get_user(self):
+        # A user object per request, like the one the authentication middleware loads
+        return copy.copy(self.user)
+
+    def execute(self, query, variables=None):
+        request = RequestFactory().post('/graphql')
+        request.user = self.get_user()
+        result = self.schema.execute(
+            query,
+            context_value=request,
+            variable_values=variables,
+            middleware=[AuthorizationMiddleware()],
+        )
+        if result.errors:
+            raise RuntimeError('Benchmark query failed: {0}'.format(result.errors))
+        return result
+
+    def update(self, detail):
+        """Update mutation of an order detail, rolled back so every call updates the same row"""
+        variables = {'input': {
+            'id': to_global_id('OrderDetails', detail.pk),
+            'orderId': to_global_id('Orders', detail.order_id_id),
+            'productId': to_global_id('Products', detail.product_id_id),
+            'quantity': detail.quantity + 1,
+        }}
+        with transaction.atomic():
+            result = self.execute(UPDATE_QUERY, variables)
+            transaction.set_rollback(True)
+        errors = result.data['updateOrderDetails']['errors']
+        if errors:
+            raise RuntimeError('Benchmark mutation failed: {0}'.format(errors))
+        return result
+
+
+def run_cases(number, repeat):
+    from autographql.schema import SchemaGenerator
+    from autographql.tests.models import Orders, OrderDetails, Customers, Employees, Products
+    from autographql.tests.utils import load_northwind, set_permissions
+
+    load_northwind()
+    # Built again, the northwind models may have been registered after the default schema
+    schema = SchemaGenerator.get_schema()
+    runner = Runner(schema, get_user_model().objects.create(username='autographql_benchmark'))
+
+    results = []
+    for name, model, rule, list_query, node_query in get_cases(Orders, Customers, Employees):
+        detail_rule = get_detail_rule(model, rule)
+        permissions = {
+            get_model_permission(model, VIEW): rule,
+            get_model_permission(OrderDetails, UPDATE): detail_rule,
+        }
+        # Every other row of the queries is visible
+        for related_model in (Orders, OrderDetails, Customers, Employees, Products):
+            for permission_type in (VIEW, CREATE, UPDATE, DELETE):
+                permissions.setdefault(get_model_permission(related_model, permission_type), always_allow)
+
+        # Restored when the case is done
+        previous = set_permissions(permissions)
+        try:
+            pk = model.objects.filter(rule.query(runner.user)).values_list('pk', flat=True).first()
+            detail = OrderDetails.objects.filter(detail_rule.query(runner.user)).first()
+
+            results.append(measure(
+                'authorization {0} list'.format(name), lambda: runner.execute(list_query), number, repeat))
+            results.append(measure(
+                'authorization {0} node'.format(name),
+                lambda: runner.execute(node_query, {'id': to_global_id(model.__name__, pk)}),
+                number, repeat,
+            ))
+            results.append(measure(
+                'authorization {0} mutation'.format(name), lambda: runner.update(detail), number, repeat))
+        finally:
+            set_permissions(previous)
+    return results
+
+
+def run(number=200, repeat=5):
+    # Registers the northwind models
+    import autographql.tests  # noqa: F401
+
+    # Each call executes a whole query, each timing runs fewer of them
+    number = max(number // 10, 1)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+    try:
+        results = run_cases(number, repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    return results
@@ -0,0 +1,116 @@
+"""
+Micro-benchmarks of the evaluation of where inputs on the northwind models of autographql.tests.
+The Q objects are never applied to a queryset, so no database is needed
+"""
+from types import SimpleNamespace
+
+from bridgekeeper import perms
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from graphene.types.enum import EnumMeta
+from graphql import coerce_input_value
+
+from autographql.auth.utils import VIEW, get_model_permission
+from autographql.benchmarks import run_benchmark
+from autographql.filters.fields import AND, OR, NOT, LogicalInputField
+from autographql.filters.types import AutoFilterInputObjectType, ModelAutoFilterInputObjectType
+
+# (name, where input of the orders list)
+CASES = [
+    ('one field', {'freight': {'gt': 100}}),
+    ('relations', {
+        'freight': {'gt': 100, 'lt': 200},
+        'customer': {'country': {'in': ['France', 'Germany']}, 'city': {'exact': 'Paris'}},
+        'employee': {'reportsTo': {'lastName': {'exact': 'Fuller'}}},
+    }),
+    ('logical', {
+        '_or': [{'freight': {'gt': 500}}, {'customer': {'city': {'exact': 'Paris'}}}] * 5,
+        '_not': [{'shipCity': {'istartswith': 'b'}}],
+    }),
+]
+
+
+def legacy_get_lookups(value, lookup_path, context):
+    """_get_lookups before the compiled lookup tables, kept as the baseline of the benchmarks"""
+    lookups = []
+    for field_name, field in value._meta.fields.items():
+        attr_value = getattr(value, field_name, None)
+        if not attr_value:
+            continue
+
+        if lookup_path:
+            cur_path = LOOKUP_SEP.join([lookup_path, field_name])
+        else:
+            cur_path = field_name
+
+        if value._is_scalar(field):
+            lookups.append((cur_path, attr_value))
+        elif isinstance(field.type, EnumMeta):
+            lookups.append((cur_path, attr_value.value))
+        elif isinstance(attr_value, AutoFilterInputObjectType):
+            lookups += legacy_get_lookups(attr_value, cur_path, context)
+        elif isinstance(field.type, LogicalInputField):
+            operator = field.type.get_operator()
+            operator_lookups = {operator: []}
+            for child in attr_value:
+                operator_lookups[operator] += legacy_get_lookups(child, lookup_path, context)
+            lookups.append(operator_lookups)
+
+    if lookups and isinstance(value, ModelAutoFilterInputObjectType):
+        permission = get_model_permission(value._meta.model, VIEW)
+        if not (permission in perms and perms[permission].is_possible_for(context.user)):
+            context.user.has_perm(permission)
+    return lookups
+
+
+def legacy_get_q_lookup_helper(lookup, operator=AND):
+    if isinstance(lookup, tuple):
+        return Q(**{lookup[0]: lookup[1]})
+
+    if isinstance(lookup, list) and len(lookup) >= 1:
+        result = None
+        for l in lookup:
+            r = legacy_get_q_lookup_helper(l)
+            if not result:
+                result = r
+            elif operator == AND:
+                result = result & r
+            elif operator == OR:
+                result = result | r
+        return result
+
+    if isinstance(lookup, dict) and lookup:
+        op, records = list(lookup.items())[0]
+        if op == NOT:
+            return ~legacy_get_q_lookup_helper(records)
+        return legacy_get_q_lookup_helper(records, op)
+
+
+def run(number=200, repeat=5):
+    import autographql.tests  # noqa: F401
+    from autographql.schema import SchemaGenerator
+    from autographql.tests.models import Orders
+    from graphene_django.registry import get_global_registry
+
+    schema = SchemaGenerator.get_schema()
+    filter_input_type = get_global_registry().get_type_for_model(Orders)._meta.filter_input_type
+    graphql_type = schema.graphql_schema.get_type(filter_input_type._meta.name)
+    context = SimpleNamespace(user=get_user_model()(pk=1, username='benchmark', is_superuser=True))
+
+    results = []
+    for name, where in CASES:
+        value = coerce_input_value(where, graphql_type)
+        legacy = run_benchmark(
+            'filters {0} legacy'.format(name),
+            lambda: legacy_get_q_lookup_helper(legacy_get_lookups(value, '', context)),
+            number * 10, repeat,
+        )
+        compiled = run_benchmark(
+            'filters {0} compiled'.format(name),
+            lambda: value.get_q_lookup(context=context),
+            number * 10, repeat,
+        )
+        compiled['speedup'] = legacy['best_us'] / compiled['best_us']
+        results += [legacy, compiled]
+    return results
@@ -0,0 +1,117 @@
+"""
+Micro-benchmarks of the per field overhead of AuthorizationMiddleware.
+Fields are resolved with stand-in resolve infos, so no database or schema is needed
+"""
+import logging
+from types import SimpleNamespace
+
+from bridgekeeper import perms
+from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
+from django.db.models import Model, QuerySet
+from django.utils.functional import SimpleLazyObject
+from graphene import Connection
+from graphql import GraphQLNonNull, GraphQLString, GraphQLObjectType, GraphQLField, OperationType
+
+from autographql.auth.constants import PERMISSION_DENIED_MESSAGE
+from autographql.auth.middleware import AuthorizationMiddleware, get_permission_cache
+from autographql.auth.utils import VIEW, get_model_permission
+from autographql.benchmarks import run_benchmark
+from autographql.managers import is_viewable_by, set_viewable_by
+
+logger = logging.getLogger(__name__)
+
+
+class LegacyAuthorizationMiddleware(AuthorizationMiddleware):
+    """AuthorizationMiddleware before the leaf field dispatch, kept as the baseline of the benchmarks"""
+    def resolve(self, next, root, info, **args):
+        instance = next(root, info, **args)
+
+        if info.path.prev is None and info.operation.operation == OperationType.MUTATION:
+            permission_cache = get_permission_cache(info.context, create=False)
+            if permission_cache is not None:
+                permission_cache.clear()
+
+        if info.context.user.is_superuser:
+            return instance
+
+        value = instance
+        user = info.context.user
+
+        if isinstance(value, Model):
+            if is_viewable_by(value, user):
+                return instance
+
+            permission = get_model_permission(value._meta.model, VIEW)
+            logger.debug('Checking permission {0} for user [{1}] to access instance'.format(permission, user))
+            if not get_permission_cache(info.context).has_perm(user, permission, value):
+                logger.debug('Permission denied for user [{0}] to instance'.format(user))
+                raise PermissionDenied(PERMISSION_DENIED_MESSAGE)
+
+        elif isinstance(value, (list, tuple, QuerySet)):
+            instance = self.check_list(info, user, value)
+
+        elif isinstance(value, Connection):
+            if hasattr(value._meta.node._meta, 'model'):
+                model = value._meta.node._meta.model
+                permission = get_model_permission(model, VIEW)
+                logger.debug('Checking permission {0} for user [{1}] to list [{2}]'.format(permission, user, value))
+                if not (permission in perms and perms[permission].is_possible_for(user)) \
+                        and not user.has_perm(permission):
+                    logger.debug('Permission denied for user [{0}] to list [{1}]'.format(user, value))
+                    raise PermissionDenied(PERMISSION_DENIED_MESSAGE)
+
+        return instance
+
+
+def build_info(user, return_type):
+    """
+    Resolve info of a field nested in a list, like the columns of the rows of a connection.
+    The user is lazy like request.user
+    """
+    return SimpleNamespace(
+        context=SimpleNamespace(user=SimpleLazyObject(lambda: user)),
+        path=SimpleNamespace(prev=SimpleNamespace(prev=None)),
+        operation=SimpleNamespace(operation=OperationType.QUERY),
+        return_type=return_type,
+    )
+
+
+def run(number=200, repeat=5):
+    model = get_user_model()
+    user = model(pk=1, username='benchmark')
+    superuser = model(pk=2, username='superuser', is_superuser=True)
+    row = model(pk=3, username='row')
+    set_viewable_by(row, user)
+
+    object_type = GraphQLObjectType('Row', {'id': GraphQLField(GraphQLString)})
+    # (name, user, return type, resolved value)
+    cases = [
+        ('leaf', user, GraphQLNonNull(GraphQLString), 'value'),
+        ('leaf superuser', superuser, GraphQLNonNull(GraphQLString), 'value'),
+        ('filtered instance', user, object_type, row),
+    ]
+
+    results = []
+    for name, case_user, return_type, value in cases:
+        info = build_info(case_user, return_type)
+
+        def resolver(root, info):
+            return value
+
+        legacy_middleware = LegacyAuthorizationMiddleware()
+        middleware = AuthorizationMiddleware()
+        # A single call takes well under a microsecond, each timing runs more of them
+        legacy = run_benchmark(
+            'middleware {0} legacy'.format(name),
+            lambda: legacy_middleware.resolve(resolver, None, info),
+            number * 100, repeat,
+        )
+        dispatch = run_benchmark(
+            'middleware {0} dispatch'.format(name),
+            lambda: middleware.resolve(resolver, None, info),
+            number * 100, repeat,
+        )
+        dispatch['speedup'] = legacy['best_us'] / dispatch['best_us']
+        results += [legacy, dispatch]
+    return results
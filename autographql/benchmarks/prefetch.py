@@ -0,0 +1,104 @@
+"""
+Micro-benchmarks of the prefetch merging done by the optimizer on every optimized queryset.
+The querysets are never evaluated, so no database is needed
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+
+from autographql.benchmarks import run_benchmark
+from autographql.optimizer.utils import combine_querysets
+
+
+def legacy_merge_querysets(queryset_list):
+    new_qs = None
+    for qs in queryset_list:
+        if new_qs is None:
+            new_qs = qs
+        else:
+            new_qs = new_qs & qs
+
+    return new_qs
+
+
+def legacy_combine_querysets(queryset_list):
+    """combine_querysets before the prefetch tree, kept as the baseline of the benchmarks"""
+    merged_queryset = legacy_merge_querysets(queryset_list)
+
+    prefetch_list = []
+    prefetch_map = {}
+
+    for queryset in queryset_list:
+        for prefetch in queryset._prefetch_related_lookups:
+            if isinstance(prefetch, str):
+                prefetch_list.append(prefetch)
+                continue
+
+            through = prefetch.prefetch_through
+            if through in prefetch_list:
+                prefetch_list = list(filter(lambda p: p != through, prefetch_list))
+
+            if through not in prefetch_map:
+                prefetch_map[through] = []
+
+            prefetch_map[through].append(prefetch.queryset)
+
+    if not prefetch_map.items():
+        return merged_queryset
+
+    for through, prefetch_querysets in prefetch_map.items():
+        prefetch_qs = legacy_combine_querysets(prefetch_querysets)
+        prefetch_list.append(Prefetch(through, queryset=prefetch_qs))
+
+    merged_queryset = merged_queryset.prefetch_related(None)
+    merged_queryset = merged_queryset.prefetch_related(*prefetch_list)
+
+    return merged_queryset
+
+
+def build_queryset(width, depth, duplicates, filtered):
+    """
+    Queryset with width prefetches on every level down to depth, each selection prefetch
+    is prefetched again by duplicates auth prefetches like the auth optimizer does.
+    Filtered auth prefetches stand for rules that restrict the rows, the others for universal rules
+    """
+    model = get_user_model()
+    queryset = model.objects.all()
+    if depth == 0:
+        return queryset
+
+    prefetch_list = []
+    for i in range(width):
+        lookup = 'relation_{0}'.format(i)
+        prefetch_list.append(Prefetch(lookup, queryset=build_queryset(width, depth - 1, duplicates, filtered)))
+        for _ in range(duplicates):
+            auth_queryset = model.objects.all()
+            if filtered:
+                auth_queryset = auth_queryset.filter(is_active=True)
+            prefetch_list.append(Prefetch(lookup, queryset=auth_queryset))
+    return queryset.prefetch_related(*prefetch_list)
+
+
+CASES = [
+    # (width, depth, duplicates, filtered)
+    (5, 1, 0, False),
+    (5, 2, 0, False),
+    (20, 1, 0, False),
+    (5, 2, 1, False),
+    (20, 1, 1, False),
+    (5, 2, 1, True),
+    (20, 1, 1, True),
+    (10, 2, 2, True),
+]
+
+
+def run(number=200, repeat=5):
+    results = []
+    for width, depth, duplicates, filtered in CASES:
+        queryset = build_queryset(width, depth, duplicates, filtered)
+        name = 'prefetch width={0} depth={1} duplicates={2}{3}'.format(
+            width, depth, duplicates, ' filtered' if filtered else '')
+        legacy = run_benchmark(name + ' legacy', lambda: legacy_combine_querysets([queryset]), number, repeat)
+        tree = run_benchmark(name + ' tree', lambda: combine_querysets([queryset]), number, repeat)
+        tree['speedup'] = legacy['best_us'] / tree['best_us']
+        results += [legacy, tree]
+    return results
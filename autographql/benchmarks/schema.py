@@ -0,0 +1,64 @@
+"""
+Benchmark of the schema build on the northwind models of autographql.tests.
+Every timing builds the schema in a new python process, types are cached for the life of a process
+"""
+import json
+import subprocess
+import sys
+
+BUILD_SCRIPT = '''
+import json
+import resource
+import time
+import tracemalloc
+
+import django
+
+tracemalloc.start()
+start = time.perf_counter()
+django.setup()
+import autographql.tests
+setup = time.perf_counter()
+setup_memory = tracemalloc.get_traced_memory()[0]
+# The schema is built when the module is imported
+from autographql.schema import schema
+end = time.perf_counter()
+current, peak = tracemalloc.get_traced_memory()
+type_map = schema.graphql_schema.type_map
+print(json.dumps({
+    'setup_us': (setup - start) * 1e6,
+    'build_us': (end - setup) * 1e6,
+    'types': len(type_map),
+    'filter_input_types': len([name for name in type_map if name.endswith('FilterInput')]),
+    'build_kb': (current - setup_memory) / 1024,
+    'peak_kb': peak / 1024,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+'''
+
+
+def build_schema():
+    """Builds the schema in a new process with the current django settings and returns its measurements"""
+    output = subprocess.run(
+        [sys.executable, '-c', BUILD_SCRIPT],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run(number=200, repeat=5):
+    # Each timing starts a python process, the number of calls is ignored
+    builds = [build_schema() for _ in range(repeat)]
+    build_times = [build['build_us'] for build in builds]
+    result = {
+        'name': 'schema build',
+        'number': 1,
+        'repeat': repeat,
+        'best_us': min(build_times),
+        'mean_us': sum(build_times) / len(build_times),
+    }
+    for key in ('types', 'filter_input_types', 'build_kb', 'peak_kb', 'max_rss_kb'):
+        result[key] = builds[-1][key]
+    return [result]
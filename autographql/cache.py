@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+REQUEST_CACHE_ATTRIBUTE = '_autographql_cache'
+
+
+class LRUCache(object):
+    """
+    Thread safe, bounded least recently used cache that keeps track of its hits and misses.
+    Entries expire after timeout seconds if a timeout is given
+    """
+    def __init__(self, maxsize, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            # Cache is disabled
+            return
+
+        expires = time.monotonic() + self.timeout if self.timeout else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_request_cache(context, name):
+    """
+    Returns a dictionary that lives as long as the request context.
+    If the context can not hold any attributes, a throwaway dictionary is returned
+    """
+    caches = getattr(context, REQUEST_CACHE_ATTRIBUTE, None)
+    if caches is None:
+        caches = {}
+        try:
+            setattr(context, REQUEST_CACHE_ATTRIBUTE, caches)
+        except AttributeError:
+            return {}
+
+    return caches.setdefault(name, {})
@@ -1,9 +1,15 @@
 from functools import partial
 
 import graphene
+from django.core.exceptions import ValidationError
 from django.db.models import Model, QuerySet
 from graphene import Field, Dynamic
 from graphene_django import DjangoObjectType, DjangoConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql_relay import cursor_to_offset, offset_to_cursor
+
+from autographql.loaders import get_batch_loader
+from autographql.pagination import connection_from_keyset, connection_from_offset
 
 
 class AutoDjangoConnectionField(DjangoConnectionField):
@@ -15,6 +21,33 @@ class AutoDjangoConnectionField(DjangoConnectionField):
         kwargs.setdefault('where', Dynamic(lambda: type_._meta.filter_input_type()))
         super().__init__(type_, *args, **kwargs)
 
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        """
+        Slices the queryset without counting it, the count is only needed
+        for last without before and is otherwise left to totalCount
+        """
+        iterable = maybe_queryset(iterable)
+        if not isinstance(iterable, QuerySet) or (args.get('last') is not None and not args.get('before')):
+            return super().resolve_connection(connection, args, iterable, max_limit=max_limit)
+
+        # Remove the offset parameter and convert it to an after cursor.
+        offset = args.pop('offset', None)
+        after = args.get('after')
+        if offset:
+            if after:
+                offset += cursor_to_offset(after) + 1
+            # input offset starts at 1 while the graphene offset starts at 0
+            args['after'] = offset_to_cursor(offset - 1)
+
+        # Impose the maximum limit via the `first` field if neither first or last are already provided
+        if max_limit is not None and args.get('first') is None and args.get('last') is None:
+            args['first'] = max_limit
+
+        connection = connection_from_offset(connection, iterable, args)
+        connection.iterable = iterable
+        return connection
+
 
 class OptimizedDjangoConnectionField(AutoDjangoConnectionField):
     """
@@ -28,11 +61,35 @@ class OptimizedDjangoConnectionField(AutoDjangoConnectionField):
         return qs
 
 
+class KeysetDjangoConnectionField(OptimizedDjangoConnectionField):
+    """
+    Optimized connection field that paginates with keyset cursors, the cursors hold the
+    values of the order_by columns and the pk of the row instead of an offset
+    """
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        if args.get('offset') is not None:
+            raise ValidationError('offset can not be used with keyset pagination, use after instead')
+
+        iterable = maybe_queryset(iterable)
+        if not isinstance(iterable, QuerySet):
+            return super().resolve_connection(connection, args, iterable, max_limit=max_limit)
+
+        # Impose the maximum limit via the `first` field if neither first or last are already provided
+        if max_limit is not None and args.get('first') is None and args.get('last') is None:
+            args['first'] = max_limit
+
+        connection = connection_from_keyset(connection, iterable, args)
+        connection.iterable = iterable
+        return connection
+
+
 class OptimizedField(Field):
     def resolve_optimized_field(self, parent_resolver, root, info, **args):
         if not issubclass(self.type, DjangoObjectType):
             return parent_resolver(root, info, **args)
 
+        attr_name = None
         if hasattr(parent_resolver, 'args'):
             attr_name = parent_resolver.args[0]
             value = getattr(root, attr_name)
@@ -41,6 +98,9 @@ class OptimizedField(Field):
 
         if isinstance(value, Model):
             # Model instance, need to use it to get new queryset
+            if attr_name is not None:
+                # Rows of the same list are loaded together
+                return get_batch_loader(info.context).load(self.type, info, args, attr_name, value)
             return self.type.get_optimized_queryset(info, args).get(pk=value.pk)
         elif isinstance(value, QuerySet):
             # Received queryset, optimize it
@@ -6,7 +6,7 @@ from django.db.models import lookups
 from django.db.models.functions import ExtractMonth, ExtractDay, ExtractWeekDay, ExtractIsoWeekDay, \
     ExtractWeek, ExtractQuarter, ExtractHour, ExtractMinute, ExtractSecond, TruncDate, TruncTime
 from graphene_django.converter import convert_django_field, convert_field_to_boolean, convert_field_to_string, \
-    get_django_field_description, convert_date_to_string, convert_time_to_string
+    convert_date_to_string, convert_time_to_string
 
 from autographql.filters.enums import WeekDay, IsoWeekDay
 
@@ -16,13 +16,11 @@ def get_lookup_name(lookup):
 
 
 def convert_lookup(converter, lookup, field):
+    # Lookup input types are shared by the fields of a class, the description is set on the field of the model
     converted = converter(field)
     cls = converted.__class__
     name = get_lookup_name(lookup)
-    return name, cls(
-        description=get_django_field_description(field),
-        required=False,
-    )
+    return name, cls(required=False)
 
 
 @singledispatch
@@ -37,7 +35,6 @@ def get_input_type_from_lookup(lookup, field):
 def convert_lookup_to_list_field_type(lookup, field):
     return get_lookup_name(lookup), graphene.List(
         of_type=convert_django_field(field).__class__,
-        description=get_django_field_description(field),
         required=False,
     )
 
@@ -1,28 +1,109 @@
 import logging
+from collections import Counter, OrderedDict
 from functools import partial
 from inspect import isclass
 
 import graphene
-from bridgekeeper import perms
-from django.core.exceptions import PermissionDenied, ImproperlyConfigured
-from django.db.models import Q, Transform, Lookup
+from django.core.exceptions import PermissionDenied, ImproperlyConfigured, FieldDoesNotExist
+from django.db.models import Q, Transform, Lookup, Exists, OuterRef, ForeignObjectRel, ManyToOneRel, Subquery, Value, \
+    Count, Sum, Avg, Min, Max, IntegerField, FloatField, DecimalField, BinaryField
 from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Coalesce
 from django.db.models.query_utils import RegisterLookupMixin
 from graphene import InputField, List, Dynamic
 from graphene.types.enum import EnumMeta
 from graphene.types.inputobjecttype import InputObjectTypeOptions
 from graphene.types.scalars import ScalarOptions
+from graphene_django.converter import get_django_field_description
 from graphene_django.registry import get_global_registry
 from graphene_django.utils import get_model_fields
 
-from autographql.auth.utils import get_model_permission, VIEW
+from autographql.auth.utils import get_model_permission, is_possible_for, VIEW
 from autographql.filters.converters import get_input_type_from_lookup
 from autographql.filters.fields import LogicalInputField, AND, OR, NOT, LogicalAndInputField, LogicalOrInputField, \
     LogicalNotInputField
-from autographql.utils import to_pascal_case
+from autographql.settings import autographql_settings
 
 logger = logging.getLogger(__name__)
 
+# Input types of the lookups of a field class or transform, shared by every model, by (class, lookups)
+lookup_input_types = {}
+# Number of lookup input types by type name
+lookup_input_type_names = Counter()
+
+# Kinds of the fields of a filter input
+LOOKUP_SCALAR = 'scalar'
+LOOKUP_ENUM = 'enum'
+LOOKUP_INPUT = 'input'
+LOOKUP_LOGICAL = 'logical'
+LOOKUP_RELATION = 'relation'
+LOOKUP_AGGREGATE = 'aggregate'
+
+# How filters through to many relations are applied: joined into the query or as exists subqueries
+TO_MANY_FILTERS_JOIN = 'join'
+TO_MANY_FILTERS_EXISTS = 'exists'
+TO_MANY_FILTERS_STRATEGIES = (TO_MANY_FILTERS_JOIN, TO_MANY_FILTERS_EXISTS)
+
+# Filters on aggregates of the rows of a to many relation, sum and avg only take numeric columns
+AGGREGATE_COUNT = '_count'
+AGGREGATE_FUNCTIONS = OrderedDict([
+    ('_sum', Sum),
+    ('_avg', Avg),
+    ('_min', Min),
+    ('_max', Max),
+])
+NUMERIC_AGGREGATES = ('_sum', '_avg')
+NUMERIC_FIELDS = (IntegerField, FloatField, DecimalField)
+AGGREGATE_ANNOTATION = '_aggregate{0}_{1}'
+
+
+def get_to_many_filters_strategy(model):
+    graphql_meta = getattr(model, '_graphql_meta', None)
+    strategy = getattr(getattr(graphql_meta, 'meta', None), 'to_many_filters', None)
+    if strategy is None:
+        strategy = autographql_settings.TO_MANY_FILTERS
+    if strategy not in TO_MANY_FILTERS_STRATEGIES:
+        raise RuntimeError('Invalid to many filters strategy {0} for {1}'.format(strategy, model))
+    return strategy
+
+
+def get_related_name(model_field):
+    """Name of the field of the related model of a to many relation that points back to the outer model"""
+    if isinstance(model_field, ForeignObjectRel):
+        # Reverse relation, the field is on the related model
+        return model_field.field.name
+    return model_field.related_query_name()
+
+
+def get_related_rows(model_field, lookup_path=''):
+    """
+    Queryset of the rows of the to many relation model_field that belong to the outer row,
+    lookup_path is the path of the model of the relation from the outer model
+    """
+    related_name = get_related_name(model_field)
+    if isinstance(model_field, ManyToOneRel):
+        outer_name = model_field.field.target_field.name
+    else:
+        outer_name = 'pk'
+    if lookup_path:
+        # Reached through forward relations of the outer model
+        outer_name = lookup_path + LOOKUP_SEP + outer_name
+
+    return model_field.related_model._base_manager.filter(**{related_name: OuterRef(outer_name)})
+
+
+def get_aggregate_columns(model, fields):
+    """Returns the columns of the model that can be aggregated and the numeric ones among them"""
+    columns = [
+        field for name, field in get_model_fields(model)
+        if name in fields.keys() and field.concrete and not field.is_relation
+        and not isinstance(field, BinaryField)
+    ]
+    numeric_columns = [
+        field for field in columns if isinstance(field, NUMERIC_FIELDS) and not field.primary_key
+    ]
+    return columns, numeric_columns
+
 
 def get_input_type(field):
     registry = get_global_registry()
@@ -31,6 +112,12 @@ def get_input_type(field):
     return model_type._meta.filter_input_type
 
 
+def get_relation_input_type(field):
+    registry = get_global_registry()
+    model_type = registry.get_type_for_model(field.related_model)
+    return model_type._meta.relation_filter_input_type
+
+
 class ModelAutoFilterInputObjectTypeOptions(InputObjectTypeOptions):
     model = None
 
@@ -45,22 +132,20 @@ class AutoFilterInputObjectType(graphene.InputObjectType):
         """Recursive helper to build the Q lookup"""
         # Base case, we have a tuple
         if isinstance(lookup, tuple):
-            args = {lookup[0]: lookup[1]}
-            return Q(**args)
+            return Q(lookup)
+
+        # Base case, boolean expression like an exists subquery
+        if hasattr(lookup, 'resolve_expression'):
+            return Q(lookup)
 
-        # We have a list, recur for each element and and them together
+        # We have a list, recur for each element and combine them with the operator in a single Q
         if isinstance(lookup, list) and len(lookup) >= 1:
-            result = None
-            for l in lookup:
-                r = self._get_q_lookup_helper(l)
-                if not result:
-                    result = r
-                else:
-                    if operator == AND:
-                        result = result & r
-                    elif operator == OR:
-                        result = result | r
-            return result
+            children = [q for q in (self._get_q_lookup_helper(l) for l in lookup) if q]
+            if not children:
+                return None
+            if len(children) == 1:
+                return children[0]
+            return Q(*children, _connector=Q.OR if operator == OR else Q.AND)
 
         # We have a dict, use the logical operator stored to process the result
         if isinstance(lookup, dict) and lookup:
@@ -71,7 +156,8 @@ class AutoFilterInputObjectType(graphene.InputObjectType):
             else:
                 return self._get_q_lookup_helper(records, op)
 
-    def _is_scalar(self, field):
+    @staticmethod
+    def _is_scalar(field):
         t = field.type
         if isinstance(t, List):
             t = t.of_type
@@ -80,46 +166,75 @@ class AutoFilterInputObjectType(graphene.InputObjectType):
             return True
         return False
 
+    @classmethod
+    def _get_lookup_table(cls):
+        """
+        Returns (kind, path suffix, model field) by field name. The kind of a field only depends on its type,
+        it is compiled the first time a value of the input type is read
+        """
+        table = cls.__dict__.get('_lookup_table')
+        if table is not None:
+            return table
+
+        table = {}
+        for field_name, field in cls._meta.fields.items():
+            field_type = field.type
+            if cls._is_scalar(field):
+                kind = LOOKUP_SCALAR
+            elif isinstance(field_type, EnumMeta):
+                kind = LOOKUP_ENUM
+            elif isinstance(field_type, LogicalInputField):
+                kind = LOOKUP_LOGICAL
+            elif isclass(field_type) and issubclass(field_type, AutoFilterInputObjectType):
+                kind = LOOKUP_INPUT
+            else:
+                kind = None
+            table[field_name] = (kind, LOOKUP_SEP + field_name, None)
+
+        # Set on the class of the values, the table of a parent input type is never reused
+        cls._lookup_table = cls._compile_lookup_table(table)
+        return cls._lookup_table
+
+    @classmethod
+    def _compile_lookup_table(cls, table):
+        """Hook to change the kinds of the fields of the table"""
+        return table
+
     def _get_lookups(self, lookup_path='', **kwargs):
-        """Helper function to build lookups"""
+        """Helper function to build lookups, only the fields that were set are visited"""
         lookups = []
-        for field_name, field in self._meta.fields.items():
-            attr_value = getattr(self, field_name, None)
-            if not attr_value:
-                # This filter is not set
+        table = self._get_lookup_table()
+        for field_name, attr_value in self.items():
+            kind, suffix, model_field = table[field_name]
+            if attr_value is None or (not attr_value and kind not in (LOOKUP_SCALAR, LOOKUP_ENUM)):
+                # This filter is not set, false and zero are values of scalar lookups
                 continue
 
-            if lookup_path:
-                cur_path = LOOKUP_SEP.join([lookup_path, field_name])
-            else:
-                cur_path = field_name
+            cur_path = lookup_path + suffix if lookup_path else field_name
 
-            if self._is_scalar(field):
+            if kind == LOOKUP_SCALAR:
                 # Base case, scalar value or list of scalar value
                 lookups.append((cur_path, attr_value))
-                continue
-
-            if isinstance(field.type, EnumMeta):
+            elif kind == LOOKUP_ENUM:
                 # Base case, enum type
                 lookups.append((cur_path, attr_value.value))
-                continue
-
-            if isinstance(attr_value, AutoFilterInputObjectType):
+            elif kind == LOOKUP_INPUT:
                 # Recursive call to get the lookups
-                child_lookups = attr_value._get_lookups(cur_path, **kwargs)
-                lookups += child_lookups
+                lookups += attr_value._get_lookups(cur_path, **kwargs)
+            elif kind == LOOKUP_RELATION:
+                # To many relation, joined or filtered by a subquery
+                lookups += self._get_relation_lookups(model_field, attr_value, lookup_path, cur_path, **kwargs)
+            elif kind == LOOKUP_AGGREGATE:
+                # Read by the filter of the to many relation
                 continue
-
-            if isinstance(field.type, LogicalInputField):
-                operator = field.type.get_operator()
+            elif kind == LOOKUP_LOGICAL:
+                operator = self._meta.fields[field_name].type.get_operator()
                 operator_lookups = {operator: []}
                 for child in attr_value:
-                    child_lookups = child._get_lookups(lookup_path, **kwargs)
-                    operator_lookups[operator] += child_lookups
+                    operator_lookups[operator] += child._get_lookups(lookup_path, **kwargs)
                 lookups.append(operator_lookups)
-                continue
-
-            raise RuntimeError('Unknown lookup field type found: {0}'.format(str(field.type)))
+            else:
+                raise RuntimeError('Unknown lookup field type found: {0}'.format(str(self._meta.fields[field_name].type)))
 
         return lookups
 
@@ -172,6 +287,61 @@ class ModelAutoFilterInputObjectType(AutoFilterInputObjectType):
 
         super().__init_subclass_with_meta__(_meta=_meta, **options)
 
+    @classmethod
+    def _compile_lookup_table(cls, table):
+        model = cls._meta.model
+        for field_name, (kind, suffix, model_field) in table.items():
+            if kind != LOOKUP_INPUT:
+                continue
+            try:
+                model_field = model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                continue
+            if model_field.one_to_many or model_field.many_to_many:
+                table[field_name] = (LOOKUP_RELATION, suffix, model_field)
+        return table
+
+    def _get_relation_lookups(self, model_field, value, lookup_path, cur_path, **kwargs):
+        """Lookups of the filter value of a to many relation"""
+        if isinstance(value, ModelAutoRelationFilterInputObjectType) and value.has_aggregates():
+            return [self._get_aggregate_lookup(model_field, value, lookup_path, **kwargs)]
+        if get_to_many_filters_strategy(self._meta.model) == TO_MANY_FILTERS_EXISTS:
+            return [self._get_exists_lookup(model_field, value, lookup_path, **kwargs)]
+        return value._get_lookups(cur_path, **kwargs)
+
+    def _get_exists_lookup(self, model_field, value, lookup_path='', **kwargs):
+        """
+        Exists subquery of the rows of a to many relation that match the filter of value,
+        a row is never repeated for each of its matching related rows like with a join
+        """
+        subquery = get_related_rows(model_field, lookup_path)
+        lookup = value._get_q_lookup_helper(value._get_lookups(**kwargs))
+        if lookup:
+            subquery = subquery.filter(lookup)
+        return Exists(subquery)
+
+    def _get_aggregate_lookup(self, model_field, value, lookup_path='', context=None):
+        """
+        Exists subquery of the row when the aggregates of the rows of a to many relation match the filter of value,
+        the other filters of value select the rows that are aggregated
+        """
+        value._check_view_permission(context.user)
+
+        rows = get_related_rows(model_field)
+        lookup = value._get_q_lookup_helper(value._get_lookups(context=context))
+        if lookup:
+            rows = rows.filter(lookup)
+        # Aggregated per row of the relation, the outer query is not grouped
+        rows = rows.order_by().values(get_related_name(model_field))
+        annotations, lookups = value._get_aggregate_lookups(rows, context=context)
+
+        outer_name = lookup_path + LOOKUP_SEP + 'pk' if lookup_path else 'pk'
+        subquery = self._meta.model._base_manager.filter(pk=OuterRef(outer_name)).annotate(**annotations)
+        lookup = value._get_q_lookup_helper(lookups)
+        if lookup:
+            subquery = subquery.filter(lookup)
+        return Exists(subquery)
+
     @classmethod
     def _convert_input_type_from_lookup(cls, dummy, field):
         try:
@@ -185,6 +355,9 @@ class ModelAutoFilterInputObjectType(AutoFilterInputObjectType):
         """Recursive helper to generate the input filters"""
         # Base case, dynamic field
         if isinstance(registry.get_converted_field(node), Dynamic):
+            if node.one_to_many or node.many_to_many:
+                # Array relationship, can also filter on aggregates of the related rows
+                return node.name, graphene.InputField(partial(get_relation_input_type, node))
             return node.name, graphene.InputField(partial(get_input_type, node))
 
         # Base case, field is of a lookup type
@@ -194,58 +367,148 @@ class ModelAutoFilterInputObjectType(AutoFilterInputObjectType):
 
         # field registers transforms
         if isclass(node) and issubclass(node, Transform):
-            lookups = node.get_lookups()
-            if not lookups:
+            if not node.get_lookups():
                 dummy = node.__new__(node)
                 return cls._convert_input_type_from_lookup(dummy, field)
 
-            lookup_fields = {}
-            for lookup_name, lookup in lookups.items():
-                next_name = name + to_pascal_case(lookup_name)
-                n, f = cls._get_filter_input(registry, model, lookup, name=next_name, field=lookup)
-                if f:
-                    lookup_fields[n] = f
-
-            return node.lookup_name, graphene.InputField(
-                type(
-                    name + to_pascal_case(node.lookup_name) + 'FilterInput',
-                    (AutoFilterInputObjectType,),
-                    lookup_fields
-                )
-            )
+            # The lookups of a transform are converted with the lookup itself as the field
+            return node.lookup_name, graphene.InputField(partial(cls._get_lookup_input_type, registry, model, node))
 
         # field registers lookups
         if isinstance(node, RegisterLookupMixin):
-            lookup_fields = {}
-            field_name = node.attname
-            next_name = name + to_pascal_case(field_name)
-
-            lookups = node.get_lookups()
-            for lookup in lookups.values():
-                n, f = cls._get_filter_input(registry, model, lookup, name=next_name, field=node)
-                if f:
-                    lookup_fields[n] = f
-
-            return field_name, graphene.InputField(
-                type(
-                    next_name + 'FilterInput',
-                    (AutoFilterInputObjectType,),
-                    lookup_fields
-                )
+            return node.attname, graphene.InputField(
+                partial(cls._get_lookup_input_type, registry, model, node),
+                description=get_django_field_description(node),
             )
 
         raise RuntimeError('Failed to generate filter tree')
 
+    @classmethod
+    def _get_lookup_input_type(cls, registry, model, node):
+        """
+        Returns the input type of the lookups registered by a model field or transform, built when the schema
+        first references it. The leaves only depend on the class of the field, so every field of the same class
+        with the same lookups shares one type
+        """
+        node_class = node if isclass(node) else node.__class__
+        lookups = node.get_lookups()
+        key = (node_class, tuple(lookups.items()))
+        input_type = lookup_input_types.get(key)
+        if input_type is not None:
+            return input_type
+
+        name = node_class.__name__
+        lookup_fields = {}
+        for lookup in lookups.values():
+            n, f = cls._get_filter_input(
+                registry,
+                model,
+                lookup,
+                name=name,
+                field=node if node_class is not node else lookup,
+            )
+            if f:
+                lookup_fields[n] = f
+
+        # Classes of different modules may share a name, graphql type names are unique
+        type_name = name + 'FilterInput'
+        lookup_input_type_names[type_name] += 1
+        if lookup_input_type_names[type_name] > 1:
+            type_name = name + str(lookup_input_type_names[type_name]) + 'FilterInput'
+
+        input_type = lookup_input_types[key] = type(type_name, (AutoFilterInputObjectType,), lookup_fields)
+        return input_type
+
     def _get_lookups(self, lookup_path='', context=None):
-        user = context.user
         lookups = super()._get_lookups(lookup_path, context=context)
-        if not lookups:
-            return lookups
+        if lookups:
+            self._check_view_permission(context.user)
+        return lookups
 
-        # Permission check
+    def _check_view_permission(self, user):
         permission = get_model_permission(self._meta.model, VIEW)
-        logger.debug('Checking permission {0} for user [{1}] to use filter [{2}]'.format(permission, user, self.__class__))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                'Checking permission {0} for user [{1}] to use filter [{2}]'.format(permission, user, self.__class__)
+            )
+
+        if not (is_possible_for(user, permission) or user.has_perm(permission)):
+            raise PermissionDenied(
+                'User {0} does not have permission to use the {1} filter'.format(str(user), self.__class__))
+
+
+class ModelAutoRelationFilterInputObjectType(ModelAutoFilterInputObjectType):
+    """
+    Filter input of the rows of a to many relation, with _count, _sum, _avg, _min and _max
+    filters on aggregates of the rows
+    """
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def __init_subclass_with_meta__(cls, fields=None, model=None, _meta=None, **options):
+        super().__init_subclass_with_meta__(fields=fields, model=model, _meta=_meta, **options)
+
+        registry = get_global_registry()
+        columns, numeric_columns = get_aggregate_columns(model, fields)
+        columns_type = cls._get_columns_input_type(registry, model, model.__name__ + 'ColumnsFilterInput', columns)
+        numeric_columns_type = cls._get_columns_input_type(
+            registry, model, model.__name__ + 'NumericColumnsFilterInput', numeric_columns)
+
+        # Counts are filtered with the lookups of an integer field
+        cls._meta.fields[AGGREGATE_COUNT] = graphene.InputField(
+            partial(cls._get_lookup_input_type, registry, model, IntegerField()),
+            name=AGGREGATE_COUNT,
+        )
+        for name in AGGREGATE_FUNCTIONS:
+            input_type = numeric_columns_type if name in NUMERIC_AGGREGATES else columns_type
+            if input_type:
+                cls._meta.fields[name] = graphene.InputField(input_type, name=name)
+
+    @classmethod
+    def _get_columns_input_type(cls, registry, model, name, columns):
+        """Input type with the lookups of each column, None if there are no columns"""
+        if not columns:
+            return None
+        return type(name, (AutoFilterInputObjectType,), {
+            field.name: graphene.InputField(partial(cls._get_lookup_input_type, registry, model, field))
+            for field in columns
+        })
 
-        if (permission in perms and perms[permission].is_possible_for(user)) or user.has_perm(permission):
-            return lookups
-        raise PermissionDenied('User {0} does not have permission to use the {1} filter'.format(str(user), self.__class__))
+    @classmethod
+    def _compile_lookup_table(cls, table):
+        table = super()._compile_lookup_table(table)
+        for name in (AGGREGATE_COUNT,) + tuple(AGGREGATE_FUNCTIONS):
+            if name in table:
+                kind, suffix, model_field = table[name]
+                table[name] = (LOOKUP_AGGREGATE, suffix, model_field)
+        return table
+
+    def has_aggregates(self):
+        return any(self.get(name) for name in (AGGREGATE_COUNT,) + tuple(AGGREGATE_FUNCTIONS))
+
+    def _get_aggregate_lookups(self, rows, **kwargs):
+        """
+        Returns the aggregate subqueries of rows to annotate on the row of the relation
+        and the lookups of the filters on them
+        """
+        annotations = {}
+        lookups = []
+        count = self.get(AGGREGATE_COUNT)
+        if count:
+            alias = AGGREGATE_ANNOTATION.format(AGGREGATE_COUNT, 'pk')
+            annotations[alias] = Coalesce(Subquery(rows.annotate(value=Count('pk')).values('value')), Value(0))
+            lookups += count._get_lookups(alias, **kwargs)
+
+        for name, function in AGGREGATE_FUNCTIONS.items():
+            columns = self.get(name)
+            if not columns:
+                continue
+            for column, column_value in columns.items():
+                if not column_value:
+                    continue
+                alias = AGGREGATE_ANNOTATION.format(name, column)
+                annotations[alias] = Subquery(rows.annotate(value=function(column)).values('value'))
+                lookups += column_value._get_lookups(alias, **kwargs)
+
+        return annotations, lookups
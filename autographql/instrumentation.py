@@ -0,0 +1,125 @@
+import contextlib
+import logging
+import time
+from collections import OrderedDict
+
+from django.db import connections
+
+from autographql.cache import get_request_cache
+
+logger = logging.getLogger(__name__)
+
+ROOT_PATH = ''
+
+
+def get_path_key(path):
+    """Field path without the list indexes, every row of a list shares the same key"""
+    return '.'.join(str(key) for key in path if not isinstance(key, int))
+
+
+class QueryCollector(object):
+    """
+    Database execute wrapper that attributes every statement to the field path
+    of the resolver that was started last
+    """
+    def __init__(self):
+        self.current_path = ()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        path = self.current_path
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((path, sql, time.perf_counter() - start))
+
+    @contextlib.contextmanager
+    def collect(self):
+        """Wraps the statements executed on every database connection"""
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+    def get_report(self):
+        """
+        Statement count, time and duplicated statements per field path.
+        Statements with the same sql under the same path that were triggered
+        by different rows of a list are reported as n+1 queries
+        """
+        paths = OrderedDict()
+        groups = OrderedDict()
+        for path, sql, duration in self.queries:
+            path_key = get_path_key(path)
+            path_report = paths.get(path_key)
+            if path_report is None:
+                path_report = paths[path_key] = {'path': path_key or ROOT_PATH, 'count': 0, 'duration': 0.0}
+            path_report['count'] += 1
+            path_report['duration'] += duration
+
+            group = groups.get((path_key, sql))
+            if group is None:
+                group = groups[(path_key, sql)] = {'sql': sql, 'count': 0, 'duration': 0.0, 'rows': set()}
+            group['count'] += 1
+            group['duration'] += duration
+            group['rows'].add(tuple(key for key in path if isinstance(key, int)))
+
+        n_plus_one = []
+        for (path_key, sql), group in groups.items():
+            if group['count'] < 2:
+                continue
+
+            duplicate = {'sql': sql, 'count': group['count'], 'duration': to_ms(group['duration'])}
+            paths[path_key].setdefault('duplicates', []).append(duplicate)
+            if len(group['rows']) > 1:
+                n_plus_one.append(dict(duplicate, path=path_key or ROOT_PATH))
+
+        for path_report in paths.values():
+            path_report['duration'] = to_ms(path_report['duration'])
+
+        return {
+            'count': len(self.queries),
+            'duration': to_ms(sum(duration for path, sql, duration in self.queries)),
+            'paths': list(paths.values()),
+            'nPlusOne': n_plus_one,
+        }
+
+
+def to_ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def get_query_collector(context):
+    return get_request_cache(context, 'instrumentation').get('collector')
+
+
+def set_query_collector(context, collector):
+    get_request_cache(context, 'instrumentation')['collector'] = collector
+
+
+class InstrumentationMiddleware(object):
+    """Tells the query collector of the request which field is being resolved"""
+    def resolve(self, next, root, info, **args):
+        collector = get_query_collector(info.context)
+        if collector is not None:
+            collector.current_path = tuple(info.path.as_list())
+        return next(root, info, **args)
+
+
+def log_report(report, operation_name=None):
+    logger.info('Executed {0} sql queries in {1}ms for operation {2}'.format(
+        report['count'], report['duration'], operation_name,
+    ))
+    if 'permissions' in report:
+        logger.info('Permission decisions: {hits} cached, {misses} evaluated, hit ratio {ratio}'.format(
+            **report['permissions']
+        ))
+    for path_report in report['paths']:
+        logger.debug('{0} sql queries in {1}ms at {2}'.format(
+            path_report['count'], path_report['duration'], path_report['path'],
+        ))
+    for group in report['nPlusOne']:
+        logger.warning('Possible n+1 queries at {0}: {1} executions of {2}'.format(
+            group['path'], group['count'], group['sql'],
+        ))
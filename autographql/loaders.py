@@ -0,0 +1,94 @@
+from django.db.models import Model, QuerySet
+
+from autographql.cache import get_request_cache
+
+# Key of the relay edge field that holds the row of a connection
+EDGE_NODE_KEY = 'node'
+
+
+class BatchLoaderMiddleware(object):
+    """
+    Remembers every list resolved during the request so that OptimizedField can
+    load the objects of all the rows in a list with a single query
+    """
+    def resolve(self, next, root, info, **args):
+        value = next(root, info, **args)
+        if isinstance(value, (list, QuerySet)):
+            get_batch_loader(info.context).add_list(tuple(info.path.as_list()), value)
+        return value
+
+
+class BatchLoader(object):
+    """
+    Request scoped loader, the first row of a list to resolve an OptimizedField loads the
+    objects for every row with one pk__in query, the other rows are served from the results
+    """
+    def __init__(self):
+        # Rows and loaded results of every list by path, the results are dropped when a path
+        # is resolved again, e.g. by the next operation of a batched request
+        self.lists = {}
+
+    def add_list(self, path, rows):
+        self.lists[path] = (rows, {})
+
+    def load(self, object_type, info, args, attr_name, value):
+        list_path = self.get_list_path(info)
+        if list_path is None or list_path[0] not in self.lists:
+            # Not part of a list, nothing to batch
+            return object_type.get_optimized_queryset(info, args).get(pk=value.pk)
+
+        # Aliases of the same field with other arguments or selections load their own rows
+        key = (object_type, attr_name, list_path[1], tuple(id(node) for node in info.field_nodes), freeze_args(args))
+        list_results = self.lists[list_path[0]][1]
+        results = list_results.get(key)
+        if results is None:
+            pks = set()
+            for sibling in self.get_sibling_roots(*list_path):
+                sibling_value = getattr(sibling, attr_name, None)
+                if isinstance(sibling_value, Model):
+                    pks.add(sibling_value.pk)
+
+            queryset = object_type.get_optimized_queryset(info, args).filter(pk__in=pks)
+            results = list_results[key] = {obj.pk: obj for obj in queryset}
+
+        if value.pk not in results:
+            # Same error the single object lookup raises when the user can not see the row
+            raise object_type._meta.model.DoesNotExist(
+                '{0} matching query does not exist.'.format(object_type._meta.model._meta.object_name)
+            )
+
+        return results[value.pk]
+
+    def get_list_path(self, info):
+        """
+        Returns the path of the closest parent list and whether the rows are relay edges.
+        Supported roots are the list items themselves and the nodes of relay edges
+        """
+        path = info.path.as_list()[:-1]
+        if path and isinstance(path[-1], int):
+            return tuple(path[:-1]), False
+        if len(path) > 1 and path[-1] == EDGE_NODE_KEY and isinstance(path[-2], int):
+            return tuple(path[:-2]), True
+        return None
+
+    def get_sibling_roots(self, path, is_edge):
+        rows = self.lists[path][0]
+        if is_edge:
+            return [getattr(edge, EDGE_NODE_KEY, None) for edge in rows]
+        return rows
+
+
+def freeze_args(value):
+    """Hashable form of resolver arguments"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze_args(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_args(item) for item in value)
+    return value
+
+
+def get_batch_loader(context):
+    request_cache = get_request_cache(context, 'batch_loader')
+    if 'loader' not in request_cache:
+        request_cache['loader'] = BatchLoader()
+    return request_cache['loader']
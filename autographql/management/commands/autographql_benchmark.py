@@ -0,0 +1,55 @@
+import importlib
+import json
+import platform
+
+import django
+
+from django.core.management.base import BaseCommand, CommandError
+
+BENCHMARKS = {
+    'prefetch': 'autographql.benchmarks.prefetch',
+    'middleware': 'autographql.benchmarks.middleware',
+    'authorization': 'autographql.benchmarks.authorization',
+    'schema': 'autographql.benchmarks.schema',
+    'filters': 'autographql.benchmarks.filters',
+}
+
+
+class Command(BaseCommand):
+    help = 'Runs the autographql micro-benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'benchmarks',
+            nargs='*',
+            help='Benchmarks to run, one of {0}. Runs all of them by default'.format(', '.join(BENCHMARKS)),
+        )
+        parser.add_argument('--number', type=int, default=200, help='Calls per timing')
+        parser.add_argument('--repeat', type=int, default=5, help='Timings per benchmark')
+        parser.add_argument('--out', help='Json file the results are written to, to compare them between versions')
+
+    def handle(self, *args, **options):
+        names = options['benchmarks'] or list(BENCHMARKS)
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError('Unknown benchmark {0}, choose from {1}'.format(name, ', '.join(BENCHMARKS)))
+
+        results = {}
+        for name in names:
+            module = importlib.import_module(BENCHMARKS[name])
+            results[name] = module.run(number=options['number'], repeat=options['repeat'])
+            for result in results[name]:
+                line = '{name:<60} best {best_us:>10.1f}us  mean {mean_us:>10.1f}us'.format(**result)
+                if 'queries' in result:
+                    line += '  {queries:>5.1f} queries  sql {sql_us:>10.1f}us  python {python_us:>10.1f}us'.format(**result)
+                if 'speedup' in result:
+                    line += '  x{0:.2f}'.format(result['speedup'])
+                self.stdout.write(line)
+
+        if options['out']:
+            with open(options['out'], 'w') as f:
+                json.dump({
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'results': results,
+                }, f, indent=2)
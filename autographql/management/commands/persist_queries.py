@@ -0,0 +1,72 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from graphene_django.settings import graphene_settings
+from graphql import parse, validate, GraphQLError
+
+from autographql.persisted_queries import get_query_hash
+from autographql.settings import autographql_settings
+
+QUERY_FILE_EXTENSIONS = ('.graphql', '.gql')
+
+
+class Command(BaseCommand):
+    help = 'Validates graphql query files and writes them to the persisted queries manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='+',
+            help='Query files or directories containing .graphql files',
+        )
+        parser.add_argument(
+            '--out',
+            dest='out',
+            default=autographql_settings.PERSISTED_QUERIES_MANIFEST,
+            help='Manifest file to write, defaults to the PERSISTED_QUERIES_MANIFEST setting',
+        )
+
+    def handle(self, *args, **options):
+        out = options['out']
+        if not out:
+            raise CommandError('No output file, pass --out or set PERSISTED_QUERIES_MANIFEST')
+
+        schema = graphene_settings.SCHEMA.graphql_schema
+
+        queries = {}
+        if os.path.exists(out):
+            # Keep previously persisted queries, clients may still send their hashes
+            with open(out) as manifest:
+                queries = json.load(manifest)
+
+        for path in self.get_query_files(options['paths']):
+            with open(path) as query_file:
+                query = query_file.read()
+
+            try:
+                errors = validate(schema, parse(query))
+            except GraphQLError as e:
+                errors = [e]
+            if errors:
+                raise CommandError('{0} is not valid: {1}'.format(path, '; '.join(e.message for e in errors)))
+
+            query_hash = get_query_hash(query)
+            queries[query_hash] = query
+            self.stdout.write('{0} {1}'.format(query_hash, path))
+
+        with open(out, 'w') as manifest:
+            json.dump(queries, manifest, indent=2, sort_keys=True)
+
+        self.stdout.write(self.style.SUCCESS('Wrote {0} persisted queries to {1}'.format(len(queries), out)))
+
+    def get_query_files(self, paths):
+        for path in paths:
+            if not os.path.isdir(path):
+                yield path
+                continue
+
+            for root, dirs, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(QUERY_FILE_EXTENSIONS):
+                        yield os.path.join(root, name)
@@ -1,11 +1,60 @@
 from bridgekeeper import perms
+from bridgekeeper.rules import UNIVERSAL, EMPTY
 from django.core.exceptions import FieldError
 from django.db import models
+from django.db.models.query import ModelIterable
 
-from autographql.auth.utils import get_model_permission, VIEW
+from autographql.auth.utils import get_model_permission, get_rule_query, VIEW
+
+# Pk of the user the view rule of the queryset or instance was applied for
+VIEWABLE_BY_ATTRIBUTE = '_autographql_viewable_by'
+NOT_VIEWABLE = object()
+
+
+def get_viewable_by(obj):
+    """Returns the pk of the user the rows were filtered for, NOT_VIEWABLE if they were not filtered"""
+    if isinstance(obj, models.QuerySet):
+        obj = obj.query
+    return getattr(obj, VIEWABLE_BY_ATTRIBUTE, NOT_VIEWABLE)
+
+
+def set_viewable_by(obj, user):
+    setattr(obj, VIEWABLE_BY_ATTRIBUTE, user.pk)
+
+
+def is_viewable_by(instance, user):
+    """Checks if the instance was loaded by a queryset filtered by the view rule of the user"""
+    return get_viewable_by(instance) == user.pk
+
+
+class ViewableModelIterable(ModelIterable):
+    """Tags the instances of a queryset filtered by the view rule with the user it was filtered for"""
+    def __iter__(self):
+        viewable_by = get_viewable_by(self.queryset)
+        for obj in super().__iter__():
+            if viewable_by is not NOT_VIEWABLE:
+                setattr(obj, VIEWABLE_BY_ATTRIBUTE, viewable_by)
+            yield obj
 
 
 class AuthQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iterable_class = ViewableModelIterable
+
+    def __or__(self, other):
+        combined = super().__or__(other)
+        if combined is not self and combined is not other and get_viewable_by(self) != get_viewable_by(other):
+            # Rows of the other queryset were not filtered for the same user
+            combined.query.__dict__.pop(VIEWABLE_BY_ATTRIBUTE, None)
+        return combined
+
+    def _combinator_query(self, combinator, *other_qs, **kwargs):
+        clone = super()._combinator_query(combinator, *other_qs, **kwargs)
+        if combinator == 'union' and any(get_viewable_by(qs) != get_viewable_by(self) for qs in other_qs):
+            clone.query.__dict__.pop(VIEWABLE_BY_ATTRIBUTE, None)
+        return clone
+
     def for_user(self, user):
         # Default functionality is identical to all()
         queryset = self.all()
@@ -17,7 +66,13 @@ class AuthQuerySet(models.QuerySet):
         # Filter queryset based on user permissions
         permission = get_model_permission(self.model, VIEW)
         if permission in perms:
-            queryset = perms[permission].filter(user, queryset)
+            query = get_rule_query(user, permission)
+            if query is EMPTY:
+                return queryset.none()
+            if query is not UNIVERSAL:
+                queryset = queryset.filter(query)
+            # The instances do not need to be checked again
+            set_viewable_by(queryset.query, user)
 
         return queryset
 
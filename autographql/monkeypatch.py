@@ -1,6 +1,11 @@
-from graphene_django import registry
+from graphene_django import registry, views
 
+from autographql.persisted_queries import parse_document, validate_document
 from autographql.registry import Registry
 
 # Monkey patch this
 registry.Registry = Registry
+
+# Persisted queries are executed by GraphQLView without parsing and validating them again
+views.parse = parse_document
+views.validate = validate_document
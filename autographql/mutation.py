@@ -1,4 +1,5 @@
 import graphene
+from django.contrib.auth import get_user_model
 from django.core.exceptions import PermissionDenied
 from graphene import InputField, ClientIDMutation
 from graphene.types.utils import yank_fields_from_attrs
@@ -8,13 +9,20 @@ from graphql_relay import from_global_id
 from graphql_relay.connection.arrayconnection import offset_to_cursor
 from rest_framework.exceptions import ErrorDetail
 
+from autographql.auth.annotations import annotate_permissions, clear_permission_annotations, has_model_perm
 from autographql.auth.constants import PERMISSION_DENIED_MESSAGE
-from autographql.auth.utils import get_model_permission, CREATE, DELETE, UPDATE
+from autographql.auth.utils import get_model_permission, invalidate_rule_queries, CREATE, DELETE, UPDATE
 from autographql.converters import get_input_fields_from_serializer
 from autographql.fields import OptimizedField
 from autographql.types import ErrorType
 
 
+def invalidate_user_rule_queries(instance):
+    """Drops the shared rule queries of a user that a mutation changes, rules may read its fields"""
+    if isinstance(instance, get_user_model()):
+        invalidate_rule_queries(instance)
+
+
 class SerializerMutation(ClientIDMutation):
     class Meta:
         abstract = True
@@ -207,21 +215,32 @@ class UpdateSerializerMutation(CrudSerializerMutation):
         return cls.update(root, info, **cleaned_input)
 
     @classmethod
-    def update(cls, root, info, **input):
-        if 'id' not in input:
-            return cls(errors=[
-                ErrorType(
-                    field='id',
-                    messages=[ErrorDetail('The id field is required.')],
-                )
-            ])
-
+    def update(cls, root, info, instance=None, **input):
+        """
+        Updates the instance with the input. An instance loaded by the optimizer can be passed in,
+        its permission annotation is checked without another query
+        """
         serializer_class = cls._meta.serializer_class
         model_class = serializer_class.Meta.model
-        instance = model_class.objects.get(id=input['id'])
+        user = info.context.user
+
+        if instance is None:
+            if 'id' not in input:
+                return cls(errors=[
+                    ErrorType(
+                        field='id',
+                        messages=[ErrorDetail('The id field is required.')],
+                    )
+                ])
+            # The permission is decided by the same query that loads the instance
+            instance = annotate_permissions(model_class.objects.all(), user, [UPDATE]).get(id=input['id'])
 
         # Permission check
-        if not info.context.user.has_perm(cls._meta.permission, instance):
+        if cls._meta.permission == get_model_permission(model_class, UPDATE):
+            allowed = has_model_perm(user, UPDATE, instance)
+        else:
+            allowed = user.has_perm(cls._meta.permission, instance)
+        if not allowed:
             raise PermissionDenied(PERMISSION_DENIED_MESSAGE)
 
         serializer = serializer_class(
@@ -236,6 +255,8 @@ class UpdateSerializerMutation(CrudSerializerMutation):
             errors = cls.get_serializer_errors(serializer)
             return cls(errors=errors)
 
+        invalidate_user_rule_queries(instance)
+        clear_permission_annotations(instance)
         if getattr(instance, '_prefetched_objects_cache', None):
             # If 'prefetch_related' has been applied to a queryset, we need to
             # forcibly invalidate the prefetch cache on the instance.
@@ -295,9 +316,6 @@ class DjangoSerializerMutationFieldFactory(object):
 
     @classmethod
     def get_delete_mutation(cls):
-        # Get required permissions
-        delete_permission = get_model_permission(cls.Meta.type._meta.model, DELETE)
-
         class DeleteInstance(ClientIDMutation):
             class Meta:
                 name = 'Delete' + cls.Meta.serializer_class.Meta.model.__name__ + 'Payload'
@@ -313,15 +331,19 @@ class DjangoSerializerMutationFieldFactory(object):
                 return inner_cls.delete(root, info, **input)
 
             @classmethod
-            def delete(inner_cls, root, info, **input):
-                deletedId = from_global_id(input['id'])[1]
+            def delete(inner_cls, root, info, instance=None, **input):
+                """Deletes the instance of the id, or the instance loaded by the optimizer that is passed in"""
                 model_class = cls.Meta.serializer_class.Meta.model
-                instance = model_class.objects.get(id=deletedId)
+                user = info.context.user
+                if instance is None:
+                    deletedId = from_global_id(input['id'])[1]
+                    instance = annotate_permissions(model_class.objects.all(), user, [DELETE]).get(id=deletedId)
 
                 # Permission check
-                if not info.context.user.has_perm(delete_permission, instance):
+                if not has_model_perm(user, DELETE, instance):
                     raise PermissionDenied(PERMISSION_DENIED_MESSAGE)
 
+                invalidate_user_rule_queries(instance)
                 deleted = instance.delete()
 
                 return DeleteInstance(
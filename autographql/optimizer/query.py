@@ -1,37 +1,91 @@
+import copy
 import functools
+from collections import Counter
 
+from bridgekeeper.rules import always_allow
 from django.db.models import ManyToOneRel, Prefetch
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ModelIterable
 from graphene import GlobalID
 from graphene.types.mutation import MutationOptions
 from graphene.types.resolver import attr_resolver, dict_or_attr_resolver, dict_resolver
 from graphene_django import DjangoObjectType
 from graphene_django_optimizer.query import QueryOptimizer as _QueryOptimizer
 from graphene_django_optimizer.query import QueryOptimizerStore as _QueryOptimizerStore
+from graphene_django_optimizer.utils import get_field_def_compat
 from graphql.execution.values import get_argument_values
 from graphql.language.ast import (
     FragmentSpreadNode,
     InlineFragmentNode,
 )
 
+from autographql.auth.annotations import annotate_permissions, get_permission_type
 from autographql.auth.query import AuthQueryOptimizer
-from autographql.optimizer.utils import remove_prefix, combine_querysets
+from autographql.cache import LRUCache
+from autographql.managers import set_viewable_by
+from autographql.optimizer.utils import remove_prefix, combine_querysets, get_document_hash, is_field_selected, \
+    get_connection_slice_end, limit_per_parent
+from autographql.settings import autographql_settings
 
 
 class QueryOptimizer(_QueryOptimizer):
+    # Compiled optimizer stores shared by every request, keyed by get_plan_key
+    plan_cache = LRUCache(autographql_settings.OPTIMIZER_PLAN_CACHE_SIZE)
+
     def __init__(self, info):
         super(QueryOptimizer, self).__init__(info)
         self.auth_optimizer = AuthQueryOptimizer(info)
         self.variable_values = info.variable_values
 
     def optimize(self, queryset):
-        queryset = super().optimize(queryset)
+        store = self.get_plan()
+        queryset = store.optimize_queryset(queryset, self)
         queryset = self.auth_optimizer.optimize(queryset)
         queryset = combine_querysets([queryset])
         return queryset
 
+    def get_plan(self):
+        """
+        Returns the optimizer store for the current selection.
+        The selection AST is only walked once per distinct operation, after that the
+        store is replayed from the plan cache onto the new queryset
+        """
+        key = self.get_plan_key()
+        store = self.plan_cache.get(key) if key else None
+        if store is not None:
+            return store
+
+        info = self.root_info
+        field_def = get_field_def_compat(info.schema, info.parent_type, info.field_nodes[0])
+        store = self._optimize_gql_selections(
+            self._get_type(field_def),
+            info.field_nodes[0],
+        )
+        if key and store.cacheable:
+            self.plan_cache.set(key, store)
+
+        return store
+
+    def get_plan_key(self):
+        """
+        Plans are keyed on the query document, the operation, the path of the field without list indexes
+        and the variables that are set. Argument values are read again each time a plan is applied
+        """
+        info = self.root_info
+        document_hash = get_document_hash(info)
+        if document_hash is None:
+            return None
+
+        operation_name = info.operation.name.value if info.operation.name else None
+        field_path = tuple(key for key in info.path.as_list() if isinstance(key, str))
+        variables_shape = tuple(sorted(
+            name for name, value in (self.variable_values or {}).items() if value is not None
+        ))
+
+        return info.schema, document_hash, operation_name, field_path, variables_shape
+
     def _optimize_gql_selections(self, field_type, field_ast):
         store = QueryOptimizerStore()
-        store.abort_only_optimization()
 
         # Optimize queryset
         selection_set = field_ast.selection_set
@@ -89,6 +143,14 @@ class QueryOptimizer(_QueryOptimizer):
                                     )
         return store
 
+    def _optimize_field(self, store, model, selection, field_def, parent_type):
+        permission_type = get_permission_type(field_def.resolve)
+        if permission_type is not None:
+            # Computed by an annotation of the rows, no column has to be loaded
+            store.annotate_permission(permission_type)
+            return
+        super()._optimize_field(store, model, selection, field_def, parent_type)
+
     def _get_name_from_resolver(self, resolver):
         resolver_fn = resolver
         optimization_hints = self._get_optimization_hints(resolver)
@@ -117,6 +179,9 @@ class QueryOptimizer(_QueryOptimizer):
         name = self._get_name_from_resolver(field_def.resolve)
         if not name:
             return False
+        if name == 'id' and self._is_resolver_for_id_field(field_def.resolve):
+            # The relay id is read from the primary key, whatever its name is
+            name = model._meta.pk.name
         model_field = self._get_model_field_from_name(model, name)
         if not model_field:
             return False
@@ -136,18 +201,52 @@ class QueryOptimizer(_QueryOptimizer):
                 # parent_type,
             )
 
+            if model_field.concrete and (model_field.many_to_one or model_field.one_to_one):
+                # The foreign key column is needed to join or prefetch the relation
+                store.only(name)
+                if not model_field.target_field.primary_key:
+                    field_store.only(model_field.target_field.name)
+
+            partition_by = None
             if isinstance(model_field, ManyToOneRel):
                 field_store.only(model_field.field.name)
+                if not model_field.field.target_field.primary_key:
+                    store.only(model_field.field.target_field.name)
+                if hasattr(node_type.graphene_type._meta, 'node'):
+                    # Connection pages can be limited per parent row
+                    partition_by = model_field.field.attname
 
-            arguments = get_argument_values(field_def, selection, self.variable_values)
-            related_queryset = self.get_queryset(node_type, arguments)
-            store.prefetch_related(name, field_store, related_queryset)
+            # Forward single valued relations without arguments can be joined instead
+            joinable = (
+                model_field.concrete and
+                (model_field.many_to_one or model_field.one_to_one) and
+                not selection.arguments and
+                self._has_default_queryset(node_type)
+            )
+
+            store.prefetch_related(
+                name,
+                field_store,
+                PrefetchPlan(name, field_store, node_type, field_def, selection, partition_by, joinable),
+            )
             return True
         if not model_field.is_relation:
             store.only(name)
             return True
         return False
 
+    def _optimize_field_by_hints(self, store, selection, field_def, parent_type):
+        optimized = super()._optimize_field_by_hints(store, selection, field_def, parent_type)
+        if optimized:
+            # Hints are evaluated against the current request so the store can not be reused
+            store.cacheable = False
+        return optimized
+
+    def _has_default_queryset(self, node_type):
+        gtype = node_type.graphene_type
+        get_queryset = getattr(gtype, 'get_queryset', None)
+        return getattr(get_queryset, '__func__', None) is DjangoObjectType.get_queryset.__func__
+
     def get_queryset(self, node_type, args):
         gtype = node_type.graphene_type
 
@@ -173,19 +272,178 @@ class QueryOptimizer(_QueryOptimizer):
         return resolver_fn == resolve_id
 
 
+class PrefetchPlan(Prefetch):
+    """
+    Prefetch that only remembers the selection it was planned from.
+    The queryset is built when the plan is applied, so the plan itself holds no request state
+    """
+    def __init__(self, lookup, store, node_type, field_def, selection, partition_by=None, joinable=False):
+        super().__init__(lookup)
+        self.store = store
+        self.node_type = node_type
+        self.field_def = field_def
+        self.selection = selection
+        self.partition_by = partition_by
+        self.joinable = joinable
+
+    def get_prefetch(self, optimizer, windowed=True, prefix=''):
+        arguments = get_argument_values(self.field_def, self.selection, optimizer.variable_values)
+        queryset = optimizer.get_queryset(self.node_type, arguments)
+        if windowed and self.partition_by:
+            # Only fetch the rows of the requested page for each parent, unless every row is counted
+            limit = get_connection_slice_end(arguments)
+            if limit is not None and not is_field_selected(self.selection, 'totalCount', optimizer.root_info.fragments):
+                queryset = limit_per_parent(queryset, self.partition_by, limit)
+        queryset = self.store.optimize_queryset(queryset, optimizer)
+        return Prefetch(prefix + self.prefetch_through, queryset=queryset)
+
+    def get_join_rule(self, optimizer, depth):
+        """Rule the joined rows are checked with, None if the relation has to be prefetched"""
+        if not self.joinable or depth >= autographql_settings.OPTIMIZER_MAX_JOIN_DEPTH:
+            return None
+        return optimizer.auth_optimizer.get_join_rule(self.node_type.graphene_type._meta.model)
+
+
+class QueryOptimizerLookups(object):
+    """Lookups collected from a store and the stores of the relations joined into the same query"""
+    def __init__(self):
+        self.select_list = []
+        self.prefetch_list = []
+        self.only_list = []
+        self.join_rules = []
+        self.permission_list = []
+
+
+class JoinedRowsIterable(object):
+    """
+    Mixin for the iterable class of a queryset with joined relations.
+    Related objects the user can not view are replaced by None, like a filtered prefetch would
+    """
+    user = None
+    join_rules = ()
+
+    def __iter__(self):
+        for obj in super().__iter__():
+            for path, rule in self.join_rules:
+                parent = obj
+                for name in path[:-1]:
+                    parent = parent._state.fields_cache.get(name)
+                    if parent is None:
+                        break
+
+                related = parent._state.fields_cache.get(path[-1]) if parent is not None else None
+                if related is None or rule is always_allow:
+                    continue
+                if rule.check(self.user, related):
+                    # Same rule the authorization middleware would check
+                    set_viewable_by(related, self.user)
+                else:
+                    parent._state.fields_cache[path[-1]] = None
+            yield obj
+
+
+def check_joined_rows(queryset, user, join_rules):
+    if not issubclass(queryset._iterable_class, ModelIterable):
+        return queryset
+
+    queryset = queryset.all()
+    queryset._iterable_class = type('JoinedRowsIterable', (JoinedRowsIterable, queryset._iterable_class), {
+        'user': user,
+        'join_rules': tuple(join_rules),
+    })
+    return queryset
+
+
 class QueryOptimizerStore(_QueryOptimizerStore):
-    def optimize_queryset(self, queryset):
-        if len(self.select_list) > 0:
-            # An empty select_list will have the queryset select everything possible
-            queryset = queryset.select_related(*self.select_list)
-        if len(self.prefetch_list) > 0:
-            queryset = queryset.prefetch_related(*self.prefetch_list)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cacheable = True
+        self.permission_list = []
+
+    def optimize_queryset(self, queryset, optimizer):
+        lookups = QueryOptimizerLookups()
+        self.collect_lookups(lookups, optimizer)
 
-        if self.only_list:
-            queryset = queryset.only(*self.only_list)
+        if len(lookups.select_list) > 0:
+            # An empty select_list will have the queryset select everything possible
+            queryset = queryset.select_related(*lookups.select_list)
+        if len(lookups.prefetch_list) > 0:
+            queryset = queryset.prefetch_related(*lookups.prefetch_list)
+        if lookups.only_list:
+            # Columns read by the permission checks of the instances are always loaded
+            auth_fields = optimizer.auth_optimizer.get_only_fields(queryset.model)
+            if auth_fields is not None:
+                queryset = queryset.only(*lookups.only_list, *auth_fields)
+        if lookups.join_rules:
+            queryset = check_joined_rows(queryset, optimizer.auth_optimizer.user, lookups.join_rules)
+        if lookups.permission_list:
+            queryset = annotate_permissions(queryset, optimizer.auth_optimizer.user, lookups.permission_list)
         return queryset
 
-    def prefetch_related(self, name, store, queryset):
-        """Overridden prefetch_related always use the prefetch object"""
-        queryset = store.optimize_queryset(queryset)
-        self.prefetch_list.append(Prefetch(name, queryset=queryset))
+    def collect_lookups(self, lookups, optimizer, prefix='', depth=0):
+        """
+        Decides for every planned relation if it is joined or prefetched.
+        Joined relations add their own lookups to the same query, prefixed with their path
+        """
+        for select in self.select_list:
+            lookups.select_list.append(prefix + select)
+
+        if not prefix:
+            lookups.permission_list += self.permission_list
+
+        if self.only_list is None:
+            lookups.only_list = None
+        elif lookups.only_list is not None:
+            lookups.only_list += [prefix + only for only in self.only_list]
+
+        # Lookups selected more than once are merged, their rows can not be windowed or joined
+        counts = Counter(p.prefetch_to for p in self.prefetch_list if isinstance(p, PrefetchPlan))
+        for prefetch in self.prefetch_list:
+            if not isinstance(prefetch, PrefetchPlan):
+                if isinstance(prefetch, Prefetch):
+                    if prefix:
+                        prefetch = copy.copy(prefetch)
+                        prefetch.add_prefix(prefix[:-len(LOOKUP_SEP)])
+                else:
+                    prefetch = prefix + prefetch
+                lookups.prefetch_list.append(prefetch)
+                continue
+
+            unique = counts[prefetch.prefetch_to] == 1
+            # Permission annotations can only be added to the rows of their own query
+            joinable = unique and not prefetch.store.permission_list
+            rule = prefetch.get_join_rule(optimizer, depth) if joinable else None
+            if rule is None:
+                lookups.prefetch_list.append(prefetch.get_prefetch(optimizer, windowed=unique, prefix=prefix))
+                continue
+
+            path = prefix + prefetch.prefetch_through
+            lookups.select_list.append(path)
+            if rule is not always_allow:
+                lookups.join_rules.append((tuple(path.split(LOOKUP_SEP)), rule))
+            if lookups.only_list is not None:
+                auth_fields = optimizer.auth_optimizer.get_only_fields(prefetch.node_type.graphene_type._meta.model)
+                if auth_fields is None:
+                    lookups.only_list = None
+                else:
+                    lookups.only_list += [path + LOOKUP_SEP + field for field in auth_fields]
+            prefetch.store.collect_lookups(lookups, optimizer, path + LOOKUP_SEP, depth + 1)
+
+    def prefetch_related(self, name, store, prefetch_plan):
+        """Overridden prefetch_related always use a prefetch plan"""
+        self.prefetch_list.append(prefetch_plan)
+        self.cacheable = self.cacheable and store.cacheable
+
+    def select_related(self, name, store):
+        super().select_related(name, store)
+        self.cacheable = self.cacheable and store.cacheable
+
+    def append(self, store):
+        super().append(store)
+        self.cacheable = self.cacheable and store.cacheable
+        for permission_type in store.permission_list:
+            self.annotate_permission(permission_type)
+
+    def annotate_permission(self, permission_type):
+        if permission_type not in self.permission_list:
+            self.permission_list.append(permission_type)
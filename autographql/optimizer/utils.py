@@ -1,4 +1,20 @@
-from django.db.models import Prefetch
+import hashlib
+from collections import OrderedDict
+
+import django
+from django.db import connections
+from django.db.models import Prefetch, F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.db.models.query import ModelIterable
+from graphql.language.ast import FieldNode, FragmentSpreadNode, InlineFragmentNode
+from graphql_relay import get_offset_with_default, cursor_to_offset
+
+from autographql.cache import get_request_cache
+
+WINDOW_ROW_NUMBER = '_window_row_number'
+WINDOW_PK = '_window_pk'
+WINDOW_ALIAS = '_windowed'
 
 
 def remove_prefix(text, prefix):
@@ -7,53 +23,293 @@ def remove_prefix(text, prefix):
     return text
 
 
+def get_document_hash(info):
+    """Returns a hash of the query document of the operation, computed once per request"""
+    loc = info.operation.loc
+    if loc is None:
+        # Document was not parsed from a source, nothing to hash
+        return None
+
+    document_hashes = get_request_cache(info.context, 'document_hash')
+    source = loc.source
+    if id(source) not in document_hashes:
+        document_hashes[id(source)] = hashlib.sha1(source.body.encode('utf-8')).hexdigest()
+
+    return document_hashes[id(source)]
+
+
+def is_field_selected(selection, name, fragments):
+    """Checks if a field is selected directly under the selection, fragments included"""
+    if not selection.selection_set:
+        return False
+
+    for child in selection.selection_set.selections:
+        if isinstance(child, FieldNode):
+            if child.name.value == name:
+                return True
+        elif isinstance(child, InlineFragmentNode):
+            if is_field_selected(child, name, fragments):
+                return True
+        elif isinstance(child, FragmentSpreadNode):
+            fragment = fragments.get(child.name.value)
+            if fragment is None or is_field_selected(fragment, name, fragments):
+                return True
+    return False
+
+
+def get_connection_slice_end(arguments):
+    """
+    Number of rows from the start of the list that a connection resolved with
+    these arguments can read, None if the connection may need every row
+    """
+    after = arguments.get('after')
+    before = arguments.get('before')
+    if (after and cursor_to_offset(after) is None) or (before and cursor_to_offset(before) is None):
+        # Keyset cursors do not tell how far into the list the page is
+        return None
+
+    end = cursor_to_offset(before) if before else None
+    first = arguments.get('first')
+    if first is None:
+        # last reads the rows before the cursor, without one it needs the whole list to know where it ends
+        return end
+
+    start = get_offset_with_default(after, -1) + 1 + (arguments.get('offset') or 0)
+    # One extra row tells if there is a next page, last is taken from the rows of first
+    fetch_end = start + first + 1
+    if end is not None:
+        return min(fetch_end, end)
+    return fetch_end
+
+
+def get_window_ordering(queryset):
+    """Ordering of the queryset as expressions with the pk as tie breaker, None if it can not be windowed"""
+    query = queryset.query
+    if query.order_by:
+        ordering = query.order_by
+    elif query.default_ordering:
+        ordering = query.get_meta().ordering or []
+    else:
+        ordering = []
+
+    expressions = []
+    for order in ordering:
+        if isinstance(order, str):
+            if order == '?':
+                return None
+            if order.startswith('-'):
+                expressions.append(F(order[1:]).desc())
+            else:
+                expressions.append(F(order.lstrip('+')).asc())
+        elif isinstance(order, F):
+            expressions.append(order.asc())
+        else:
+            expressions.append(order)
+
+    expressions.append(F('pk').asc())
+    return expressions
+
+
+class WindowedRowsIterable(object):
+    """
+    Mixin for the iterable class of a prefetch queryset that keeps the first rows of every parent.
+    The rows are numbered when the queryset is read, once the prefetch has filtered it on the parents,
+    with a ROW_NUMBER() OVER (PARTITION BY field) subquery for django versions that can not filter on windows
+    """
+    partition_by = None
+    limit = None
+
+    def __iter__(self):
+        queryset = self.queryset
+        if connections[queryset.db].features.supports_over_clause:
+            rows = queryset.annotate(**{
+                WINDOW_PK: F('pk'),
+                WINDOW_ROW_NUMBER: Window(
+                    RowNumber(),
+                    partition_by=F(self.partition_by),
+                    order_by=get_window_ordering(queryset),
+                ),
+            }).order_by().values(WINDOW_PK, WINDOW_ROW_NUMBER)
+            sql, params = rows.query.get_compiler(queryset.db).as_sql()
+            quote_name = connections[queryset.db].ops.quote_name
+            windowed = 'SELECT {pk} FROM ({sql}) {alias} WHERE {alias}.{row_number} <= %s'.format(
+                pk=quote_name(WINDOW_PK),
+                sql=sql,
+                alias=quote_name(WINDOW_ALIAS),
+                row_number=quote_name(WINDOW_ROW_NUMBER),
+            )
+            self.queryset = queryset.filter(pk__in=RawSQL(windowed, (*params, self.limit)))
+        return super().__iter__()
+
+
+def limit_per_parent(queryset, field_name, limit):
+    """
+    Keeps the first rows of the queryset for every value of field_name.
+    Uses a ROW_NUMBER() OVER (PARTITION BY field_name) filter when django can filter on windows,
+    the same window in a pk IN subquery of the prefetched rows otherwise
+    """
+    ordering = get_window_ordering(queryset)
+    if ordering is None:
+        return queryset
+
+    if django.VERSION >= (4, 2):
+        queryset = queryset.annotate(**{
+            WINDOW_ROW_NUMBER: Window(RowNumber(), partition_by=F(field_name), order_by=ordering),
+        })
+        queryset = queryset.filter(**{WINDOW_ROW_NUMBER + '__lte': limit})
+    elif issubclass(queryset._iterable_class, ModelIterable):
+        queryset = queryset.all()
+        queryset._iterable_class = type('WindowedRowsIterable', (WindowedRowsIterable, queryset._iterable_class), {
+            'partition_by': field_name,
+            'limit': limit,
+        })
+    else:
+        return queryset
+
+    return queryset.order_by(*ordering)
+
+
+def is_unrestricted(queryset, other):
+    """Checks if combining queryset into other with & would leave other unchanged"""
+    query = queryset.query
+    return (
+        query.model == other.query.model and
+        not other.query.is_sliced and
+        not query.where and
+        len(query.alias_map) <= 1 and
+        not query.select and
+        not query.extra and
+        not query.extra_tables and
+        not query.order_by and
+        not query.extra_order_by and
+        query.distinct == other.query.distinct and
+        query.distinct_fields == other.query.distinct_fields
+    )
+
+
+def is_same_query(queryset, other):
+    """Checks if queryset selects the same rows as other, combining them with & would only cost time"""
+    query = queryset.query
+    other_query = other.query
+    return (
+        query.model == other_query.model and
+        not query.is_sliced and
+        not other_query.is_sliced and
+        query.where == other_query.where and
+        query.alias_map == other_query.alias_map and
+        query.select == other_query.select and
+        query.extra == other_query.extra and
+        query.extra_tables == other_query.extra_tables and
+        query.order_by == other_query.order_by and
+        query.extra_order_by == other_query.extra_order_by and
+        query.distinct == other_query.distinct and
+        query.distinct_fields == other_query.distinct_fields
+    )
+
+
+def merge_deferred_loading(queryset_list):
+    """
+    Returns the deferred loading that loads every column any of the querysets loads,
+    & keeps the columns of its left hand side
+    """
+    loading = [qs.query.deferred_loading for qs in queryset_list]
+    if all(not defer for field_names, defer in loading):
+        # only() on every queryset
+        return frozenset().union(*(field_names for field_names, defer in loading)), False
+    if all(defer for field_names, defer in loading):
+        # defer() on every queryset
+        return frozenset.intersection(*(frozenset(field_names) for field_names, defer in loading)), True
+    return frozenset(), True
+
+
 def merge_querysets(queryset_list):
     new_qs = None
+    combined = []
     for qs in queryset_list:
         if new_qs is None:
             new_qs = qs
+        elif is_unrestricted(qs, new_qs) or any(is_same_query(qs, other) for other in combined):
+            continue
         else:
             new_qs = new_qs & qs
+        combined.append(qs)
 
+    if new_qs is not None and len(queryset_list) > 1:
+        deferred_loading = merge_deferred_loading(queryset_list)
+        if deferred_loading != new_qs.query.deferred_loading:
+            new_qs = new_qs._chain()
+            new_qs.query.deferred_loading = deferred_loading
     return new_qs
 
 
-def combine_querysets(queryset_list):
-    """Recursive helper. Combines the querysets in queryset_list and recursively
-        deduplicates and applies any prefetches"""
-    merged_queryset = merge_querysets(queryset_list)
-
-    # Combine duplicate prefetch types
-    prefetch_list = []
-    prefetch_map = {}
-
-    for queryset in queryset_list:
-        for prefetch in queryset._prefetch_related_lookups:
-            if isinstance(prefetch, str):
-                # String prefetch, just add it to the list
+def get_prefetch_to(prefetch):
+    if isinstance(prefetch, str):
+        return prefetch
+    return prefetch.prefetch_to
+
+
+class PrefetchTree(object):
+    """
+    Prefetch lookups of one or more querysets grouped by the path they prefetch to.
+    Lookups to the same path, e.g. from the selection and from the auth rules, are merged into a single
+    Prefetch whose queryset is the combination of theirs. Each lookup is visited once
+    """
+    def __init__(self, queryset_list):
+        self.queryset_list = queryset_list
+        # prefetch_to -> (first lookup, querysets of the lookups)
+        self.nodes = OrderedDict()
+        self.merged = len(queryset_list) > 1
+
+        for queryset in queryset_list:
+            for prefetch in queryset._prefetch_related_lookups:
+                prefetch_to = get_prefetch_to(prefetch)
+                node = self.nodes.get(prefetch_to)
+                if node is None:
+                    node = self.nodes[prefetch_to] = (prefetch, [])
+                else:
+                    # Same path prefetched twice, the queryset has to be rebuilt
+                    self.merged = True
+
+                if not isinstance(prefetch, str) and prefetch.queryset is not None:
+                    node[1].append(prefetch.queryset)
+
+    def get_queryset(self):
+        """Returns the combined queryset, the queryset itself if it has nothing to merge"""
+        merged_queryset = merge_querysets(self.queryset_list)
+        if not self.nodes:
+            # Base case, no prefetches
+            return merged_queryset
+
+        prefetch_list = []
+        changed = self.merged
+        for prefetch, querysets in self.nodes.values():
+            if not querysets:
+                # Plain lookup
                 prefetch_list.append(prefetch)
                 continue
 
-            through = prefetch.prefetch_through
-            # If through is in prefetch_list as a string, remove it
-            if through in prefetch_list:
-                prefetch_list = list(filter(lambda p: p != through, prefetch_list))
+            prefetch_queryset = PrefetchTree(querysets).get_queryset()
+            if len(querysets) == 1 and prefetch_queryset is querysets[0] and not isinstance(prefetch, str):
+                prefetch_list.append(prefetch)
+                continue
 
-            if through not in prefetch_map:
-                prefetch_map[through] = []
+            # A lookup with a queryset supersedes plain lookups to the same path
+            changed = True
+            prefetch_list.append(Prefetch(
+                prefetch if isinstance(prefetch, str) else prefetch.prefetch_through,
+                queryset=prefetch_queryset,
+                to_attr=None if isinstance(prefetch, str) else prefetch.to_attr,
+            ))
 
-            prefetch_map[through].append(prefetch.queryset)
+        if not changed:
+            return merged_queryset
 
-    if not prefetch_map.items():
-        # Base case, no prefetches, just returned the combined queryset
+        # Replace the lookups with a single clone
+        merged_queryset = merged_queryset._chain()
+        merged_queryset._prefetch_related_lookups = tuple(prefetch_list)
         return merged_queryset
 
-    for through, prefetch_querysets in prefetch_map.items():
-        # Has prefetches, recursive call
-        prefetch_qs = combine_querysets(prefetch_querysets)
-        prefetch_list.append(Prefetch(through, queryset=prefetch_qs))
 
-    merged_queryset = merged_queryset.prefetch_related(None)
-    merged_queryset = merged_queryset.prefetch_related(*prefetch_list)
-
-    return merged_queryset
+def combine_querysets(queryset_list):
+    """Combines the querysets in queryset_list and deduplicates their prefetches at every level"""
+    return PrefetchTree(queryset_list).get_queryset()
@@ -13,6 +13,8 @@ class GraphQLOptions:
             'Meta': type('Meta', (object, ), {
                 'model': self.model,
                 'fields': getattr(self.meta, 'fields', None),
+                'keyset_pagination': getattr(self.meta, 'keyset_pagination', None),
+                'permission_fields': getattr(self.meta, 'permission_fields', None),
             })
         })
 
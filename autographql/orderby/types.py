@@ -1,21 +1,56 @@
 import logging
+from collections import OrderedDict
 from functools import partial
 
 import graphene
-from bridgekeeper import perms
 from django.core.exceptions import ValidationError, PermissionDenied
-from django.db.models import ManyToOneRel, ManyToManyRel
+from django.db.models import ManyToOneRel, ManyToManyRel, Subquery, Value, Count, Sum, Avg, Min, Max, DecimalField, \
+    FloatField, Func
 from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Coalesce, Cast
 from graphene import Dynamic
 from graphene.types.inputobjecttype import InputObjectTypeOptions
 from graphene_django.registry import get_global_registry
 from graphene_django.utils import get_model_fields
 
-from autographql.auth.utils import get_model_permission, VIEW
+from autographql.auth.utils import get_model_permission, is_possible_for, VIEW
+from autographql.filters.types import get_aggregate_columns, get_related_name, get_related_rows
 from autographql.orderby.enums import OrderByDirection
 
 logger = logging.getLogger(__name__)
 
+# Aggregates of to many relations are annotated on the queryset and ordered by their alias
+ORDER_BY_ANNOTATION_PREFIX = '_orderby_'
+ORDER_BY_ANNOTATION = ORDER_BY_ANNOTATION_PREFIX + '{0}'
+
+AGGREGATE_COUNT = 'count'
+# Aggregates of a column of the related model, sum and avg only take numeric columns
+AGGREGATE_FUNCTIONS = OrderedDict([
+    ('sum', Sum),
+    ('avg', Avg),
+    ('min', Min),
+    ('max', Max),
+])
+NUMERIC_AGGREGATES = ('sum', 'avg')
+# Digits added to the integer part of a decimal column for the sum of its values
+AGGREGATE_DECIMAL_DIGITS = 10
+
+
+def get_exact_aggregate(expression, aggregate, column_field):
+    """
+    Keeps the aggregate of a column in a type its keyset cursor value compares equal to,
+    decimals are rounded to the places of the column and other averages are floats
+    """
+    if isinstance(column_field, DecimalField):
+        output_field = DecimalField(
+            max_digits=column_field.max_digits + AGGREGATE_DECIMAL_DIGITS,
+            decimal_places=column_field.decimal_places,
+        )
+        return Func(expression, Value(column_field.decimal_places), function='ROUND', output_field=output_field)
+    if aggregate == 'avg' and not isinstance(column_field, FloatField):
+        return Cast(expression, FloatField())
+    return expression
+
 
 def get_input_type(field):
     registry = get_global_registry()
@@ -24,6 +59,24 @@ def get_input_type(field):
     return model_type._meta.orderby_input_type
 
 
+def get_aggregate_input_type(field):
+    registry = get_global_registry()
+    model_type = registry.get_type_for_model(field.related_model)
+    return model_type._meta.aggregate_orderby_input_type
+
+
+def check_view_permission(user, model, input_type):
+    """Raises PermissionDenied if the user can not view any row of the model they order by"""
+    permission = get_model_permission(model, VIEW)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            'Checking permission {0} for user [{1}] to order on model [{2}]'.format(permission, user, input_type)
+        )
+
+    if not (is_possible_for(user, permission) or user.has_perm(permission)):
+        raise PermissionDenied('User {0} does not have permission to order using {1}'.format(str(user), input_type))
+
+
 class ModelAutoOrderByInputObjectTypeOptions(InputObjectTypeOptions):
     model = None
 
@@ -104,24 +157,92 @@ class ModelAutoOrderByInputObjectType(AutoOrderByInputObjectType):
         # Dynamic field
         if isinstance(registry.get_converted_field(node), Dynamic):
             if isinstance(node, ManyToOneRel) or isinstance(node, ManyToManyRel):
-                # Array relationship, we don't handle these yet
-                # TODO: Add aggregation and allow ordering by the aggregates
-                return None, None
+                # Array relationship, ordered by an aggregate of the related rows
+                return node.name, graphene.InputField(partial(get_aggregate_input_type, node))
             return node.name, graphene.InputField(partial(get_input_type, node))
 
         # Order by direction
         return node.name, graphene.InputField(OrderByDirection)
 
-    def _get_order_by(self, lookup_path='', context=None):
-        user = context.user
-        order_by = super()._get_order_by(lookup_path, context=context)
+    def _get_order_by(self, lookup_path='', context=None, annotations=None, **kwargs):
+        # The model is passed down to the aggregates of its to many relations
+        order_by = super()._get_order_by(
+            lookup_path, context=context, annotations=annotations, model=self._meta.model)
         if not order_by:
             return order_by
 
-        # Permission check
-        permission = get_model_permission(self._meta.model, VIEW)
-        logger.debug('Checking permission {0} for user [{1}] to order on model [{2}]'.format(permission, user, self.__class__))
+        check_view_permission(context.user, self._meta.model, self.__class__)
+        return order_by
 
-        if (permission in perms and perms[permission].is_possible_for(user)) or user.has_perm(permission):
+
+class ModelAutoAggregateOrderByInputObjectType(AutoOrderByInputObjectType):
+    """
+    Generated input type that orders by an aggregate of the rows of a to many relation to the model in its meta,
+    the aggregate is annotated on the queryset as a subquery so that every row is still returned once
+    """
+    @classmethod
+    def __init_subclass_with_meta__(cls, fields=None, model=None, _meta=None, **options):
+        if not _meta:
+            _meta = ModelAutoOrderByInputObjectTypeOptions(cls)
+
+        if not model:
+            raise RuntimeError('model is required in Meta class for {0}'.format(cls))
+        _meta.model = model
+
+        columns, numeric_columns = get_aggregate_columns(model, fields)
+        columns_type = cls._get_columns_input_type(model.__name__ + 'ColumnsOrderByInput', columns)
+        numeric_columns_type = cls._get_columns_input_type(
+            model.__name__ + 'NumericColumnsOrderByInput', numeric_columns)
+
+        aggregate_fields = OrderedDict([(AGGREGATE_COUNT, graphene.InputField(OrderByDirection))])
+        for name in AGGREGATE_FUNCTIONS:
+            input_type = numeric_columns_type if name in NUMERIC_AGGREGATES else columns_type
+            if input_type:
+                aggregate_fields[name] = graphene.InputField(input_type)
+
+        if _meta.fields:
+            _meta.fields.update(aggregate_fields)
+        else:
+            _meta.fields = aggregate_fields
+
+        super().__init_subclass_with_meta__(_meta=_meta, **options)
+
+    @classmethod
+    def _get_columns_input_type(cls, name, columns):
+        """Input type with an order by direction per column, None if there are no columns"""
+        if not columns:
+            return None
+        return type(name, (AutoOrderByInputObjectType,), {
+            field.name: graphene.InputField(OrderByDirection) for field in columns
+        })
+
+    def _get_order_by(self, lookup_path='', context=None, annotations=None, model=None, **kwargs):
+        # Path of the aggregate and column relative to the relation, e.g. -sum__freight
+        order_by = super()._get_order_by(context=context)
+        if not order_by:
             return order_by
-        raise PermissionDenied('User {0} does not have permission to order using {1}'.format(str(user), self.__class__))
+
+        if annotations is None or model is None:
+            raise RuntimeError('{0} can only be used in the order by of a model'.format(self.__class__))
+
+        check_view_permission(context.user, self._meta.model, self.__class__)
+
+        descending = order_by.startswith('-')
+        aggregate, _, column = order_by.lstrip('-').partition(LOOKUP_SEP)
+
+        path, _, field_name = lookup_path.rpartition(LOOKUP_SEP)
+        model_field = model._meta.get_field(field_name)
+        # Aggregated per outer row, the outer query is not grouped
+        rows = get_related_rows(model_field, path).order_by().values(get_related_name(model_field))
+        if aggregate == AGGREGATE_COUNT:
+            expression = Coalesce(Subquery(rows.annotate(value=Count('pk')).values('value')), Value(0))
+        else:
+            rows = rows.annotate(value=AGGREGATE_FUNCTIONS[aggregate](column))
+            column_field = model_field.related_model._meta.get_field(column)
+            expression = get_exact_aggregate(Subquery(rows.values('value')), aggregate, column_field)
+
+        alias = ORDER_BY_ANNOTATION.format(len(annotations))
+        annotations[alias] = expression
+        if descending:
+            return '-' + alias
+        return alias
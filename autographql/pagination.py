@@ -0,0 +1,363 @@
+import base64
+import binascii
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q, OrderBy
+from django.utils.dateparse import parse_datetime, parse_date, parse_time, parse_duration
+from django.utils.duration import duration_iso_string
+from graphene.relay import PageInfo
+from graphql_relay import get_offset_with_default, offset_to_cursor, cursor_to_offset
+
+from autographql.auth.annotations import PERMISSION_ANNOTATION_PREFIX
+from autographql.auth.rules import MANY_RELATION_ANNOTATION_PREFIX
+from autographql.orderby.types import ORDER_BY_ANNOTATION_PREFIX
+from autographql.settings import autographql_settings
+
+logger = logging.getLogger(__name__)
+
+KEYSET_CURSOR_PREFIX = 'keyset:'
+KEYSET_ANNOTATION = '_keyset_{0}'
+# Values json can not hold are stored as {type: string} in the cursor, at full precision.
+# Datetime comes before date, it is a subclass of it
+KEYSET_VALUE_TYPES = OrderedDict([
+    ('datetime', (datetime.datetime, datetime.datetime.isoformat, parse_datetime)),
+    ('date', (datetime.date, datetime.date.isoformat, parse_date)),
+    ('time', (datetime.time, datetime.time.isoformat, parse_time)),
+    ('duration', (datetime.timedelta, duration_iso_string, parse_duration)),
+    ('decimal', (decimal.Decimal, str, decimal.Decimal)),
+    ('uuid', (uuid.UUID, str, uuid.UUID)),
+])
+
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATE = 'estimate'
+COUNT_CACHED = 'cached'
+COUNT_STRATEGIES = (COUNT_EXACT, COUNT_ESTIMATE, COUNT_CACHED)
+COUNT_CACHE_PREFIX = 'autographql:count:'
+
+
+def get_keyset_ordering(queryset):
+    """
+    Returns the ordering of the queryset as a list of (lookup path, descending) tuples.
+    The primary key is appended so that every row has a unique position
+    """
+    query = queryset.query
+    if query.order_by:
+        ordering = query.order_by
+    elif query.default_ordering:
+        ordering = query.get_meta().ordering or []
+    else:
+        ordering = []
+
+    keys = []
+    for order in ordering:
+        if isinstance(order, str):
+            if order == '?':
+                raise ValidationError('Random ordering can not be used with keyset pagination')
+            if order.startswith('-'):
+                keys.append((order[1:], True))
+            else:
+                keys.append((order.lstrip('+'), False))
+        elif isinstance(order, OrderBy) and isinstance(order.expression, F):
+            keys.append((order.expression.name, order.descending))
+        elif isinstance(order, F):
+            keys.append((order.name, False))
+        else:
+            raise ValidationError('Keyset pagination only supports ordering on model fields')
+
+    pk_name = queryset.model._meta.pk.name
+    if not keys or keys[-1][0] not in ('pk', pk_name):
+        keys.append(('pk', False))
+
+    return keys
+
+
+def get_keyset_order_by(keys, reverse=False):
+    """Order by expressions for the keys, nulls always come after the values in the forward direction"""
+    nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+    order_by = []
+    for path, descending in keys:
+        if descending != reverse:
+            order_by.append(F(path).desc(**nulls))
+        else:
+            order_by.append(F(path).asc(**nulls))
+    return order_by
+
+
+def get_keyset_q(keys, values, after=True):
+    """
+    Builds the lexicographic (col, pk) > (value, id) comparison for the cursor values,
+    or the < comparison for the rows before the cursor
+    """
+    if len(keys) != len(values):
+        raise ValidationError('Cursor does not match the requested ordering')
+
+    lookup = Q(pk__in=[])
+    equal = Q()
+    for (path, descending), value in zip(keys, values):
+        if value is None:
+            # Nulls come last
+            if not after:
+                lookup |= equal & Q(**{path + '__isnull': False})
+            equal &= Q(**{path + '__isnull': True})
+            continue
+
+        if after != descending:
+            strict = Q(**{path + '__gt': value})
+        else:
+            strict = Q(**{path + '__lt': value})
+        if after:
+            strict |= Q(**{path + '__isnull': True})
+
+        lookup |= equal & strict
+        equal &= Q(**{path: value})
+
+    return lookup
+
+
+def encode_keyset_value(value):
+    for type_name, (value_type, encode, decode) in KEYSET_VALUE_TYPES.items():
+        if isinstance(value, value_type):
+            return {type_name: encode(value)}
+    return value
+
+
+def decode_keyset_value(value):
+    """Value of a cursor as it was read from the row, None if it is not a value of a known type"""
+    if not isinstance(value, dict):
+        return value
+    if len(value) != 1:
+        return None
+    (type_name, data), = value.items()
+    if type_name not in KEYSET_VALUE_TYPES or not isinstance(data, str):
+        return None
+    try:
+        return KEYSET_VALUE_TYPES[type_name][2](data)
+    except (ValueError, decimal.InvalidOperation):
+        return None
+
+
+def keyset_to_cursor(values):
+    data = KEYSET_CURSOR_PREFIX + json.dumps([encode_keyset_value(value) for value in values])
+    return base64.b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def cursor_to_keyset(cursor):
+    try:
+        data = base64.b64decode(cursor.encode('ascii')).decode('utf-8')
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValidationError('Invalid cursor {0}'.format(cursor))
+
+    if not data.startswith(KEYSET_CURSOR_PREFIX):
+        raise ValidationError('Invalid cursor {0}'.format(cursor))
+
+    try:
+        values = json.loads(data[len(KEYSET_CURSOR_PREFIX):])
+    except ValueError:
+        raise ValidationError('Invalid cursor {0}'.format(cursor))
+
+    if not isinstance(values, list):
+        raise ValidationError('Invalid cursor {0}'.format(cursor))
+
+    decoded = []
+    for value in values:
+        decoded_value = decode_keyset_value(value)
+        if decoded_value is None and value is not None:
+            raise ValidationError('Invalid cursor {0}'.format(cursor))
+        decoded.append(decoded_value)
+    return decoded
+
+
+def connection_from_keyset(connection, queryset, args):
+    """
+    Slices the queryset with keyset comparisons instead of offsets so that
+    any page costs the same as the first one on an indexed ordering
+    """
+    first = args.get('first')
+    last = args.get('last')
+    after = args.get('after')
+    before = args.get('before')
+
+    if first is not None and first < 0:
+        raise ValidationError("Argument 'first' must be a non-negative integer.")
+    if last is not None and last < 0:
+        raise ValidationError("Argument 'last' must be a non-negative integer.")
+
+    keys = get_keyset_ordering(queryset)
+    queryset = queryset.annotate(**{
+        KEYSET_ANNOTATION.format(i): F(path) for i, (path, descending) in enumerate(keys)
+    })
+
+    if after:
+        queryset = queryset.filter(get_keyset_q(keys, cursor_to_keyset(after), after=True))
+    if before:
+        queryset = queryset.filter(get_keyset_q(keys, cursor_to_keyset(before), after=False))
+
+    has_previous_page = False
+    has_next_page = False
+    if first is None and last is not None:
+        # Only the end of the list is needed, read it backwards
+        rows = list(queryset.order_by(*get_keyset_order_by(keys, reverse=True))[:last + 1])
+        has_previous_page = len(rows) > last
+        rows = rows[:last]
+        rows.reverse()
+    else:
+        queryset = queryset.order_by(*get_keyset_order_by(keys))
+        if first is not None:
+            # One extra row tells if there is a next page
+            rows = list(queryset[:first + 1])
+            has_next_page = len(rows) > first
+            rows = rows[:first]
+        else:
+            rows = list(queryset)
+
+        if last is not None:
+            has_previous_page = len(rows) > last
+            rows = rows[max(len(rows) - last, 0):] if last else []
+
+    edges = [
+        connection.Edge(
+            node=row,
+            cursor=keyset_to_cursor([getattr(row, KEYSET_ANNOTATION.format(i)) for i in range(len(keys))]),
+        )
+        for row in rows
+    ]
+
+    return connection(
+        edges=edges,
+        page_info=PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page,
+        ),
+    )
+
+
+def connection_from_offset(connection, queryset, args):
+    """
+    Same slicing as graphene-django's offset connections but without counting the queryset first.
+    One extra row is fetched to tell if there is a next page
+    """
+    first = args.get('first')
+    last = args.get('last')
+    before = args.get('before')
+
+    if first is not None and first < 0:
+        raise ValidationError("Argument 'first' must be a non-negative integer.")
+    if last is not None and last < 0:
+        raise ValidationError("Argument 'last' must be a non-negative integer.")
+
+    start = get_offset_with_default(args.get('after'), -1) + 1
+    end = cursor_to_offset(before) if before else None
+
+    has_previous_page = False
+    has_next_page = False
+    if first is None:
+        if last is not None and end is not None:
+            slice_start = max(start, end - last)
+            has_previous_page = slice_start > start
+            start = slice_start
+        rows = list(queryset[start:end])
+    else:
+        fetch_end = start + first + 1
+        if end is not None:
+            fetch_end = min(fetch_end, end)
+        rows = list(queryset[start:fetch_end])
+        has_next_page = len(rows) > first
+        rows = rows[:first]
+
+        if last is not None and len(rows) > last:
+            has_previous_page = True
+            start += len(rows) - last
+            rows = rows[len(rows) - last:]
+
+    edges = [
+        connection.Edge(node=row, cursor=offset_to_cursor(start + index))
+        for index, row in enumerate(rows)
+    ]
+
+    return connection(
+        edges=edges,
+        page_info=PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page,
+        ),
+    )
+
+
+def get_count_strategy(model):
+    graphql_meta = getattr(model, '_graphql_meta', None)
+    strategy = getattr(getattr(graphql_meta, 'meta', None), 'count_strategy', None)
+    if strategy is None:
+        strategy = autographql_settings.CONNECTION_COUNT
+    if strategy not in COUNT_STRATEGIES:
+        raise RuntimeError('Invalid count strategy {0} for {1}'.format(strategy, model))
+    return strategy
+
+
+def get_total_count(queryset):
+    """
+    Counts the rows of a connection queryset, ordering, joins and prefetches are stripped
+    from the count query since they do not change the number of rows
+    """
+    if queryset._result_cache is not None:
+        return len(queryset._result_cache)
+
+    queryset = queryset.order_by().prefetch_related(None)
+    queryset.query.select_related = False
+    for name in list(queryset.query.annotations):
+        if name.startswith((MANY_RELATION_ANNOTATION_PREFIX, PERMISSION_ANNOTATION_PREFIX, ORDER_BY_ANNOTATION_PREFIX)):
+            # Only read by the permission checks and the ordering of the rows
+            del queryset.query.annotations[name]
+
+    strategy = get_count_strategy(queryset.model)
+    if strategy == COUNT_ESTIMATE:
+        estimate = get_estimated_count(queryset)
+        if estimate is not None and estimate >= autographql_settings.CONNECTION_COUNT_ESTIMATE_THRESHOLD:
+            return estimate
+    elif strategy == COUNT_CACHED:
+        return get_cached_count(queryset)
+
+    return queryset.count()
+
+
+def get_estimated_count(queryset):
+    """Row estimate of the query planner, only available on postgresql"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    try:
+        return int(plan[0]['Plan']['Plan Rows'])
+    except (LookupError, TypeError, ValueError):
+        logger.warning('Could not read the row estimate of {0}'.format(queryset.model))
+        return None
+
+
+def get_cached_count(queryset):
+    """Exact count that is cached in the django cache for CONNECTION_COUNT_CACHE_TIMEOUT seconds"""
+    sql, params = queryset.query.sql_with_params()
+    key = COUNT_CACHE_PREFIX + hashlib.sha1('{0}{1}'.format(sql, params).encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, autographql_settings.CONNECTION_COUNT_CACHE_TIMEOUT)
+    return count
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+
+from graphql import parse, validate, GraphQLError
+from graphene_django.settings import graphene_settings
+
+from autographql.cache import LRUCache
+from autographql.settings import autographql_settings
+
+PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound'
+PERSISTED_QUERY_HASH_MISMATCH = 'provided sha does not match query'
+
+# Stores by schema and validation rules, a document is only valid for the schema it was validated against
+persisted_query_stores = {}
+persisted_query_stores_lock = threading.Lock()
+
+# Persisted query executed by the current thread, see parse_document and validate_document
+current_persisted_query = threading.local()
+
+
+def get_query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def get_persisted_query_hash(extensions):
+    """Reads the sha256 hash out of the apollo style persistedQuery request extension"""
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            return None
+
+    if not isinstance(extensions, dict):
+        return None
+
+    persisted_query = extensions.get('persistedQuery')
+    if not isinstance(persisted_query, dict):
+        return None
+
+    return persisted_query.get('sha256Hash')
+
+
+class PersistedQuery(object):
+    """A query document that has been parsed and validated once"""
+    def __init__(self, query, document, validation_errors):
+        self.query = query
+        self.document = document
+        self.validation_errors = validation_errors
+
+
+class PersistedQueryStore(object):
+    """
+    In memory store of the persisted queries of a schema keyed by the sha256 hash of the query.
+    Queries from the manifest are kept forever, queries registered on first use are kept in a bounded cache
+    """
+    def __init__(self, schema, validation_rules=None):
+        self.schema = schema
+        self.validation_rules = validation_rules
+        self.manifest_queries = {}
+        self.registered_queries = LRUCache(autographql_settings.PERSISTED_QUERIES_CACHE_SIZE)
+        self._manifest_loaded = False
+        self._lock = threading.Lock()
+
+    def get(self, query_hash):
+        persisted_query = self.manifest_queries.get(query_hash)
+        if persisted_query is None:
+            persisted_query = self.registered_queries.get(query_hash)
+        return persisted_query
+
+    def register(self, query):
+        """Parses and validates the query and stores it by its hash"""
+        persisted_query = self.compile(query)
+        self.registered_queries.set(get_query_hash(query), persisted_query)
+        return persisted_query
+
+    def compile(self, query):
+        # Parse errors are raised, there is nothing to persist
+        document = parse(query)
+        validation_errors = validate(
+            self.schema,
+            document,
+            self.validation_rules,
+            graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+        return PersistedQuery(query, document, validation_errors)
+
+    def load_manifest(self):
+        """Loads the manifest written by the persist_queries management command, only done once"""
+        if self._manifest_loaded:
+            return
+
+        with self._lock:
+            if self._manifest_loaded:
+                return
+
+            path = autographql_settings.PERSISTED_QUERIES_MANIFEST
+            if path:
+                with open(path) as manifest:
+                    queries = json.load(manifest)
+                for query_hash, query in queries.items():
+                    self.manifest_queries[query_hash] = self.compile(query)
+
+            self._manifest_loaded = True
+
+    def __contains__(self, query_hash):
+        return self.get(query_hash) is not None
+
+
+def get_persisted_query_store(schema, validation_rules=None):
+    """Returns the store of the queries validated against the schema and the validation rules"""
+    key = (schema, tuple(validation_rules or ()))
+    store = persisted_query_stores.get(key)
+    if store is None:
+        with persisted_query_stores_lock:
+            store = persisted_query_stores.get(key)
+            if store is None:
+                store = persisted_query_stores[key] = PersistedQueryStore(schema, validation_rules)
+    return store
+
+
+@contextmanager
+def use_persisted_query(persisted_query):
+    """Serves the document and the validation errors of the persisted query to parse_document and validate_document"""
+    previous = getattr(current_persisted_query, 'value', None)
+    current_persisted_query.value = persisted_query
+    try:
+        yield
+    finally:
+        current_persisted_query.value = previous
+
+
+def parse_document(source, *args, **kwargs):
+    """
+    graphql parse for GraphQLView.execute_graphql_request,
+    the persisted query being executed is not parsed again
+    """
+    persisted_query = getattr(current_persisted_query, 'value', None)
+    if persisted_query is not None and source is persisted_query.query:
+        return persisted_query.document
+    return parse(source, *args, **kwargs)
+
+
+def validate_document(schema, document, *args, **kwargs):
+    """
+    graphql validate for GraphQLView.execute_graphql_request,
+    the persisted query being executed is not validated again
+    """
+    persisted_query = getattr(current_persisted_query, 'value', None)
+    if persisted_query is not None and document is persisted_query.document:
+        return persisted_query.validation_errors
+    return validate(schema, document, *args, **kwargs)
+
+
+def persisted_query_not_found():
+    return GraphQLError(PERSISTED_QUERY_NOT_FOUND, extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'})
@@ -1,7 +1,9 @@
 from graphene import relay
 from graphene.utils.str_converters import to_snake_case
 
-from autographql.fields import OptimizedDjangoConnectionField
+from autographql.fields import OptimizedDjangoConnectionField, KeysetDjangoConnectionField
+from autographql.settings import autographql_settings
+from autographql.utils import get_meta
 
 
 class DjangoQueryFactory(object):
@@ -11,6 +13,7 @@ class DjangoQueryFactory(object):
         list_attribute_name = None
         retrieve = True
         list = True
+        keyset_pagination = None
         resolve_decorators = []
 
     @classmethod
@@ -37,11 +40,16 @@ class DjangoQueryFactory(object):
             # Default to list_ + snake cased model name
             list_attribute_name = 'list_' + to_snake_case(cls.Meta.type._meta.model.__name__)
 
+        if get_meta(cls.Meta, 'keyset_pagination', autographql_settings.KEYSET_PAGINATION):
+            connection_field_class = KeysetDjangoConnectionField
+        else:
+            connection_field_class = OptimizedDjangoConnectionField
+
         class Query(object):
             if retrieve_attribute_name is not None:
                 vars()[retrieve_attribute_name] = relay.Node.Field(cls.Meta.type)
 
             if list_attribute_name is not None:
-                vars()[list_attribute_name] = OptimizedDjangoConnectionField(cls.Meta.type)
+                vars()[list_attribute_name] = connection_field_class(cls.Meta.type)
 
         return Query
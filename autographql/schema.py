@@ -26,6 +26,8 @@ class RelayDjangoSerializerSchemaFactory(object):
         create_attribute_name = None
         update_attribute_name = None
         delete_attribute_name = None
+        keyset_pagination = None
+        permission_fields = None
 
     @classmethod
     def build(cls):
@@ -53,6 +55,8 @@ class RelayDjangoSerializerSchemaFactory(object):
         b_create_attribute_name = get_meta(cls.Meta, 'create_attribute_name', 'create_' + model_name_snaked)
         b_update_attribute_name = get_meta(cls.Meta, 'update_attribute_name', 'update_' + model_name_snaked)
         b_delete_attribute_name = get_meta(cls.Meta, 'delete_attribute_name', 'delete_' + model_name_snaked)
+        b_keyset_pagination = get_meta(cls.Meta, 'keyset_pagination', None)
+        b_permission_fields = get_meta(cls.Meta, 'permission_fields', None)
 
         # Autogenerate Type
         if node_type:
@@ -64,6 +68,7 @@ class RelayDjangoSerializerSchemaFactory(object):
                     'model': model_class,
                     'interfaces': (relay.Node,),
                     'fields': type_fields,
+                    'permission_fields': b_permission_fields,
                 })
             })
 
@@ -86,6 +91,7 @@ class RelayDjangoSerializerSchemaFactory(object):
                 list = 'list' in allowed_actions
                 retrieve_attribute_name = b_retrieve_attribute_name
                 list_attribute_name = b_list_attribute_name
+                keyset_pagination = b_keyset_pagination
 
         class MutationFieldFactory(DjangoSerializerMutationFieldFactory):
             class Meta:
@@ -0,0 +1,54 @@
+from django.conf import settings
+
+DEFAULTS = {
+    # Maximum number of compiled optimizer plans kept in memory, 0 disables the plan cache
+    'OPTIMIZER_PLAN_CACHE_SIZE': 512,
+    # Maximum number of forward relations joined into one query, deeper relations are prefetched
+    'OPTIMIZER_MAX_JOIN_DEPTH': 3,
+    # Use keyset cursors instead of offsets for the generated list connection fields
+    'KEYSET_PAGINATION': False,
+    # How totalCount is computed: exact, estimate (planner estimate on postgresql) or cached
+    'CONNECTION_COUNT': 'exact',
+    # Estimates below this number of rows are replaced by an exact count
+    'CONNECTION_COUNT_ESTIMATE_THRESHOLD': 100000,
+    # Seconds a cached count is kept in the django cache
+    'CONNECTION_COUNT_CACHE_TIMEOUT': 60,
+    # Maximum number of users whose compiled permission rule queries are shared between requests
+    'USER_QUERY_CACHE_SIZE': 1000,
+    # Seconds the compiled rule queries of a user are shared between requests, 0 builds them once per request
+    'USER_QUERY_CACHE_TIMEOUT': 0,
+    # How where filters through to many relations are applied: join or exists (a subquery per relation)
+    'TO_MANY_FILTERS': 'join',
+    # Maximum number of is_possible_for results shared between requests
+    'POSSIBLE_PERMISSION_CACHE_SIZE': 10000,
+    # Seconds an is_possible_for result is shared between requests, 0 computes it once per request
+    'POSSIBLE_PERMISSION_CACHE_TIMEOUT': 0,
+    # Add canView, canUpdate and canDelete fields to the generated object types
+    'PERMISSION_FIELDS': False,
+    # Report the sql queries of every field, 'extensions' adds them to the response and 'log' logs them
+    'INSTRUMENTATION': False,
+    # Accept apollo style persisted queries in OptimizedGraphQLView
+    'PERSISTED_QUERIES': False,
+    # Json file written by the persist_queries management command
+    'PERSISTED_QUERIES_MANIFEST': None,
+    # Only execute hashes from the manifest, queries are not registered on first use
+    'PERSISTED_QUERIES_REJECT_UNKNOWN': False,
+    # Maximum number of queries registered on first use that are kept in memory
+    'PERSISTED_QUERIES_CACHE_SIZE': 1000,
+}
+
+
+class AutoGraphQLSettings(object):
+    """
+    Settings are read from the AUTOGRAPHQL dictionary in the django settings,
+    any setting that is not defined there falls back to its default value
+    """
+    def __getattr__(self, name):
+        if name not in DEFAULTS:
+            raise AttributeError('Invalid autographql setting: {0}'.format(name))
+
+        user_settings = getattr(settings, 'AUTOGRAPHQL', {})
+        return user_settings.get(name, DEFAULTS[name])
+
+
+autographql_settings = AutoGraphQLSettings()
@@ -0,0 +1,165 @@
+import types
+
+import graphene
+from bridgekeeper.rules import Attribute, always_allow, always_deny
+from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from graphene import relay
+from rest_framework.serializers import ModelSerializer
+
+from autographql.auth.annotations import PERMISSION_ANNOTATION_PREFIX, annotate_permissions
+from autographql.auth.utils import VIEW, UPDATE, DELETE, get_model_permission
+from autographql.fields import OptimizedDjangoConnectionField
+from autographql.mutation import DjangoSerializerMutationFieldFactory
+from autographql.tests.models import Shippers
+from autographql.tests.utils import NorthwindTestCase, execute, set_permissions
+from autographql.types import AutoDjangoObjectType
+
+SHIPPERS_QUERY = '''
+{
+    shippers(first: 10) {
+        %s
+        edges { node { shipperId canView canUpdate canDelete } }
+    }
+}
+'''
+
+
+class PermissionShippers(AutoDjangoObjectType):
+    class Meta:
+        model = Shippers
+        interfaces = (relay.Node,)
+        fields = ('shipper_id', 'company_name')
+        permission_fields = True
+        # The generated Shippers type stays the one of the other schemas
+        skip_registry = True
+
+
+class ShippersSerializer(ModelSerializer):
+    class Meta:
+        model = Shippers
+        fields = ('shipper_id', 'company_name')
+
+
+class ShippersMutationFactory(DjangoSerializerMutationFieldFactory):
+    class Meta:
+        type = PermissionShippers
+        serializer_class = ShippersSerializer
+
+
+class Query(graphene.ObjectType):
+    shippers = OptimizedDjangoConnectionField(PermissionShippers)
+
+
+schema = graphene.Schema(query=Query)
+
+
+class PermissionFieldsTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+        cls.superuser = get_user_model().objects.create(username='superuser', is_superuser=True)
+
+    def set_rules(self, **rules):
+        """Replaces the rules of the shippers by permission type until the end of the test"""
+        previous = set_permissions({
+            get_model_permission(Shippers, permission_type): rule for permission_type, rule in rules.items()
+        })
+        self.addCleanup(set_permissions, previous)
+
+    def get_shippers(self, user, total_count=False):
+        with CaptureQueriesContext(connection) as queries:
+            result = execute(SHIPPERS_QUERY % ('totalCount' if total_count else ''), user, schema=schema)
+        self.assertIsNone(result.errors)
+        shippers = {}
+        for edge in result.data['shippers']['edges']:
+            node = edge['node']
+            shippers[int(node['shipperId'])] = (node['canView'], node['canUpdate'], node['canDelete'])
+        return shippers, result.data['shippers'], queries
+
+    def test_rules_are_computed_with_the_rows(self):
+        self.set_rules(**{UPDATE: Attribute('company_name', 'Speedy Express')})
+        shippers, data, queries = self.get_shippers(self.user)
+        speedy_express = Shippers.objects.get(company_name='Speedy Express').pk
+        self.assertEqual(shippers, {
+            pk: (True, pk == speedy_express, True) for pk in Shippers.objects.values_list('pk', flat=True)
+        })
+        # The EXISTS subquery of the rule is part of the query of the rows
+        self.assertEqual(len(queries), 1)
+        self.assertIn('EXISTS', queries[0]['sql'])
+
+    def test_universal_and_empty_rules_are_constants(self):
+        self.set_rules(**{UPDATE: always_allow, DELETE: always_deny})
+        shippers, data, queries = self.get_shippers(self.user)
+        self.assertEqual(set(shippers.values()), {(True, True, False)})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('EXISTS', queries[0]['sql'])
+
+    def test_superuser(self):
+        self.set_rules(**{VIEW: always_allow, UPDATE: always_deny, DELETE: Attribute('company_name', 'Nobody')})
+        shippers, data, queries = self.get_shippers(self.superuser)
+        # Superusers are answered by has_perm, no annotation is needed
+        self.assertEqual(set(shippers.values()), {(True, True, True)})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('EXISTS', queries[0]['sql'])
+
+    def test_total_count(self):
+        self.set_rules(**{UPDATE: Attribute('company_name', 'Speedy Express')})
+        shippers, data, queries = self.get_shippers(self.user, total_count=True)
+        self.assertEqual(data['totalCount'], Shippers.objects.count())
+        self.assertEqual(len(shippers), Shippers.objects.count())
+        # The rows and their count, the annotations are left out of the count
+        self.assertEqual(len(queries), 2)
+        count_sql = [query['sql'] for query in queries if 'COUNT(' in query['sql']]
+        self.assertEqual(len(count_sql), 1)
+        self.assertNotIn('EXISTS', count_sql[0])
+
+
+class MutationInstanceTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    def setUp(self):
+        request = RequestFactory().post('/graphql')
+        request.user = self.user
+        self.info = types.SimpleNamespace(context=request)
+
+    def set_rule(self, permission_type, rule):
+        previous = set_permissions({get_model_permission(Shippers, permission_type): rule})
+        self.addCleanup(set_permissions, previous)
+
+    def get_shipper(self, permission_type, company_name):
+        """Shipper loaded with its permission annotation, like the optimizer loads it"""
+        return annotate_permissions(Shippers.objects.all(), self.user, [permission_type]).get(company_name=company_name)
+
+    def test_update_checks_the_annotation(self):
+        self.set_rule(UPDATE, Attribute('company_name', 'Speedy Express'))
+        mutation = ShippersMutationFactory.get_update_mutation()
+
+        shipper = self.get_shipper(UPDATE, 'Speedy Express')
+        # Only the update of the row, the instance is neither loaded nor checked again
+        with self.assertNumQueries(1):
+            payload = mutation.update(None, self.info, instance=shipper, company_name='Speedier Express')
+        self.assertIsNone(payload.errors)
+        self.assertEqual(Shippers.objects.get(pk=shipper.pk).company_name, 'Speedier Express')
+        # The annotation is stale once the row is changed
+        self.assertFalse([name for name in vars(shipper) if name.startswith(PERMISSION_ANNOTATION_PREFIX)])
+
+        shipper = self.get_shipper(UPDATE, 'United Package')
+        with self.assertNumQueries(0), self.assertRaises(PermissionDenied):
+            mutation.update(None, self.info, instance=shipper, company_name='United Packages')
+
+    def test_delete_checks_the_annotation(self):
+        self.set_rule(DELETE, always_deny)
+        mutation = ShippersMutationFactory.get_delete_mutation()
+
+        shipper = self.get_shipper(DELETE, 'Speedy Express')
+        with self.assertNumQueries(0), self.assertRaises(PermissionDenied):
+            mutation.delete(None, self.info, instance=shipper, id='')
+        self.assertTrue(Shippers.objects.filter(pk=shipper.pk).exists())
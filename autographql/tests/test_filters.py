@@ -0,0 +1,282 @@
+import decimal
+
+from bridgekeeper.rules import always_deny
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from graphql import get_named_type
+
+from autographql.schema import SchemaGenerator
+from autographql.tests.models import Customers, Orders
+from autographql.tests.utils import TEST_APP_LABEL, NorthwindTestCase, execute
+
+# Input types generated for each model, every other filter input is shared by the models
+MODEL_FILTER_INPUTS = ('FilterInput', 'RelationFilterInput', 'ColumnsFilterInput', 'NumericColumnsFilterInput')
+
+PAGE_SIZE = 100
+
+ORDERS_QUERY = '''
+query ($where: OrdersFilterInput) {
+    listOrders(first: %d, where: $where, orderBy: [{orderId: ASC}]) {
+        totalCount
+        edges { node { orderId } }
+    }
+}
+''' % PAGE_SIZE
+
+CUSTOMERS_QUERY = '''
+query ($where: CustomersFilterInput) {
+    listCustomers(first: %d, where: $where, orderBy: [{customerId: ASC}]) {
+        totalCount
+        edges { node { customerId } }
+    }
+}
+''' % PAGE_SIZE
+
+
+class FilterInputTypesTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.graphql_schema = SchemaGenerator.get_schema().graphql_schema
+
+    def get_field_type(self, type_name, field_name):
+        return get_named_type(self.graphql_schema.get_type(type_name).fields[field_name].type)
+
+    def test_lookup_types_are_shared_by_field_class(self):
+        date_lookups = self.get_field_type('OrdersFilterInput', 'orderDate')
+        self.assertEqual(date_lookups.name, 'DateFieldFilterInput')
+        self.assertIs(self.get_field_type('OrdersFilterInput', 'shippedDate'), date_lookups)
+        self.assertIs(self.get_field_type('OrdersColumnsFilterInput', 'requiredDate'), date_lookups)
+
+        datetime_lookups = self.get_field_type('EmployeesFilterInput', 'birthDate')
+        self.assertEqual(datetime_lookups.name, 'DateTimeFieldFilterInput')
+        self.assertIs(self.get_field_type('EmployeesFilterInput', 'hireDate'), datetime_lookups)
+
+        # Transforms are shared too
+        year_lookups = self.get_field_type('DateFieldFilterInput', 'year')
+        self.assertEqual(year_lookups.name, 'ExtractYearFilterInput')
+        self.assertIs(self.get_field_type('DateTimeFieldFilterInput', 'year'), year_lookups)
+
+    def test_no_lookup_types_per_model_field(self):
+        model_names = [model.__name__ for model in apps.get_app_config(TEST_APP_LABEL).get_models()]
+        for name in self.graphql_schema.type_map:
+            for model_name in model_names:
+                if name.startswith(model_name) and name.endswith('FilterInput'):
+                    self.assertIn(name[len(model_name):], MODEL_FILTER_INPUTS)
+
+    def test_lookup_fields(self):
+        lookups = self.graphql_schema.get_type('CharFieldFilterInput').fields
+        self.assertEqual(str(lookups['exact'].type), 'String')
+        self.assertEqual(str(lookups['in'].type), '[String]')
+        self.assertEqual(str(lookups['isnull'].type), 'Boolean')
+
+        lookups = self.graphql_schema.get_type('DateFieldFilterInput').fields
+        self.assertEqual(str(lookups['gte'].type), 'Date')
+        self.assertEqual(str(lookups['weekDay'].type), 'WeekDay')
+        self.assertEqual(str(lookups['month'].type), 'Int')
+        lookups = self.graphql_schema.get_type('ExtractYearFilterInput').fields
+        self.assertEqual(
+            {name: str(field.type) for name, field in lookups.items()},
+            {'exact': 'Int', 'gt': 'Int', 'gte': 'Int', 'lt': 'Int', 'lte': 'Int'},
+        )
+
+    def test_model_filter_inputs(self):
+        fields = self.graphql_schema.get_type('OrdersFilterInput').fields
+        self.assertEqual(str(fields['_and'].type), '[OrdersFilterInput]')
+        self.assertEqual(str(fields['customer'].type), 'CustomersFilterInput')
+        self.assertEqual(str(fields['freight'].type), 'DecimalFieldFilterInput')
+        self.assertEqual(str(fields['orderdetails'].type), 'OrderDetailsRelationFilterInput')
+
+
+class WhereTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    def get_orders(self, where):
+        """First page of the orders and the number of orders"""
+        result = execute(ORDERS_QUERY, self.user, {'where': where})
+        self.assertIsNone(result.errors)
+        connection = result.data['listOrders']
+        return [int(edge['node']['orderId']) for edge in connection['edges']], connection['totalCount']
+
+    def assertWhere(self, where, q):
+        expected = list(Orders.objects.filter(q).order_by('pk').values_list('pk', flat=True))
+        # Neither every order nor none of them
+        self.assertTrue(expected, where)
+        self.assertLess(len(expected), Orders.objects.count(), where)
+        self.assertEqual(self.get_orders(where), (expected[:PAGE_SIZE], len(expected)), where)
+
+    def test_scalar_lookups(self):
+        self.assertWhere({'freight': {'gt': '100'}}, Q(freight__gt=decimal.Decimal('100')))
+        self.assertWhere({'shipCountry': {'in': ['France', 'Germany']}}, Q(ship_country__in=['France', 'Germany']))
+        self.assertWhere({'shipName': {'istartswith': 'la'}}, Q(ship_name__istartswith='la'))
+        self.assertWhere({'shippedDate': {'isnull': True}}, Q(shipped_date__isnull=True))
+        # False and zero are lookup values too
+        self.assertWhere({'shippedDate': {'isnull': False}}, Q(shipped_date__isnull=False))
+        self.assertEqual(self.get_orders({'freight': {'lt': '0'}}), ([], 0))
+        self.assertEqual(self.get_orders({'shipVia': {'shipperId': {'lte': 0}}}), ([], 0))
+
+    def test_transform_and_enum_lookups(self):
+        self.assertWhere({'orderDate': {'year': {'gte': 1998}}}, Q(order_date__year__gte=1998))
+        self.assertWhere({'orderDate': {'month': 2}}, Q(order_date__month=2))
+        self.assertWhere({'orderDate': {'weekDay': 'MONDAY'}}, Q(order_date__week_day=2))
+
+    def test_relation_lookups(self):
+        self.assertWhere({'customer': {'country': {'exact': 'Germany'}}}, Q(customer__country='Germany'))
+        self.assertWhere(
+            {'employee': {'reportsTo': {'lastName': {'exact': 'Fuller'}}}},
+            Q(employee__reports_to__last_name='Fuller'),
+        )
+
+    def test_logical_lookups(self):
+        self.assertWhere(
+            {'_or': [{'shipVia': {'shipperId': {'exact': 1}}}, {'freight': {'lt': '10'}}]},
+            Q(ship_via__shipper_id=1) | Q(freight__lt=10),
+        )
+        self.assertWhere(
+            {'_and': [{'shipCountry': {'exact': 'France'}}, {'freight': {'gte': '50'}}]},
+            Q(ship_country='France') & Q(freight__gte=50),
+        )
+        self.assertWhere({'_not': [{'shipCountry': {'exact': 'USA'}}]}, ~Q(ship_country='USA'))
+        # Fields next to a logical lookup are combined with and
+        self.assertWhere(
+            {'shipCountry': {'exact': 'Germany'}, '_or': [{'freight': {'lt': '10'}}, {'freight': {'gt': '200'}}]},
+            Q(ship_country='Germany') & (Q(freight__lt=10) | Q(freight__gt=200)),
+        )
+
+
+@override_settings(AUTOGRAPHQL={'TO_MANY_FILTERS': 'exists'})
+class ExistsToManyFiltersTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    def get_customers(self, where):
+        """Customer ids of the list, its total count and the sql of the queries"""
+        with CaptureQueriesContext(connection) as queries:
+            result = execute(CUSTOMERS_QUERY, self.user, {'where': where})
+        self.assertIsNone(result.errors)
+        customers = result.data['listCustomers']
+        customer_ids = [edge['node']['customerId'] for edge in customers['edges']]
+        return customer_ids, customers['totalCount'], [query['sql'] for query in queries.captured_queries]
+
+    def get_expected(self, q):
+        return list(Customers.objects.filter(q).order_by('pk').values_list('pk', flat=True))
+
+    def test_rows_are_not_repeated(self):
+        where = {'orders': {'shipVia': {'shipperId': {'exact': 3}}}}
+        expected = self.get_expected(Exists(Orders.objects.filter(customer=OuterRef('pk'), ship_via=3)))
+        self.assertLess(len(expected), Orders.objects.filter(ship_via=3).count())
+
+        customer_ids, total_count, queries = self.get_customers(where)
+        self.assertEqual(customer_ids, expected)
+        self.assertEqual(total_count, len(expected))
+        for sql in queries:
+            self.assertIn('EXISTS', sql)
+            self.assertNotIn('JOIN', sql)
+
+        # Joined, a customer is listed once per matching order
+        with override_settings(AUTOGRAPHQL={'TO_MANY_FILTERS': 'join'}):
+            customer_ids, total_count, queries = self.get_customers(where)
+        self.assertEqual(total_count, Orders.objects.filter(ship_via=3).count())
+
+    def test_logical_lookups(self):
+        shipped_by_3 = Exists(Orders.objects.filter(customer=OuterRef('pk'), ship_via=3))
+        where = {'_not': [{'orders': {'shipVia': {'shipperId': {'exact': 3}}}}]}
+        customer_ids, total_count, queries = self.get_customers(where)
+        self.assertEqual(customer_ids, self.get_expected(~shipped_by_3))
+        self.assertEqual(total_count, len(customer_ids))
+        # Customers without any order are kept
+        self.assertIn('PARIS', customer_ids)
+
+        customer_ids, total_count, queries = self.get_customers({
+            '_or': [{'orders': {'shipVia': {'shipperId': {'exact': 3}}}}, {'country': {'exact': 'France'}}],
+        })
+        self.assertEqual(customer_ids, self.get_expected(shipped_by_3 | Q(country='France')))
+
+    def test_branches_are_matched_by_different_rows(self):
+        where = {'_and': [
+            {'orders': {'freight': {'gt': '500'}}},
+            {'orders': {'shipCountry': {'exact': 'Germany'}}},
+        ]}
+        expected = self.get_expected(
+            Exists(Orders.objects.filter(customer=OuterRef('pk'), freight__gt=500)) &
+            Exists(Orders.objects.filter(customer=OuterRef('pk'), ship_country='Germany'))
+        )
+        self.assertTrue(expected)
+        customer_ids, total_count, queries = self.get_customers(where)
+        self.assertEqual(customer_ids, expected)
+        self.assertEqual(total_count, len(expected))
+
+    def test_many_to_many(self):
+        result = execute(ORDERS_QUERY, self.user, {'where': {'orderDetails': {'discontinued': {'exact': 1}}}})
+        self.assertIsNone(result.errors)
+        expected = Orders.objects.filter(order_details__discontinued=1).distinct().count()
+        self.assertEqual(result.data['listOrders']['totalCount'], expected)
+
+
+class AggregateFiltersTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    def get_rows(self, query, field_name, pk_name, where):
+        result = execute(query, self.user, {'where': where})
+        self.assertIsNone(result.errors)
+        connection = result.data[field_name]
+        return [edge['node'][pk_name] for edge in connection['edges']], connection['totalCount']
+
+    def assertCustomers(self, where, queryset):
+        expected = list(queryset.order_by('pk').values_list('pk', flat=True))
+        self.assertTrue(expected, where)
+        for strategy in ('join', 'exists'):
+            with override_settings(AUTOGRAPHQL={'TO_MANY_FILTERS': strategy}):
+                self.assertEqual(
+                    self.get_rows(CUSTOMERS_QUERY, 'listCustomers', 'customerId', where),
+                    (expected[:PAGE_SIZE], len(expected)),
+                    (where, strategy),
+                )
+
+    def test_count(self):
+        customers = Customers.objects.annotate(order_count=Count('orders'))
+        self.assertCustomers({'orders': {'_count': {'gt': 15}}}, customers.filter(order_count__gt=15))
+        # Customers without any order count zero orders
+        self.assertCustomers({'orders': {'_count': {'exact': 0}}}, customers.filter(order_count=0))
+
+    def test_count_of_the_filtered_rows(self):
+        customers = Customers.objects.annotate(order_count=Count('orders', filter=Q(orders__ship_via=3)))
+        self.assertCustomers(
+            {'orders': {'_count': {'gte': 5}, 'shipVia': {'shipperId': {'exact': 3}}}},
+            customers.filter(order_count__gte=5),
+        )
+
+    def test_logical_lookups(self):
+        customers = Customers.objects.annotate(order_count=Count('orders'))
+        self.assertCustomers({'_not': [{'orders': {'_count': {'gt': 5}}}]}, customers.filter(order_count__lte=5))
+        self.assertCustomers(
+            {'_or': [{'orders': {'_count': {'gt': 20}}}, {'country': {'exact': 'France'}}]},
+            customers.filter(Q(order_count__gt=20) | Q(country='France')),
+        )
+
+    def test_sum(self):
+        orders = Orders.objects.annotate(quantity=Sum('orderdetails__quantity')).filter(quantity__gt=200)
+        expected = [str(pk) for pk in orders.order_by('pk').values_list('pk', flat=True)]
+        self.assertTrue(expected)
+        self.assertEqual(
+            self.get_rows(ORDERS_QUERY, 'listOrders', 'orderId', {'orderdetails': {'_sum': {'quantity': {'gt': 200}}}}),
+            (expected[:PAGE_SIZE], len(expected)),
+        )
+
+    def test_aggregate_needs_the_view_permission(self):
+        self.set_view_rule(Orders, always_deny)
+        result = execute(CUSTOMERS_QUERY, self.user, {'where': {'orders': {'_count': {'gt': 15}}}})
+        self.assertEqual(len(result.errors), 1)
+        self.assertIsNone(result.data['listCustomers'])
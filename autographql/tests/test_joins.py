@@ -0,0 +1,207 @@
+from unittest import mock
+
+import graphene
+from bridgekeeper.rules import Attribute, ManyRelation, Relation, always_deny
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from autographql.auth.query import AuthQueryOptimizer
+from autographql.optimizer.query import QueryOptimizer
+from autographql.schema import SchemaGenerator
+from autographql.tests.models import Customers, Employees, Orders
+from autographql.tests.utils import NorthwindTestCase, execute
+
+ORDER_COUNT = 20
+
+ORDER_CUSTOMERS_QUERY = '''
+{
+    listOrders(first: 100, orderBy: [{orderId: ASC}]) {
+        edges { node { orderId customer { customerId } } }
+    }
+}
+'''
+
+
+class JoinedRelationTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    def get_order_customers(self, queries):
+        with self.assertNumQueries(queries):
+            result = execute(ORDER_CUSTOMERS_QUERY, self.user)
+        self.assertIsNone(result.errors)
+        return {
+            edge['node']['orderId']: edge['node']['customer'] and edge['node']['customer']['customerId']
+            for edge in result.data['listOrders']['edges']
+        }
+
+    def test_rows_the_user_can_not_view_are_null(self):
+        self.set_view_rule(Customers, Attribute('country', 'Germany'))
+        expected = {
+            str(order.pk): order.customer_id if order.customer.country == 'Germany' else None
+            for order in Orders.objects.select_related('customer').order_by('pk')[:100]
+        }
+        self.assertIn(None, expected.values())
+        self.assertNotEqual(set(expected.values()), {None})
+
+        # The customers are joined into the query of the orders and checked on the joined rows
+        self.assertEqual(self.get_order_customers(1), expected)
+        with override_settings(AUTOGRAPHQL={'OPTIMIZER_MAX_JOIN_DEPTH': 0}):
+            self.assertEqual(self.get_order_customers(2), expected)
+
+    def test_relation_the_user_can_not_view_at_all(self):
+        self.set_view_rule(Customers, always_deny)
+        # No customer is read at all
+        customers = self.get_order_customers(1)
+        self.assertEqual(len(customers), 100)
+        self.assertEqual(set(customers.values()), {None})
+
+
+def get_unfiltered_schema():
+    """Schema with a list of orders that were not filtered with for_user, their rows are checked one by one"""
+    orders_type = SchemaGenerator.get_schema().graphql_schema.get_type('Orders').graphene_type
+
+    class Query(graphene.ObjectType):
+        orders = graphene.List(orders_type)
+
+        order = graphene.Field(orders_type, order_id=graphene.Int(required=True))
+
+        def resolve_orders(root, info):
+            return QueryOptimizer(info).optimize(Orders.objects.order_by('pk')[:ORDER_COUNT])
+
+        def resolve_order(root, info, order_id):
+            return QueryOptimizer(info).optimize(Orders.objects.filter(pk=order_id)).get()
+
+    return graphene.Schema(query=Query, types=[orders_type])
+
+
+class RelationRuleTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = get_unfiltered_schema()
+
+    def setUp(self):
+        # Orders taken by the employees that report to Fuller, two relations away from the order
+        self.set_view_rule(Orders, Relation('employee', Relation('reports_to', Attribute('last_name', 'Fuller'))))
+
+    def get_orders(self, queries):
+        with self.assertNumQueries(queries):
+            result = execute('{ orders { orderId } }', self.user, schema=self.schema)
+        self.assertIsNone(result.errors)
+        return [order['orderId'] for order in result.data['orders']]
+
+    def get_expected_orders(self):
+        expected = []
+        for order in Orders.objects.select_related('employee__reports_to').order_by('pk')[:ORDER_COUNT]:
+            reports_to = order.employee.reports_to
+            expected.append(str(order.pk) if reports_to is not None and reports_to.last_name == 'Fuller' else None)
+        self.assertIn(None, expected)
+        self.assertNotEqual(set(expected), {None})
+        return expected
+
+    def test_nested_relation_rule(self):
+        # Orders the user can not view are left out of the list
+        expected = [order_id for order_id in self.get_expected_orders() if order_id is not None]
+        # The orders with their employees and managers joined, and the bulk check of the list
+        self.assertEqual(self.get_orders(2), expected)
+        # A prefetch of the employees and one of their managers
+        with mock.patch.object(AuthQueryOptimizer, 'is_join_rule', return_value=False):
+            self.assertEqual(self.get_orders(4), expected)
+
+    def test_nested_relation_rule_of_an_instance(self):
+        query = 'query ($orderId: Int!) { order(orderId: $orderId) { orderId } }'
+        order_ids = Orders.objects.order_by('pk').values_list('pk', flat=True)[:ORDER_COUNT]
+        for order_id, expected in zip(order_ids, self.get_expected_orders()):
+            # The rule is checked on the joined rows
+            with self.assertNumQueries(1):
+                result = execute(query, self.user, {'orderId': order_id}, schema=self.schema)
+            if expected is None:
+                self.assertIsNone(result.data['order'])
+                self.assertEqual(len(result.errors), 1)
+            else:
+                self.assertIsNone(result.errors)
+                self.assertEqual(result.data['order']['orderId'], expected)
+
+            # The employee and its manager are prefetched
+            with mock.patch.object(AuthQueryOptimizer, 'is_join_rule', return_value=False):
+                with CaptureQueriesContext(connection) as queries:
+                    execute(query, self.user, {'orderId': order_id}, schema=self.schema)
+            self.assertGreater(len(queries), 1)
+
+
+ORDER_DETAILS_QUERY = '''
+{
+    listOrderDetails(first: 50, orderBy: [{id: ASC}]) {
+        edges {
+            node {
+                id
+                orderId { customer { companyName } employee { reportsTo { lastName } } }
+                productId { categoryId { categoryName } }
+            }
+        }
+    }
+}
+'''
+
+
+class JoinDecisionTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+        cls.superuser = get_user_model().objects.create(username='superuser', is_superuser=True)
+
+    def execute(self, query, user, queries):
+        with self.assertNumQueries(queries):
+            result = execute(query, user)
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def test_forward_relations_are_joined(self):
+        for user in (self.user, self.superuser):
+            # Every relation is at most three levels below the details
+            data = self.execute(ORDER_DETAILS_QUERY, user, 1)
+            # The managers, three levels down, are prefetched
+            with override_settings(AUTOGRAPHQL={'OPTIMIZER_MAX_JOIN_DEPTH': 2}):
+                self.assertEqual(self.execute(ORDER_DETAILS_QUERY, user, 2), data)
+            # One query per relation
+            with override_settings(AUTOGRAPHQL={'OPTIMIZER_MAX_JOIN_DEPTH': 0}):
+                self.assertEqual(self.execute(ORDER_DETAILS_QUERY, user, 7), data)
+
+    def test_rows_the_rule_denies_are_null(self):
+        self.set_view_rule(Employees, Attribute('title', 'Sales Representative'))
+        data = self.execute(ORDER_DETAILS_QUERY, self.user, 1)
+        with override_settings(AUTOGRAPHQL={'OPTIMIZER_MAX_JOIN_DEPTH': 0}):
+            self.assertEqual(self.execute(ORDER_DETAILS_QUERY, self.user, 7), data)
+
+        managers = [edge['node']['orderId']['employee'] for edge in data['listOrderDetails']['edges']]
+        # Sales representatives are shown, their managers are not
+        self.assertIn({'reportsTo': None}, managers)
+        self.assertIn(None, managers)
+
+    def test_rule_that_reads_other_rows_is_prefetched(self):
+        query = '''
+        {
+            listOrders(first: 100, orderBy: [{orderId: ASC}]) {
+                edges { node { orderId customer { customerId } } }
+            }
+        }
+        '''
+        self.set_view_rule(Customers, ManyRelation('orders', Attribute('ship_via_id', 3)))
+        # The customers are filtered by a query of their own
+        data = self.execute(query, self.user, 2)
+        allowed = set(Orders.objects.filter(ship_via_id=3).values_list('customer', flat=True))
+        for edge in data['listOrders']['edges']:
+            customer_id = Orders.objects.get(pk=edge['node']['orderId']).customer_id
+            expected = {'customerId': customer_id} if customer_id in allowed else None
+            self.assertEqual(edge['node']['customer'], expected)
@@ -0,0 +1,106 @@
+import graphene
+from bridgekeeper.rules import Attribute
+from django.contrib.auth import get_user_model
+from django.test.client import RequestFactory
+
+from autographql.auth.middleware import AuthorizationMiddleware
+from autographql.auth.utils import VIEW, get_model_permission
+from autographql.fields import OptimizedField
+from autographql.loaders import BatchLoaderMiddleware
+from autographql.schema import SchemaGenerator
+from autographql.tests.models import Orders
+from autographql.tests.utils import NorthwindTestCase, set_permissions
+
+PAYLOAD_COUNT = 20
+
+
+class Payload(object):
+    def __init__(self, order):
+        self.order = order
+
+
+def get_payload_schema():
+    """Schema with a list of mutation like payloads that hold an order each"""
+    orders_type = SchemaGenerator.get_schema().graphql_schema.get_type('Orders').graphene_type
+
+    class PayloadType(graphene.ObjectType):
+        class Meta:
+            name = 'Payload'
+
+        order = OptimizedField(orders_type)
+
+    class Query(graphene.ObjectType):
+        payloads = graphene.List(PayloadType)
+
+        def resolve_payloads(root, info):
+            return [Payload(order) for order in Orders.objects.order_by('pk')[:PAYLOAD_COUNT]]
+
+    return graphene.Schema(query=Query, types=[orders_type])
+
+
+class BatchLoaderTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.superuser = get_user_model().objects.create(username='superuser', is_superuser=True)
+        cls.user = get_user_model().objects.create(username='user')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = get_payload_schema()
+
+    def execute(self, query, user, middleware):
+        request = RequestFactory().post('/graphql')
+        request.user = user
+        return self.schema.execute(query, context_value=request, middleware=middleware)
+
+    def test_payloads_without_batch_loader(self):
+        # The list and one query per payload
+        with self.assertNumQueries(PAYLOAD_COUNT + 1):
+            result = self.execute(
+                '{ payloads { order { orderId shipName } } }', self.superuser, [AuthorizationMiddleware()])
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data['payloads']), PAYLOAD_COUNT)
+
+    def test_payloads_with_batch_loader(self):
+        # The list and one query for the orders of every payload
+        with self.assertNumQueries(2):
+            result = self.execute(
+                '{ payloads { order { orderId shipName } } }',
+                self.superuser,
+                [AuthorizationMiddleware(), BatchLoaderMiddleware()],
+            )
+        self.assertIsNone(result.errors)
+        order_ids = [payload['order']['orderId'] for payload in result.data['payloads']]
+        expected = [str(pk) for pk in Orders.objects.order_by('pk').values_list('pk', flat=True)[:PAYLOAD_COUNT]]
+        self.assertEqual(order_ids, expected)
+
+    def test_aliases_with_other_selections(self):
+        # Every alias loads its own selection, the customers are joined to the orders of b
+        query = '{ payloads { a: order { orderId } b: order { orderId customer { companyName } } } }'
+        with self.assertNumQueries(3):
+            result = self.execute(query, self.superuser, [AuthorizationMiddleware(), BatchLoaderMiddleware()])
+        self.assertIsNone(result.errors)
+        for payload, order in zip(result.data['payloads'], Orders.objects.order_by('pk').select_related('customer')):
+            self.assertEqual(payload['a']['orderId'], str(order.pk))
+            self.assertEqual(payload['b']['customer']['companyName'], order.customer.company_name)
+
+    def test_rows_the_user_can_not_view(self):
+        previous = set_permissions({
+            get_model_permission(Orders, VIEW): Attribute('ship_name', 'Victuailles en stock'),
+        })
+        try:
+            result = self.execute(
+                '{ payloads { order { orderId shipName } } }',
+                self.user,
+                [AuthorizationMiddleware(), BatchLoaderMiddleware()],
+            )
+        finally:
+            set_permissions(previous)
+
+        visible = [payload['order'] for payload in result.data['payloads'] if payload['order']]
+        self.assertTrue(visible)
+        self.assertTrue(all(order['shipName'] == 'Victuailles en stock' for order in visible))
+        # Every other row fails on its own
+        self.assertEqual(len(result.errors), PAYLOAD_COUNT - len(visible))
@@ -0,0 +1,115 @@
+from unittest import mock
+
+import graphene
+from bridgekeeper.rules import Attribute
+from django.contrib.auth import get_user_model
+
+from autographql.managers import NOT_VIEWABLE, get_viewable_by, is_viewable_by
+from autographql.schema import SchemaGenerator
+from autographql.tests.models import Customers
+from autographql.tests.utils import NorthwindTestCase, execute
+
+
+def get_customers_schema():
+    """Customers loaded for the requesting user, for another user, for both or for no user"""
+    customers_type = SchemaGenerator.get_schema().graphql_schema.get_type('Customers').graphene_type
+
+    def get_queryset(info, loaded_for):
+        if loaded_for == 'all':
+            return Customers.objects.all()
+        queryset = Customers.objects.for_user(info.context.user)
+        if loaded_for == 'user':
+            return queryset
+
+        other_queryset = Customers.objects.for_user(get_user_model().objects.get(username='other'))
+        if loaded_for == 'both':
+            return queryset | other_queryset
+        if loaded_for == 'union':
+            return queryset.union(other_queryset)
+        return other_queryset
+
+    class Query(graphene.ObjectType):
+        customer = graphene.Field(customers_type, customer_id=graphene.String(), loaded_for=graphene.String())
+        customers = graphene.List(customers_type, loaded_for=graphene.String())
+
+        def resolve_customer(root, info, customer_id, loaded_for):
+            return get_queryset(info, loaded_for).get(pk=customer_id)
+
+        def resolve_customers(root, info, loaded_for):
+            return get_queryset(info, loaded_for).order_by('pk')
+
+    return graphene.Schema(query=Query, types=[customers_type])
+
+
+class ViewableByTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Each user views the customers of their own country
+        cls.user = get_user_model().objects.create(username='user', last_name='Germany')
+        cls.other = get_user_model().objects.create(username='other', last_name='France')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = get_customers_schema()
+
+    def setUp(self):
+        self.set_view_rule(Customers, Attribute('country', lambda user: user.last_name))
+
+    def get_customer_ids(self, country):
+        return list(Customers.objects.filter(country=country).order_by('pk').values_list('pk', flat=True))
+
+    def test_querysets_of_the_same_user_keep_the_marker(self):
+        queryset = Customers.objects.for_user(self.user)
+        self.assertEqual(get_viewable_by(queryset), self.user.pk)
+        self.assertEqual(get_viewable_by(queryset.filter(city='Berlin')), self.user.pk)
+        self.assertEqual(get_viewable_by(queryset | Customers.objects.for_user(self.user)), self.user.pk)
+        self.assertEqual(get_viewable_by(queryset.union(Customers.objects.for_user(self.user))), self.user.pk)
+        self.assertTrue(all(is_viewable_by(customer, self.user) for customer in queryset))
+
+    def test_querysets_of_other_users_drop_the_marker(self):
+        queryset = Customers.objects.for_user(self.user)
+        other_queryset = Customers.objects.for_user(self.other)
+        self.assertEqual(get_viewable_by(queryset | other_queryset), NOT_VIEWABLE)
+        self.assertEqual(get_viewable_by(other_queryset | queryset), NOT_VIEWABLE)
+        self.assertEqual(get_viewable_by(queryset | Customers.objects.all()), NOT_VIEWABLE)
+        self.assertEqual(get_viewable_by(queryset.union(other_queryset)), NOT_VIEWABLE)
+        self.assertFalse(any(is_viewable_by(customer, self.user) for customer in queryset | other_queryset))
+        self.assertFalse(any(is_viewable_by(customer, self.user) for customer in Customers.objects.all()))
+
+    def test_superusers_do_not_mark_their_rows(self):
+        superuser = get_user_model().objects.create(username='superuser', is_superuser=True)
+        self.assertEqual(get_viewable_by(Customers.objects.for_user(superuser)), NOT_VIEWABLE)
+
+    def test_instances_loaded_for_the_user_are_not_checked_again(self):
+        query = 'query ($id: String) { customer(customerId: $id, loadedFor: "user") { customerId } }'
+        # A check of the rule would deny every row
+        with mock.patch.object(Attribute, 'check', return_value=False) as check:
+            result = execute(query, self.user, {'id': 'ALFKI'}, schema=self.schema)
+        check.assert_not_called()
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['customer']['customerId'], 'ALFKI')
+
+    def test_instances_loaded_for_another_user_are_checked(self):
+        query = 'query ($id: String, $for: String) { customer(customerId: $id, loadedFor: $for) { customerId } }'
+        for loaded_for in ('other', 'both', 'all'):
+            result = execute(query, self.user, {'id': 'BLONP', 'for': loaded_for}, schema=self.schema)
+            self.assertIsNone(result.data['customer'], loaded_for)
+            self.assertEqual(len(result.errors), 1, loaded_for)
+
+            result = execute(query, self.user, {'id': 'ALFKI', 'for': loaded_for}, schema=self.schema)
+            if loaded_for == 'other':
+                # Not a row of the other user, the query finds nothing
+                self.assertIsNone(result.data['customer'], loaded_for)
+            else:
+                self.assertIsNone(result.errors, loaded_for)
+                self.assertEqual(result.data['customer']['customerId'], 'ALFKI')
+
+    def test_lists_loaded_for_another_user_are_checked(self):
+        query = 'query ($for: String) { customers(loadedFor: $for) { customerId } }'
+        german = self.get_customer_ids('Germany')
+        for loaded_for, expected in (('user', german), ('other', []), ('both', german), ('union', german), ('all', german)):
+            result = execute(query, self.user, {'for': loaded_for}, schema=self.schema)
+            self.assertIsNone(result.errors, loaded_for)
+            self.assertEqual([customer['customerId'] for customer in result.data['customers']], expected, loaded_for)
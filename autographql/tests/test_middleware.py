@@ -0,0 +1,172 @@
+from unittest import mock
+
+import graphene
+from bridgekeeper.rules import Attribute, ManyRelation, always_deny
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.test.client import RequestFactory
+
+from autographql.auth.middleware import AuthorizationMiddleware, get_permission_cache
+from autographql.auth.utils import VIEW, get_model_permission
+from autographql.schema import SchemaGenerator
+from autographql.tests.models import Customers
+from autographql.tests.utils import NorthwindTestCase, execute
+
+
+class CountryBackend(object):
+    """Authentication backend that lets users view the customers of the country in their last name"""
+    # Pks of the customers checked by the backend
+    checked = []
+
+    def authenticate(self, request, **credentials):
+        return None
+
+    def has_perm(self, user, permission, obj=None):
+        if obj is None or permission != get_model_permission(Customers, VIEW):
+            return False
+        self.checked.append(obj.pk)
+        return obj.country == user.last_name
+
+
+def get_list_schema():
+    """Customers that were not filtered for the user, every row is checked by the middleware"""
+    customers_type = SchemaGenerator.get_schema().graphql_schema.get_type('Customers').graphene_type
+
+    class Query(graphene.ObjectType):
+        customers = graphene.List(customers_type)
+
+        customer = graphene.Field(customers_type, customer_id=graphene.String(required=True))
+
+        def resolve_customers(root, info):
+            return Customers.objects.order_by('pk')
+
+        def resolve_customer(root, info, customer_id):
+            return Customers.objects.get(pk=customer_id)
+
+    return graphene.Schema(query=Query, types=[customers_type])
+
+
+class CheckListTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user', last_name='France')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = get_list_schema()
+
+    def get_customers(self):
+        result = execute('{ customers { customerId } }', self.user, schema=self.schema)
+        self.assertIsNone(result.errors)
+        return [customer['customerId'] for customer in result.data['customers']]
+
+    def get_customer_ids(self, country):
+        return list(Customers.objects.filter(country=country).order_by('pk').values_list('pk', flat=True))
+
+    def test_denied_rows_are_left_out(self):
+        self.set_view_rule(Customers, Attribute('country', 'Germany'))
+        # The list and one pk__in query filtered by the rule for all of its rows
+        with self.assertNumQueries(2):
+            customer_ids = self.get_customers()
+        self.assertEqual(customer_ids, self.get_customer_ids('Germany'))
+
+    def test_every_row_denied(self):
+        self.set_view_rule(Customers, always_deny)
+        # The rule can not match any row, only the list is queried
+        with self.assertNumQueries(1):
+            customer_ids = self.get_customers()
+        self.assertEqual(customer_ids, [])
+
+    @override_settings(AUTHENTICATION_BACKENDS=[
+        'bridgekeeper.backends.RulePermissionBackend',
+        'django.contrib.auth.backends.ModelBackend',
+        'autographql.tests.test_middleware.CountryBackend',
+    ])
+    def test_permission_without_rule(self):
+        self.set_view_rule(Customers, None)
+        CountryBackend.checked = []
+        # Only the authentication backends know about the permission, every row is checked on its own
+        with self.assertNumQueries(1):
+            customer_ids = self.get_customers()
+        self.assertEqual(customer_ids, self.get_customer_ids('France'))
+        self.assertEqual(sorted(CountryBackend.checked), sorted(Customers.objects.values_list('pk', flat=True)))
+
+
+class PermissionCacheTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = get_list_schema()
+
+    def setUp(self):
+        # Checking a customer takes a query
+        self.set_view_rule(Customers, ManyRelation('orders', Attribute('ship_via_id', 3)))
+
+    def execute(self, query):
+        """Result of the query and the permission cache of its request"""
+        request = RequestFactory().post('/graphql')
+        request.user = self.user
+        result = self.schema.execute(query, context_value=request, middleware=[AuthorizationMiddleware()])
+        self.assertIsNone(result.errors)
+        return result.data, get_permission_cache(request).info()
+
+    def test_instance_is_checked_once(self):
+        query = '{ first: customer(customerId: "ALFKI") { customerId } second: customer(customerId: "ALFKI") { city } }'
+        # Two loads of the customer and one check
+        with self.assertNumQueries(3):
+            data, info = self.execute(query)
+        self.assertEqual(data['first']['customerId'], 'ALFKI')
+        self.assertEqual(data['second']['city'], Customers.objects.get(pk='ALFKI').city)
+        self.assertEqual(info, {'hits': 1, 'misses': 1, 'size': 1, 'ratio': 0.5})
+
+    def test_instances_of_a_list_are_not_checked_again(self):
+        query = '{ customers { customerId } customer(customerId: "ALFKI") { customerId } }'
+        # The list, its bulk check and the load of the customer
+        with self.assertNumQueries(3):
+            data, info = self.execute(query)
+        count = Customers.objects.count()
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], count)
+        self.assertEqual(info['size'], count)
+        self.assertEqual(info['ratio'], round(1 / (count + 1), 3))
+
+
+class LeafFieldsTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = get_list_schema()
+
+    def count_user_reads(self, fields):
+        """Number of times the middleware reads the user to resolve the fields of every customer"""
+        with mock.patch.object(
+                get_user_model(), 'is_superuser', new_callable=mock.PropertyMock, return_value=False) as is_superuser:
+            result = execute('{ customers { %s } }' % fields, self.user, schema=self.schema)
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data['customers']), Customers.objects.count())
+        return is_superuser.call_count
+
+    def test_scalar_fields_do_not_read_the_user(self):
+        reads = self.count_user_reads('customerId')
+        self.assertEqual(self.count_user_reads('customerId companyName city country'), reads)
+        # The list itself is checked
+        self.assertGreater(reads, 0)
+        self.assertLess(reads, Customers.objects.count())
+
+    def test_scalar_fields_are_resolved(self):
+        result = execute('{ customer(customerId: "ALFKI") { customerId companyName } }', self.user, schema=self.schema)
+        self.assertIsNone(result.errors)
+        customer = Customers.objects.get(pk='ALFKI')
+        self.assertEqual(result.data['customer'], {'customerId': 'ALFKI', 'companyName': customer.company_name})
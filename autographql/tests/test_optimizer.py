@@ -0,0 +1,245 @@
+from bridgekeeper.rules import Attribute, Rule
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.db.models import Prefetch, Q
+from django.db.models.signals import post_init
+from django.test import SimpleTestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from graphql_relay import offset_to_cursor
+
+from autographql.auth.middleware import AuthorizationMiddleware
+from autographql.optimizer.query import QueryOptimizer
+from autographql.optimizer.utils import combine_querysets, merge_querysets
+from autographql.schema import SchemaGenerator
+from autographql.tests.models import Categories, Customers, Orders
+from autographql.tests.utils import NorthwindTestCase, execute
+
+
+class MergeQuerysetsTestCase(SimpleTestCase):
+    def test_identical_querysets_are_not_combined(self):
+        model = get_user_model()
+        queryset = model.objects.filter(is_active=True)
+        merged = merge_querysets([queryset, model.objects.filter(is_active=True), model.objects.all()])
+        self.assertIs(merged, queryset)
+
+    def test_other_querysets_are_combined(self):
+        model = get_user_model()
+        merged = merge_querysets([model.objects.filter(is_active=True), model.objects.filter(is_staff=True)])
+        self.assertEqual(len(merged.query.where.children), 2)
+
+    def test_columns_of_every_queryset_are_loaded(self):
+        model = get_user_model()
+        merged = merge_querysets([model.objects.only('username'), model.objects.only('email')])
+        self.assertEqual(merged.query.deferred_loading, (frozenset(['username', 'email']), False))
+        merged = merge_querysets([model.objects.only('username'), model.objects.all()])
+        self.assertEqual(merged.query.deferred_loading, (frozenset(), True))
+
+    def test_identical_prefetches_are_merged_once(self):
+        queryset = get_user_model().objects.prefetch_related(
+            Prefetch('groups'),
+            Prefetch('groups', queryset=Group.objects.filter(name='staff')),
+            Prefetch('groups', queryset=Group.objects.filter(name='staff')),
+        )
+        prefetch, = combine_querysets([queryset])._prefetch_related_lookups
+        self.assertEqual(len(prefetch.queryset.query.where.children), 1)
+
+
+CUSTOMER_ORDERS_QUERY = '''
+query ($first: Int, $last: Int, $before: String) {
+    listCustomers(orderBy: [{customerId: ASC}]) {
+        edges {
+            node {
+                customerId
+                ordersSet(first: $first, last: $last, before: $before, orderBy: [{orderDate: DESC}]) {
+                    edges { node { orderId } }
+                }
+            }
+        }
+    }
+}
+'''
+
+
+class LimitPerParentTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    def execute(self, **variables):
+        """Pages of the orders of every customer and the number of orders read from the database"""
+        loaded = []
+
+        def count_order(sender, **kwargs):
+            loaded.append(sender)
+
+        request = RequestFactory().post('/graphql')
+        request.user = self.user
+        post_init.connect(count_order, sender=Orders)
+        try:
+            with self.assertNumQueries(2):
+                result = SchemaGenerator.get_schema().execute(
+                    CUSTOMER_ORDERS_QUERY,
+                    context_value=request,
+                    variable_values=variables,
+                    middleware=[AuthorizationMiddleware()],
+                )
+        finally:
+            post_init.disconnect(count_order, sender=Orders)
+
+        self.assertIsNone(result.errors)
+        pages = {}
+        for edge in result.data['listCustomers']['edges']:
+            orders = edge['node']['ordersSet']
+            pages[edge['node']['customerId']] = [int(order['node']['orderId']) for order in orders['edges']]
+        return pages, len(loaded)
+
+    def get_orders(self):
+        orders = {customer_id: [] for customer_id in Customers.objects.values_list('pk', flat=True)}
+        for order_id, customer_id in Orders.objects.order_by('-order_date', 'pk').values_list('pk', 'customer_id'):
+            orders[customer_id].append(order_id)
+        return orders
+
+    def test_first(self):
+        pages, loaded = self.execute(first=2)
+        orders = self.get_orders()
+        self.assertEqual(pages, {customer_id: rows[:2] for customer_id, rows in orders.items()})
+        # One more row than the page for hasNextPage
+        self.assertEqual(loaded, sum(min(len(rows), 3) for rows in orders.values()))
+
+    def test_first_and_last(self):
+        pages, loaded = self.execute(first=3, last=2)
+        orders = self.get_orders()
+        self.assertEqual(pages, {customer_id: rows[:3][-2:] for customer_id, rows in orders.items()})
+        self.assertEqual(loaded, sum(min(len(rows), 4) for rows in orders.values()))
+
+    def test_last_and_before(self):
+        pages, loaded = self.execute(last=2, before=offset_to_cursor(3))
+        orders = self.get_orders()
+        self.assertEqual(pages, {customer_id: rows[1:3] for customer_id, rows in orders.items()})
+        self.assertEqual(loaded, sum(min(len(rows), 3) for rows in orders.values()))
+
+    def test_last_reads_every_row(self):
+        pages, loaded = self.execute(last=2)
+        orders = self.get_orders()
+        self.assertEqual(pages, {customer_id: rows[-2:] for customer_id, rows in orders.items()})
+        self.assertEqual(loaded, Orders.objects.count())
+
+
+class PlanCacheTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Plans are kept per schema, like the one schema of a server
+        cls.schema = SchemaGenerator.get_schema()
+
+    def setUp(self):
+        QueryOptimizer.plan_cache.clear()
+        self.addCleanup(QueryOptimizer.plan_cache.clear)
+
+    def get_pages(self, **variables):
+        """Pages of the orders of every customer and the plan cache hits and misses of the query"""
+        before = QueryOptimizer.plan_cache.info()
+        result = execute(CUSTOMER_ORDERS_QUERY, self.user, variables, schema=self.schema)
+        after = QueryOptimizer.plan_cache.info()
+
+        self.assertIsNone(result.errors)
+        pages = {}
+        for edge in result.data['listCustomers']['edges']:
+            orders = edge['node']['ordersSet']
+            pages[edge['node']['customerId']] = [int(order['node']['orderId']) for order in orders['edges']]
+        return pages, after['hits'] - before['hits'], after['misses'] - before['misses']
+
+    def test_plans_are_shared_by_the_same_variables(self):
+        pages, hits, misses = self.get_pages(first=2)
+        self.assertEqual((hits, misses), (0, 1))
+
+        # Other values of the same variables reuse the plan, their arguments are read again
+        cached_pages, hits, misses = self.get_pages(first=3)
+        self.assertEqual((hits, misses), (1, 0))
+        self.assertEqual(cached_pages, {customer_id: rows[:3] for customer_id, rows in self.get_orders().items()})
+
+        # A plan for another set of variables
+        pages, hits, misses = self.get_pages(last=2)
+        self.assertEqual((hits, misses), (0, 1))
+        self.assertEqual(pages, {customer_id: rows[-2:] for customer_id, rows in self.get_orders().items()})
+
+    def test_plans_are_kept_per_schema(self):
+        self.get_pages(first=2)
+        other_schema = SchemaGenerator.get_schema()
+        misses = QueryOptimizer.plan_cache.info()['misses']
+        result = execute(CUSTOMER_ORDERS_QUERY, self.user, {'first': 2}, schema=other_schema)
+        self.assertIsNone(result.errors)
+        self.assertEqual(QueryOptimizer.plan_cache.info()['misses'], misses + 1)
+
+    def get_orders(self):
+        orders = {customer_id: [] for customer_id in Customers.objects.values_list('pk', flat=True)}
+        for order_id, customer_id in Orders.objects.order_by('-order_date', 'pk').values_list('pk', 'customer_id'):
+            orders[customer_id].append(order_id)
+        return orders
+
+
+class GermanyRule(Rule):
+    """Rule of a type the optimizer does not know the fields of"""
+    def query(self, user):
+        return Q(country='Germany')
+
+    def check(self, user, instance=None):
+        return instance is not None and instance.country == 'Germany'
+
+
+class OnlyFieldsTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    def execute(self, query, queries):
+        with CaptureQueriesContext(connection) as captured:
+            result = execute(query, self.user)
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(captured), queries, [q['sql'] for q in captured.captured_queries])
+        return result.data, [q['sql'] for q in captured.captured_queries]
+
+    def test_columns_that_are_not_selected_are_left_out(self):
+        data, queries = self.execute('{ listCategories(first: 10) { edges { node { categoryName } } } }', 1)
+        self.assertEqual(len(data['listCategories']['edges']), Categories.objects.count())
+        self.assertNotIn('"Picture"', queries[0])
+        self.assertNotIn('"Description"', queries[0])
+
+    def test_columns_of_the_rule_are_loaded(self):
+        self.set_view_rule(Customers, Attribute('country', 'Germany'))
+        # The country is not selected, the joined customers are checked without loading it again
+        data, queries = self.execute(
+            '{ listOrders(first: 20, orderBy: [{orderId: ASC}]) { edges { node { customer { customerId } } } } }', 1)
+        self.assertIn('"customers"."Country"', queries[0])
+        self.assertNotIn('"customers"."Fax"', queries[0])
+
+    def test_rule_of_unknown_fields_loads_every_column(self):
+        # The fields the rule reads can not be determined, the customers are loaded whole
+        self.set_view_rule(Customers, GermanyRule())
+        data, queries = self.execute(
+            '{ listOrders(first: 20, orderBy: [{orderId: ASC}]) { edges { node { customer { customerId } } } } }', 2)
+        self.assertIn('"customers"."Fax"', queries[1])
+
+    def test_relation_selected_twice(self):
+        query = '''
+        {
+            listOrders(first: 20, orderBy: [{orderId: ASC}]) {
+                edges { node { orderId customer { customerId } buyer: customer { companyName } } }
+            }
+        }
+        '''
+        # One prefetch of the customers with the columns of both selections
+        data, queries = self.execute(query, 2)
+        for edge in data['listOrders']['edges']:
+            order = Orders.objects.select_related('customer').get(pk=edge['node']['orderId'])
+            self.assertEqual(edge['node']['customer']['customerId'], order.customer_id)
+            self.assertEqual(edge['node']['buyer']['companyName'], order.customer.company_name)
@@ -0,0 +1,90 @@
+import graphene
+from django.contrib.auth import get_user_model
+from django.db.models import Avg, Count, Sum
+from django.test.client import RequestFactory
+
+from autographql.auth.middleware import AuthorizationMiddleware
+from autographql.fields import KeysetDjangoConnectionField
+from autographql.schema import SchemaGenerator
+from autographql.tests.models import Customers
+from autographql.tests.utils import NorthwindTestCase
+
+PAGE_SIZE = 10
+
+LIST_QUERY = '''
+query ($after: String, $orderBy: [CustomersOrderByInput]) {
+    %s(first: %d, after: $after, orderBy: $orderBy) {
+        totalCount
+        pageInfo { hasNextPage endCursor }
+        edges { node { customerId } }
+    }
+}
+'''
+
+
+def get_pagination_schema():
+    """Customers listed with keyset pagination"""
+    customers_type = SchemaGenerator.get_schema().graphql_schema.get_type('Customers').graphene_type
+
+    class Query(graphene.ObjectType):
+        keyset_customers = KeysetDjangoConnectionField(customers_type)
+
+    return graphene.Schema(query=Query, types=[customers_type])
+
+
+class AggregateOrderByTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = get_pagination_schema()
+
+    def get_pages(self, field_name, order_by):
+        """Customer ids of every page of the list"""
+        customer_ids = []
+        after = None
+        while True:
+            request = RequestFactory().post('/graphql')
+            request.user = self.user
+            result = self.schema.execute(
+                LIST_QUERY % (field_name, PAGE_SIZE),
+                context_value=request,
+                variable_values={'after': after, 'orderBy': order_by},
+                middleware=[AuthorizationMiddleware()],
+            )
+            self.assertIsNone(result.errors)
+            connection = result.data[field_name]
+            self.assertEqual(connection['totalCount'], Customers.objects.count())
+            customer_ids += [edge['node']['customerId'] for edge in connection['edges']]
+            if not connection['pageInfo']['hasNextPage']:
+                return customer_ids
+            after = connection['pageInfo']['endCursor']
+
+    def assertPages(self, aggregate, descending):
+        """Every customer comes once, in the order of the aggregate"""
+        order_by = [{'orders': {aggregate.__name__.lower(): {'freight': 'DESC' if descending else 'ASC'}}}]
+        customer_ids = self.get_pages('keysetCustomers', order_by)
+        self.assertEqual(len(customer_ids), len(set(customer_ids)))
+        self.assertEqual(len(customer_ids), Customers.objects.count())
+
+        values = dict(Customers.objects.annotate(value=aggregate('orders__freight')).values_list('pk', 'value'))
+        ordered = [values[pk] for pk in customer_ids if values[pk] is not None]
+        self.assertEqual(ordered, sorted(ordered, reverse=descending))
+        self.assertEqual(customer_ids[len(ordered):], [pk for pk in customer_ids if values[pk] is None])
+
+    def test_count(self):
+        expected = Customers.objects.annotate(value=Count('orders')).order_by('-value', 'pk')
+        customer_ids = self.get_pages('keysetCustomers', [{'orders': {'count': 'DESC'}}, {'customerId': 'ASC'}])
+        self.assertEqual(customer_ids, list(expected.values_list('pk', flat=True)))
+
+    def test_sum_of_decimal_column(self):
+        self.assertPages(Sum, descending=False)
+        self.assertPages(Sum, descending=True)
+
+    def test_avg_of_decimal_column(self):
+        self.assertPages(Avg, descending=False)
+        self.assertPages(Avg, descending=True)
@@ -0,0 +1,144 @@
+import datetime
+
+import graphene
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from autographql.auth.middleware import AuthorizationMiddleware
+from autographql.fields import KeysetDjangoConnectionField
+from autographql.pagination import keyset_to_cursor, cursor_to_keyset
+from autographql.schema import SchemaGenerator
+from autographql.tests.models import Employees, Orders
+from autographql.tests.utils import NorthwindTestCase
+
+PAGE_QUERY = '''
+query ($first: Int, $last: Int, $after: String, $before: String, $orderBy: [%(type)sOrderByInput]) {
+    %(field)s(first: $first, last: $last, after: $after, before: $before, orderBy: $orderBy) {
+        pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+        edges { node { %(pk)s } }
+    }
+}
+'''
+
+LISTS = {
+    'keysetOrders': ('Orders', 'orderId'),
+    'keysetEmployees': ('Employees', 'employeeId'),
+}
+
+
+def get_keyset_schema():
+    """Orders and employees listed with keyset pagination"""
+    graphql_schema = SchemaGenerator.get_schema().graphql_schema
+    orders_type = graphql_schema.get_type('Orders').graphene_type
+    employees_type = graphql_schema.get_type('Employees').graphene_type
+
+    class Query(graphene.ObjectType):
+        keyset_orders = KeysetDjangoConnectionField(orders_type)
+        keyset_employees = KeysetDjangoConnectionField(employees_type)
+
+    return graphene.Schema(query=Query, types=[orders_type, employees_type])
+
+
+class KeysetCursorTestCase(NorthwindTestCase):
+    def test_values_keep_their_precision(self):
+        values = [
+            datetime.datetime(2020, 1, 1, 12, 0, 0, 123456, tzinfo=datetime.timezone.utc),
+            datetime.time(12, 0, 0, 123456),
+            datetime.date(2020, 1, 1),
+            datetime.timedelta(microseconds=1),
+            None,
+            'text',
+            1,
+        ]
+        self.assertEqual(cursor_to_keyset(keyset_to_cursor(values)), values)
+
+
+class KeysetPaginationTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = get_keyset_schema()
+
+    def get_page(self, field_name, order_by, **variables):
+        type_name, pk_name = LISTS[field_name]
+        request = RequestFactory().post('/graphql')
+        request.user = self.user
+        result = self.schema.execute(
+            PAGE_QUERY % {'type': type_name, 'field': field_name, 'pk': pk_name},
+            context_value=request,
+            variable_values=dict(variables, orderBy=order_by),
+            middleware=[AuthorizationMiddleware()],
+        )
+        self.assertIsNone(result.errors)
+        connection = result.data[field_name]
+        return [int(edge['node'][pk_name]) for edge in connection['edges']], connection['pageInfo']
+
+    def get_pages_forward(self, field_name, order_by, size, max_pages):
+        ids = []
+        after = None
+        for _ in range(max_pages):
+            page, page_info = self.get_page(field_name, order_by, first=size, after=after)
+            ids += page
+            if not page_info['hasNextPage']:
+                return ids
+            after = page_info['endCursor']
+        self.fail('More than {0} pages'.format(max_pages))
+
+    def get_pages_backward(self, field_name, order_by, size, max_pages):
+        ids = []
+        before = None
+        for _ in range(max_pages):
+            page, page_info = self.get_page(field_name, order_by, last=size, before=before)
+            ids = page + ids
+            if not page_info['hasPreviousPage']:
+                return ids
+            before = page_info['startCursor']
+        self.fail('More than {0} pages'.format(max_pages))
+
+    def assertPages(self, field_name, order_by, size, expected):
+        # Pages that repeat rows would never reach the end of the list
+        max_pages = len(expected) // size + 1
+        self.assertEqual(self.get_pages_forward(field_name, order_by, size, max_pages), expected)
+        self.assertEqual(self.get_pages_backward(field_name, order_by, size, max_pages), expected)
+
+    def test_nulls_come_last(self):
+        self.assertTrue(Orders.objects.filter(shipped_date__isnull=True).exists())
+        for descending in (False, True):
+            shipped_date = F('shipped_date').desc if descending else F('shipped_date').asc
+            expected = list(Orders.objects.order_by(shipped_date(nulls_last=True), 'pk').values_list('pk', flat=True))
+            self.assertPages('keysetOrders', [{'shippedDate': 'DESC' if descending else 'ASC'}], 100, expected)
+
+    def test_after_and_before(self):
+        order_by = [{'freight': 'DESC'}]
+        expected = list(Orders.objects.order_by('-freight', 'pk').values_list('pk', flat=True))
+        page, page_info = self.get_page('keysetOrders', order_by, first=10)
+        after = page_info['endCursor']
+        page, page_info = self.get_page('keysetOrders', order_by, first=10, after=after)
+        self.assertEqual(page, expected[10:20])
+        before = page_info['endCursor']
+
+        page, page_info = self.get_page('keysetOrders', order_by, first=100, after=after, before=before)
+        self.assertEqual(page, expected[10:19])
+        self.assertFalse(page_info['hasNextPage'])
+        page, page_info = self.get_page('keysetOrders', order_by, last=5, after=after, before=before)
+        self.assertEqual(page, expected[14:19])
+        self.assertTrue(page_info['hasPreviousPage'])
+
+    def test_sub_millisecond_datetimes(self):
+        # Every hire date falls within the same millisecond, in the reverse order of the primary keys
+        hired = timezone.make_aware(datetime.datetime(2020, 1, 1, 12, 0, 0, 123000))
+        employees = list(Employees.objects.order_by('-pk'))
+        for index, employee in enumerate(employees):
+            employee.hire_date = hired + datetime.timedelta(microseconds=index * 100)
+            employee.save(update_fields=['hire_date'])
+
+        expected = [employee.pk for employee in employees]
+        self.assertPages('keysetEmployees', [{'hireDate': 'ASC'}], 2, expected)
+        self.assertPages('keysetEmployees', [{'hireDate': 'DESC'}], 2, expected[::-1])
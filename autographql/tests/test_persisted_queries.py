@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+import graphene
+from django.test import SimpleTestCase, override_settings
+from django.test.client import RequestFactory
+
+from autographql import persisted_queries
+from autographql.persisted_queries import get_query_hash
+from autographql.views import OptimizedGraphQLView
+
+
+class QueryA(graphene.ObjectType):
+    hello = graphene.String()
+
+    def resolve_hello(root, info):
+        return 'a'
+
+
+class QueryB(graphene.ObjectType):
+    hello = graphene.Int()
+    other = graphene.String()
+
+    def resolve_hello(root, info):
+        return 1
+
+
+schema_a = graphene.Schema(query=QueryA)
+schema_b = graphene.Schema(query=QueryB)
+
+
+@override_settings(AUTOGRAPHQL={'PERSISTED_QUERIES': True})
+class PersistedQueryTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.manifest_path = os.path.join(directory.name, 'persisted_queries.json')
+
+    def post(self, schema, query_hash, query=None):
+        body = {'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': query_hash}}}
+        if query is not None:
+            body['query'] = query
+        request = RequestFactory().post('/graphql', data=json.dumps(body), content_type='application/json')
+        response = OptimizedGraphQLView.as_view(schema=schema)(request)
+        return json.loads(response.content)
+
+    def test_hash_only_request_is_not_parsed_again(self):
+        query = '{ hello }'
+        query_hash = get_query_hash(query)
+        self.assertEqual(self.post(schema_a, query_hash, query), {'data': {'hello': 'a'}})
+
+        with mock.patch.object(persisted_queries, 'parse', wraps=persisted_queries.parse) as parse, \
+                mock.patch.object(persisted_queries, 'validate', wraps=persisted_queries.validate) as validate:
+            self.assertEqual(self.post(schema_a, query_hash), {'data': {'hello': 'a'}})
+        parse.assert_not_called()
+        validate.assert_not_called()
+
+    def test_queries_are_persisted_per_schema(self):
+        query = '{ hello other }'
+        query_hash = get_query_hash(query)
+        self.assertEqual(self.post(schema_b, query_hash, query), {'data': {'hello': 1, 'other': None}})
+
+        # Registered through schema_b, unknown to schema_a and invalid for it
+        response = self.post(schema_a, query_hash)
+        self.assertEqual(response['errors'][0]['message'], persisted_queries.PERSISTED_QUERY_NOT_FOUND)
+        response = self.post(schema_a, query_hash, query)
+        self.assertIn('other', response['errors'][0]['message'])
+        self.assertEqual(self.post(schema_b, query_hash), {'data': {'hello': 1, 'other': None}})
+
+    def test_manifest_is_validated_per_schema(self):
+        query = '{ other }'
+        with open(self.manifest_path, 'w') as manifest:
+            json.dump({get_query_hash(query): query}, manifest)
+
+        settings = {'PERSISTED_QUERIES': True, 'PERSISTED_QUERIES_MANIFEST': self.manifest_path}
+        schema_c = graphene.Schema(query=QueryA)
+        schema_d = graphene.Schema(query=QueryB)
+        with override_settings(AUTOGRAPHQL=settings):
+            self.assertIn('other', self.post(schema_c, get_query_hash(query))['errors'][0]['message'])
+            self.assertEqual(self.post(schema_d, get_query_hash(query)), {'data': {'other': None}})
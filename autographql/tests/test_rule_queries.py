@@ -0,0 +1,145 @@
+import types
+from unittest import mock
+
+from bridgekeeper.rules import Attribute, always_allow, blanket_rule
+from django.contrib.auth import get_user_model
+from django.test.client import RequestFactory
+from graphene import relay
+from rest_framework.serializers import ModelSerializer
+
+from autographql.auth.utils import VIEW, UPDATE, get_model_permission, get_rule_query, invalidate_rule_queries, \
+    is_possible_for, possible_permissions_cache, user_queries_cache
+from autographql.mutation import DjangoSerializerMutationFieldFactory
+from autographql.tests.models import Customers
+from autographql.tests.utils import NorthwindTestCase, set_permissions
+from autographql.types import AutoDjangoObjectType
+
+# Customers of the country in the last name of the user
+COUNTRY_RULE = Attribute('country', lambda user: user.last_name)
+# Every customer for staff users, none for the others
+STAFF_RULE = blanket_rule(lambda user: user.is_staff)
+
+
+class UserType(AutoDjangoObjectType):
+    class Meta:
+        model = get_user_model()
+        interfaces = (relay.Node,)
+        fields = ('id', 'username', 'last_name')
+        skip_registry = True
+
+
+class UserSerializer(ModelSerializer):
+    class Meta:
+        model = get_user_model()
+        fields = ('id', 'last_name')
+
+
+class UserMutationFactory(DjangoSerializerMutationFieldFactory):
+    class Meta:
+        type = UserType
+        serializer_class = UserSerializer
+
+
+class SharedRuleQueriesTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user', last_name='France')
+
+    def setUp(self):
+        self.set_permissions({
+            get_model_permission(Customers, VIEW): COUNTRY_RULE,
+            get_model_permission(get_user_model(), UPDATE): always_allow,
+        })
+        patcher = mock.patch.object(user_queries_cache, 'timeout', 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(invalidate_rule_queries)
+
+    def set_permissions(self, permissions):
+        previous = set_permissions(permissions)
+        self.addCleanup(set_permissions, previous)
+
+    def get_request_user(self):
+        """User object of a new request"""
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def get_countries(self, user):
+        query = get_rule_query(user, get_model_permission(Customers, VIEW))
+        return set(Customers.objects.filter(query).values_list('country', flat=True))
+
+    def set_last_name(self, last_name):
+        get_user_model().objects.filter(pk=self.user.pk).update(last_name=last_name)
+
+    def test_invalidate(self):
+        self.assertEqual(self.get_countries(self.get_request_user()), {'France'})
+        self.set_last_name('Germany')
+        # The query of the previous request is shared
+        self.assertEqual(self.get_countries(self.get_request_user()), {'France'})
+
+        invalidate_rule_queries(self.get_request_user())
+        self.assertEqual(self.get_countries(self.get_request_user()), {'Germany'})
+
+    def test_invalidate_every_user(self):
+        self.assertEqual(self.get_countries(self.get_request_user()), {'France'})
+        self.set_last_name('Germany')
+        invalidate_rule_queries()
+        self.assertEqual(self.get_countries(self.get_request_user()), {'Germany'})
+
+    def test_update_mutation_invalidates(self):
+        user = self.get_request_user()
+        self.assertEqual(self.get_countries(user), {'France'})
+
+        request = RequestFactory().post('/graphql')
+        request.user = user
+        mutation = UserMutationFactory.get_update_mutation()
+        payload = mutation.update(None, types.SimpleNamespace(context=request), id=user.pk, last_name='Germany')
+        self.assertIsNone(payload.errors)
+
+        # The next requests of the user build the query again
+        self.assertEqual(self.get_countries(self.get_request_user()), {'Germany'})
+
+
+class SharedPossiblePermissionsTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+
+    def setUp(self):
+        previous = set_permissions({get_model_permission(Customers, VIEW): STAFF_RULE})
+        self.addCleanup(set_permissions, previous)
+        patcher = mock.patch.object(possible_permissions_cache, 'timeout', 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(invalidate_rule_queries)
+
+    def is_possible(self):
+        """Result for the user object of a new request"""
+        user = get_user_model().objects.get(pk=self.user.pk)
+        return is_possible_for(user, get_model_permission(Customers, VIEW))
+
+    def test_invalidate(self):
+        self.assertFalse(self.is_possible())
+        get_user_model().objects.filter(pk=self.user.pk).update(is_staff=True)
+        # The result of the previous request is shared
+        self.assertFalse(self.is_possible())
+
+        invalidate_rule_queries(self.user)
+        self.assertTrue(self.is_possible())
+
+    def test_invalidate_every_user(self):
+        self.assertFalse(self.is_possible())
+        get_user_model().objects.filter(pk=self.user.pk).update(is_staff=True)
+        invalidate_rule_queries()
+        self.assertTrue(self.is_possible())
+
+    def test_results_are_kept_per_user(self):
+        other_user = get_user_model().objects.create(username='other user', is_staff=True)
+        self.assertFalse(self.is_possible())
+        self.assertTrue(is_possible_for(other_user, get_model_permission(Customers, VIEW)))
+
+        invalidate_rule_queries(other_user)
+        get_user_model().objects.filter(pk=self.user.pk).update(is_staff=True)
+        # Only the results of the invalidated user are dropped
+        self.assertFalse(self.is_possible())
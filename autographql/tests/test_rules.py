@@ -0,0 +1,67 @@
+from bridgekeeper.rules import Attribute, always_allow, always_deny
+from django.contrib.auth import get_user_model
+
+from autographql.auth.rules import ManyRelation, Relation, get_accessor_name
+from autographql.tests.models import Customers, Employees, Orders, Territories
+from autographql.tests.utils import NorthwindTestCase
+
+
+class ManyRelationTestCase(NorthwindTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(username='user')
+        # The fixture has no territories of employees, each employee gets the territories of a region
+        employees = Employees.objects.order_by('pk')
+        for index, employee in enumerate(employees):
+            employee.territories.set(Territories.objects.filter(region_id=index % 4 + 1))
+
+    def get_allowed(self, rule, queryset):
+        """Pks of the rows the rule allows, checked on the rows of the queryset"""
+        return {instance.pk for instance in queryset if rule.check(self.user, instance)}
+
+    def assertSameRows(self, model, rule, expected=None):
+        queryset = model.objects.order_by('pk')
+        # One exists query per instance
+        checked = self.get_allowed(rule, queryset.all())
+        # The related rows are prefetched and checked in python
+        prefetched = self.get_allowed(rule, queryset.prefetch_related(get_accessor_name(model, rule.query_attr)))
+        annotated = self.get_allowed(rule, rule.annotate(self.user, queryset.all()))
+
+        self.assertEqual(annotated, checked)
+        self.assertEqual(prefetched, checked)
+        if expected is not None:
+            self.assertEqual(checked, expected)
+        return checked
+
+    def test_reverse_foreign_key(self):
+        rule = ManyRelation('orders', Attribute('ship_via_id', 3))
+        expected = set(Orders.objects.filter(ship_via_id=3).values_list('customer', flat=True))
+        allowed = self.assertSameRows(Customers, rule, expected)
+        # Some customers are left out
+        self.assertLess(len(allowed), Customers.objects.count())
+        # Every row is answered by the query that loads it
+        with self.assertNumQueries(1):
+            self.get_allowed(rule, rule.annotate(self.user, Customers.objects.all()))
+
+    def test_many_to_many(self):
+        rule = ManyRelation('territories', Relation('region_id', Attribute('region_description', 'Eastern')))
+        expected = set(Employees.objects.filter(rule.query(self.user)).values_list('pk', flat=True))
+        allowed = self.assertSameRows(Employees, rule, expected)
+        self.assertTrue(allowed)
+        self.assertLess(len(allowed), Employees.objects.count())
+
+    def test_many_to_many_through(self):
+        rule = ManyRelation('order_details', Attribute('discontinued', 1))
+        expected = set(Orders.objects.filter(rule.query(self.user)).values_list('pk', flat=True))
+        allowed = self.assertSameRows(Orders, rule, expected)
+        self.assertTrue(allowed)
+        self.assertLess(len(allowed), Orders.objects.count())
+
+    def test_blanket_rules(self):
+        self.assertSameRows(Customers, ManyRelation('orders', always_deny), set())
+        self.assertSameRows(Customers, ManyRelation('orders', always_allow))
+        # Neither rule needs an annotation
+        queryset = Customers.objects.all()
+        for rule in (ManyRelation('orders', always_deny), ManyRelation('orders', always_allow)):
+            self.assertIs(rule.annotate(self.user, queryset), queryset)
@@ -0,0 +1,83 @@
+import json
+import os
+
+from bridgekeeper import perms
+from bridgekeeper.rules import always_allow
+from django.apps import apps
+from django.core import serializers
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from autographql.auth.middleware import AuthorizationMiddleware
+from autographql.auth.utils import VIEW, CREATE, UPDATE, DELETE, get_model_permission
+from autographql.schema import SchemaGenerator
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'northwind.json')
+# App label of the models in the fixture
+FIXTURE_APP_LABEL = 'demo'
+TEST_APP_LABEL = 'autographql_tests'
+
+
+def load_northwind():
+    """Loads the fixture into the database, it was written for an app labeled demo"""
+    with open(FIXTURE) as f:
+        objects = json.load(f)
+    for obj in objects:
+        obj['model'] = obj['model'].replace(FIXTURE_APP_LABEL + '.', TEST_APP_LABEL + '.', 1)
+    # Rows refer to rows further down the fixture, foreign keys are checked at commit
+    with transaction.atomic(), connection.constraint_checks_disabled():
+        for obj in serializers.deserialize('python', objects):
+            obj.save()
+
+
+def set_permissions(permissions):
+    """
+    Sets rules in the bridgekeeper registry, which refuses to replace them.
+    Returns the previous rules so that they can be restored
+    """
+    previous = {permission: perms.get(permission) for permission in permissions}
+    for permission, rule in permissions.items():
+        if rule is None:
+            dict.pop(perms, permission, None)
+        else:
+            dict.__setitem__(perms, permission, rule)
+    return previous
+
+
+def execute(query, user, variables=None, schema=None, middleware=None):
+    """Executes the query for the user, on the generated schema with the authorization middleware by default"""
+    request = RequestFactory().post('/graphql')
+    request.user = user
+    return (schema or SchemaGenerator.get_schema()).execute(
+        query,
+        context_value=request,
+        variable_values=variables,
+        middleware=middleware if middleware is not None else [AuthorizationMiddleware()],
+    )
+
+
+class NorthwindTestCase(TestCase):
+    """Test case with the northwind rows loaded, every user can do anything unless a test sets other rules"""
+    @classmethod
+    def setUpClass(cls):
+        permissions = {}
+        for model in apps.get_app_config(TEST_APP_LABEL).get_models():
+            for permission_type in (VIEW, CREATE, UPDATE, DELETE):
+                permissions[get_model_permission(model, permission_type)] = always_allow
+        cls.previous_permissions = set_permissions(permissions)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        set_permissions(cls.previous_permissions)
+
+    @classmethod
+    def setUpTestData(cls):
+        load_northwind()
+
+    def set_view_rule(self, model, rule):
+        """Replaces the view rule of the model until the end of the test"""
+        previous = set_permissions({get_model_permission(model, VIEW): rule})
+        self.addCleanup(set_permissions, previous)
@@ -9,16 +9,43 @@ from graphene_django.types import ErrorType as _ErrorType, DjangoObjectTypeOptio
 
 from graphene_django.filter.utils import get_filtering_args_from_filterset
 
-from autographql.filters.types import ModelAutoFilterInputObjectType
+from autographql.auth.annotations import PERMISSION_FIELDS, get_permission_resolver
+from autographql.filters.types import ModelAutoFilterInputObjectType, ModelAutoRelationFilterInputObjectType
 from autographql.optimizer import query
-from autographql.orderby.types import ModelAutoOrderByInputObjectType
+from autographql.orderby.types import ModelAutoOrderByInputObjectType, ModelAutoAggregateOrderByInputObjectType
+from autographql.pagination import get_total_count
+from autographql.settings import autographql_settings
 
 
 class ErrorType(_ErrorType):
     errors = graphene.List(lambda: ErrorType)
 
 
+class AutoConnection(graphene.relay.Connection):
+    """
+    Connection with a totalCount field, the rows are only counted when totalCount is selected
+    """
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(root, info):
+        length = getattr(root, 'length', None)
+        if length is None:
+            iterable = getattr(root, 'iterable', None)
+            if iterable is None:
+                return None
+            length = root.length = get_total_count(iterable)
+        return length
+
+
 class AutoDjangoObjectTypeOptions(DjangoObjectTypeOptions):
+    @cached_property
+    def filtering_args(self):
+        """Arguments of the filterset class, they are the same for every request"""
+        return get_filtering_args_from_filterset(self.filterset_class, self.class_type)
+
     @cached_property
     def filter_input_type(self):
         return type(self.model.__name__ + 'FilterInput', (ModelAutoFilterInputObjectType,), {
@@ -28,6 +55,15 @@ class AutoDjangoObjectTypeOptions(DjangoObjectTypeOptions):
             },
         })
 
+    @cached_property
+    def relation_filter_input_type(self):
+        return type(self.model.__name__ + 'RelationFilterInput', (ModelAutoRelationFilterInputObjectType,), {
+            'Meta': {
+                'model': self.model,
+                'fields': self.fields,
+            },
+        })
+
     @cached_property
     def orderby_input_type(self):
         return type(self.model.__name__ + 'OrderByInput', (ModelAutoOrderByInputObjectType,), {
@@ -37,6 +73,15 @@ class AutoDjangoObjectTypeOptions(DjangoObjectTypeOptions):
             },
         })
 
+    @cached_property
+    def aggregate_orderby_input_type(self):
+        return type(self.model.__name__ + 'AggregateOrderByInput', (ModelAutoAggregateOrderByInputObjectType,), {
+            'Meta': {
+                'model': self.model,
+                'fields': self.fields,
+            },
+        })
+
 
 class AutoDjangoObjectType(DjangoObjectType):
     """
@@ -48,17 +93,31 @@ class AutoDjangoObjectType(DjangoObjectType):
     @classmethod
     def __init_subclass_with_meta__(
             cls,
+            permission_fields=None,
             _meta=None,
             **options
     ):
         if not _meta:
             _meta = AutoDjangoObjectTypeOptions(cls)
 
+        options.setdefault('connection_class', AutoConnection)
+
         super().__init_subclass_with_meta__(
             _meta=_meta,
             **options
         )
 
+        if permission_fields is None:
+            permission_fields = autographql_settings.PERMISSION_FIELDS
+        if permission_fields:
+            # canView, canUpdate and canDelete, computed in the query of the rows by the optimizer
+            for name, permission_type in PERMISSION_FIELDS.items():
+                if name not in cls._meta.fields:
+                    cls._meta.fields[name] = graphene.Field(
+                        graphene.Boolean,
+                        resolver=get_permission_resolver(permission_type),
+                    )
+
     @classmethod
     def get_optimized_queryset(cls, info, args=OrderedDict()):
         queryset = cls._meta.model.objects
@@ -81,7 +140,7 @@ class AutoDjangoObjectType(DjangoObjectType):
         # Apply filterset class if it exists
         filterset_class = cls._meta.filterset_class
         if filterset_class:
-            filtering_args = get_filtering_args_from_filterset(filterset_class, cls)
+            filtering_args = cls._meta.filtering_args
             filter_kwargs = {k: v for k, v in args.items() if k in filtering_args}
             if len(filter_kwargs) > 0:
                 queryset = filterset_class(
@@ -101,10 +160,14 @@ class AutoDjangoObjectType(DjangoObjectType):
         if 'order_by' in args and args['order_by']:
             order_by_input = args['order_by']
             order_by = []
+            # Aggregates of to many relations to order by
+            annotations = {}
             for obi in order_by_input:
-                ob = obi.get_order_by(context=info.context)
+                ob = obi.get_order_by(context=info.context, annotations=annotations)
                 if ob:
                     order_by.append(ob)
+            if annotations:
+                queryset = queryset.annotate(**annotations)
             if order_by:
                 queryset = queryset.order_by(*order_by)
 
@@ -1,23 +1,116 @@
+import json
 import traceback
 
 from django.conf import settings
 from graphene_django.views import GraphQLView
+from graphql import ExecutionResult, validate_schema, GraphQLError
+
+from autographql.auth.middleware import get_permission_cache
+from autographql.instrumentation import QueryCollector, InstrumentationMiddleware, set_query_collector, \
+    log_report
+from autographql.persisted_queries import get_persisted_query_hash, get_persisted_query_store, get_query_hash, \
+    persisted_query_not_found, use_persisted_query, PERSISTED_QUERY_HASH_MISMATCH
+from autographql.settings import autographql_settings
 
 
 class OptimizedGraphQLView(GraphQLView):
-    def execute_graphql_request(self, *args, **kwargs):
+    def get_response(self, request, data, show_graphiql=False):
+        """Attributes the sql queries of the request to the fields that triggered them when instrumentation is on"""
+        instrumentation = autographql_settings.INSTRUMENTATION
+        if not instrumentation:
+            return super().get_response(request, data, show_graphiql)
+
+        collector = QueryCollector()
+        set_query_collector(self.get_context(request), collector)
+        try:
+            with collector.collect():
+                result, status_code = super().get_response(request, data, show_graphiql)
+        finally:
+            set_query_collector(self.get_context(request), None)
+
+        report = collector.get_report()
+        permission_cache = get_permission_cache(self.get_context(request), create=False)
+        if permission_cache is not None:
+            report['permissions'] = permission_cache.info()
+
+        if instrumentation == 'log':
+            log_report(report, self.get_graphql_params(request, data)[2])
+        elif result is not None:
+            response = json.loads(result)
+            response.setdefault('extensions', {})['sql'] = report
+            result = self.json_encode(request, response, pretty=show_graphiql)
+
+        return result, status_code
+
+    def get_middleware(self, request):
+        middleware = super().get_middleware(request)
+        if autographql_settings.INSTRUMENTATION:
+            # Last middleware is the outermost one, the field path is set before any other middleware runs
+            middleware = list(middleware or []) + [InstrumentationMiddleware()]
+        return middleware
+
+    def execute_graphql_request(self, request, data, query, *args, **kwargs):
         """
         By default, graphene will eat any exceptions that occur
         Extract any exceptions and echo them to console
         """
-        result = super().execute_graphql_request(*args, **kwargs)
+        query_hash = None
+        if autographql_settings.PERSISTED_QUERIES:
+            query_hash = get_persisted_query_hash(request.GET.get('extensions') or data.get('extensions'))
+
+        if query_hash:
+            result = self.execute_persisted_query(request, data, query_hash, query, *args, **kwargs)
+        else:
+            result = super().execute_graphql_request(request, data, query, *args, **kwargs)
+
         if result and result.errors:
             for error in result.errors:
                 try:
-                    if hasattr(error, 'original_error'):
+                    if getattr(error, 'original_error', None):
                         raise error.original_error
                 except Exception as e:
                     if settings.DEBUG:
                         traceback.print_exc()
 
         return result
+
+    def get_persisted_query_store(self):
+        """Parsed and validated documents, shared by the views of the same schema"""
+        return get_persisted_query_store(self.schema.graphql_schema, self.validation_rules)
+
+    def execute_persisted_query(self, request, data, query_hash, query, variables, operation_name,
+                                show_graphiql=False):
+        """
+        Executes a persisted query, the document is only parsed and validated
+        the first time the hash is seen so clients only need to send the hash
+        """
+        persisted_queries = self.get_persisted_query_store()
+        persisted_queries.load_manifest()
+
+        persisted_query = persisted_queries.get(query_hash)
+        if persisted_query is None:
+            if not query or autographql_settings.PERSISTED_QUERIES_REJECT_UNKNOWN:
+                return ExecutionResult(errors=[persisted_query_not_found()])
+
+            if get_query_hash(query) != query_hash:
+                return ExecutionResult(errors=[GraphQLError(PERSISTED_QUERY_HASH_MISMATCH)])
+
+            schema_validation_errors = validate_schema(self.schema.graphql_schema)
+            if schema_validation_errors:
+                return ExecutionResult(data=None, errors=schema_validation_errors)
+
+            try:
+                persisted_query = persisted_queries.register(query)
+            except Exception as e:
+                return ExecutionResult(errors=[e])
+
+        # Executed by graphene-django, with the stored document and validation errors
+        with use_persisted_query(persisted_query):
+            return super().execute_graphql_request(
+                request,
+                data,
+                persisted_query.query,
+                variables,
+                operation_name,
+                show_graphiql,
+            )
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""Runs the tests of autographql against an in memory sqlite database"""
+import sys
+
+import django
+from django.conf import settings
+from django.test.utils import get_runner
+
+if __name__ == '__main__':
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'graphene_django',
+            'bridgekeeper',
+            'autographql',
+        ],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        AUTHENTICATION_BACKENDS=[
+            'bridgekeeper.backends.RulePermissionBackend',
+            'django.contrib.auth.backends.ModelBackend',
+        ],
+        GRAPHENE={'SCHEMA': 'autographql.schema.schema'},
+        SECRET_KEY='autographql-tests',
+        USE_TZ=True,
+        DEFAULT_AUTO_FIELD='django.db.models.AutoField',
+    )
+    django.setup()
+    TestRunner = get_runner(settings)
+    failures = TestRunner().run_tests(sys.argv[1:] or ['autographql.tests'])
+    sys.exit(bool(failures))